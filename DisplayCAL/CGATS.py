@@ -8,12 +8,61 @@ Copyright (C) 2008 Florian Hoech
 
 
 import math, os, re, sys
+from functools import cmp_to_key
 
 import colormath
 from log import safe_print
 from options import debug, verbose
 from util_io import GzipFileProper, StringIOu as StringIO
 from util_str import safe_unicode
+from ordereddict import OrderedDict
+
+
+_control_chars_re = re.compile('[^\x09\x20-\x7E\x80-\xFF]')
+_control_chars_multiline_re = re.compile('[^\x09\x0A\x20-\x7E\x80-\xFF]')
+_number_re = re.compile('(?:\d+|((?:\d*\.\d+|\d+)(?:e[+-]?\d+)?))$')
+
+
+def _sample_id_value(name, value, key, number_of_sets):
+	""" Return the INDEX / SAMPLE_ID value of the sample at index key. """
+	if type(value) not in (int, float):
+		return value
+	if name.upper() == 'INDEX':
+		return key
+	if type(value) == float:
+		return 1.0 / (number_of_sets - 1) * key
+	return key + 1
+
+
+def _hashable(value):
+	""" Return a hashable key which compares equal where value does. """
+	if isinstance(value, dict):
+		return frozenset((key, _hashable(item)) for key, item in
+						 list(value.items()))
+	elif isinstance(value, list):
+		return (list, tuple(_hashable(item) for item in value))
+	elif isinstance(value, tuple):
+		return tuple(_hashable(item) for item in value)
+	return value
+
+
+def _query_seen_add(seen, unhashable, value):
+	"""
+	Add value to the values seen by a query.
+	
+	Return True if an equal value was seen before.
+	
+	"""
+	try:
+		key = _hashable(value)
+		if key in seen:
+			return True
+		seen.add(key)
+	except TypeError:
+		if value in unhashable:
+			return True
+		unhashable.append(value)
+	return False
 
 
 def get_device_value_labels(color_rep=None):
@@ -219,8 +268,12 @@ class CGATS(dict):
 	fileName = property(lambda self: self.filename,
 						lambda self, filename: setattr(self, "filename", filename))
 	key = None
+	_columns = None  # Columnar DATA (field name -> array or list)
+	_generation = 0  # Incremented on every change below root
+	_index = None  # Sample lookup tables of DATA, see _query_samples
 	_lvl = 0
 	_modified = False
+	_nrows = 0
 	mtime = None
 	parent = None
 	root = None
@@ -273,12 +326,15 @@ class CGATS(dict):
 
 			context = self
 
-			for raw_line in raw_lines:
+			index = 0
+			numlines = len(raw_lines)
+			while index < numlines:
+				raw_line = raw_lines[index]
+				index += 1
 				# Replace 1.#IND00 with NaN
 				raw_line = raw_line.replace("1.#IND00", "NaN")
 				# strip control chars and leading/trailing whitespace
-				line = re.sub('[^\x09\x20-\x7E\x80-\xFF]', '', 
-								raw_line.strip())
+				line = _control_chars_re.sub('', raw_line.strip())
 				if '#' in line or '"' in line:
 					# Deal with comments and quotes
 					quoted = False
@@ -338,6 +394,13 @@ class CGATS(dict):
 					context['DATA'].root = self
 					context['DATA'].type = 'DATA'
 					context = context['DATA']
+					# Fast path: Parse the whole block in one go
+					for end in range(index, numlines):
+						if raw_lines[end].strip() == 'END_DATA':
+							if context.set_columns(raw_lines[index:end]):
+								index = end + 1
+								context = context.parent
+							break
 				elif line == 'END_DATA':
 					context = context.parent
 				elif line[:6] == 'BEGIN_':
@@ -389,7 +452,14 @@ class CGATS(dict):
 		del self[name]
 		self.setmodified()
 	
+	def __contains__(self, name):
+		if self._columns is not None:
+			return type(name) == int and 0 <= name < self._nrows
+		return dict.__contains__(self, name)
+
 	def __delitem__(self, name):
+		if self._columns is not None:
+			self._materialize()
 		if (self.type not in ('DATA', 'DATA_FORMAT', 'KEYWORDS', 'SECTION') and
 			name in self._keys):
 			self._keys.remove(name)
@@ -409,17 +479,58 @@ class CGATS(dict):
 			return getattr(self, name)
 		elif name in self:
 			if str(name).upper() in ('INDEX', 'SAMPLE_ID', 'SAMPLEID'):
-				if type(self.get(name)) not in (int, float):
-					return self.get(name)
-				if str(name).upper() == 'INDEX':
-					return self.key
-				if type(self.get(name)) == float:
-					return 1.0 / (self.NUMBER_OF_SETS - 1) * self.key
-				return self.key + 1
+				return _sample_id_value(name, self.get(name), self.key,
+										self.NUMBER_OF_SETS)
 			return self.get(name)
 		raise CGATSKeyError(name)
+
+	def __eq__(self, other):
+		if self is other:
+			return True
+		if isinstance(other, dict) and (self._columns is not None or
+										getattr(other, '_columns',
+												None) is not None):
+			if len(self) != len(other):
+				return False
+			self._materialize()
+			if isinstance(other, CGATS):
+				other._materialize()
+		return dict.__eq__(self, other)
+
+	def __iter__(self):
+		if self._columns is not None:
+			return iter(range(self._nrows))
+		return dict.__iter__(self)
+
+	def __len__(self):
+		if self._columns is not None:
+			return self._nrows
+		return dict.__len__(self)
+
+	def items(self):
+		if self._columns is not None:
+			self._materialize()
+		return dict.items(self)
+
+	def keys(self):
+		if self._columns is not None:
+			return range(self._nrows)
+		return dict.keys(self)
+
+	def values(self):
+		if self._columns is not None:
+			self._materialize()
+		return dict.values(self)
+
+	def __ne__(self, other):
+		result = self.__eq__(other)
+		if result is NotImplemented:
+			return result
+		return not result
 	
 	def get(self, name, default=None):
+		if self._columns is not None and type(name) == int:
+			self._materialize()
 		if name == -1:
 			return dict.get(self, len(self) - 1, default)
 		elif name in ('NUMBER_OF_FIELDS', 'NUMBER_OF_SETS'):
@@ -483,7 +594,8 @@ class CGATS(dict):
 		return desc
 
 	def __setattr__(self, name, value):
-		if name in ('_keys', '_lvl'):
+		if name in ('_columns', '_generation', '_index', '_keys', '_lvl',
+					'_nrows'):
 			object.__setattr__(self, name, value)
 		elif name == 'modified':
 			self.setmodified(value)
@@ -496,6 +608,8 @@ class CGATS(dict):
 			self[name] = value
 	
 	def __setitem__(self, name, value):
+		if self._columns is not None:
+			self._materialize()
 		if (self.type not in ('DATA', 'DATA_FORMAT', 'KEYWORDS', 'SECTION') and
 			not name in self):
 			self._keys.append(name)
@@ -503,9 +617,17 @@ class CGATS(dict):
 		self.setmodified()
 	
 	def setmodified(self, modified=True):
-		""" Set 'modified' state on the 'root' object. """
-		if self.root and self.root._modified != modified:
-			object.__setattr__(self.root, '_modified', modified)
+		"""
+		Set 'modified' state on the 'root' object.
+		
+		This also invalidates the query indexes of the document.
+		
+		"""
+		if self.root:
+			object.__setattr__(self.root, '_generation',
+							   self.root._generation + 1)
+			if self.root._modified != modified:
+				object.__setattr__(self.root, '_modified', modified)
 	
 	def __str__(self):
 		result = []
@@ -574,12 +696,16 @@ class CGATS(dict):
 			result.append('')
 			result.append('NUMBER_OF_SETS %s' % (len(data)))
 			result.append('BEGIN_DATA')
-			for key in data:
-				result.append(' '.join([rpad(data[key][item], 
-											 data.vmaxlen + 
-											 (1 if data[key][item] < 0 else 0)) 
-										for item in 
-										list(data.parent['DATA_FORMAT'].values())]))
+			fields = list(data.parent['DATA_FORMAT'].values())
+			if (data._columns is not None and
+				all(item in data._columns for item in fields)):
+				result.extend(data._format_rows(fields))
+			else:
+				for key in data:
+					result.append(' '.join([rpad(data[key][item], 
+												 data.vmaxlen + 
+												 (1 if data[key][item] < 0 else 0)) 
+											for item in fields]))
 			result.append('END_DATA')
 		if (self.parent and self.parent.type or
 			self.type) == 'ROOT' and result and result[-1] != '' and lvl == 0:
@@ -650,6 +776,13 @@ class CGATS(dict):
 	
 	def get_RGB_XYZ_values(self):
 		field_names = ("RGB_R", "RGB_G", "RGB_B", "XYZ_X", "XYZ_Y", "XYZ_Z")
+		data = self.queryv1("DATA")
+		if (data and data._columns is not None and
+			all(field_name in data._columns for field_name in field_names)):
+			import numpy
+			return data, numpy.column_stack([data._columns[field_name]
+											 for field_name in
+											 field_names]).tolist()
 		data = self.get_data(field_names)
 		if not data:
 			return False, False
@@ -663,6 +796,14 @@ class CGATS(dict):
 	
 	def set_RGB_XYZ_values(self, valueslist):
 		field_names = ("RGB_R", "RGB_G", "RGB_B", "XYZ_X", "XYZ_Y", "XYZ_Z")
+		if (self._columns is not None and len(valueslist) == self._nrows and
+			all(field_name in self._columns for field_name in field_names)):
+			import numpy
+			values = numpy.array(valueslist, dtype=numpy.float64)
+			for j, field_name in enumerate(field_names):
+				self._columns[field_name] = values[:, j].copy()
+			self.setmodified()
+			return True
 		for i, values in enumerate(valueslist):
 			for j, field_name in enumerate(field_names):
 				self[i][field_name] = values[j]
@@ -675,9 +816,9 @@ class CGATS(dict):
 			return False
 		numvalues = len(valueslist)
 		if sort1:
-			valueslist.sort(sort1)
+			valueslist.sort(key=cmp_to_key(sort1))
 		if sort2:
-			valueslist.sort(sort2)
+			valueslist.sort(key=cmp_to_key(sort2))
 		gray = []
 		if split_grays:
 			# Split values into gray and color. First gray in a consecutive
@@ -878,7 +1019,9 @@ class CGATS(dict):
 		data, valueslist = self.get_RGB_XYZ_values()
 		if not valueslist:
 			return False
-		valueslist.sort(cmp, key, reverse)
+		if cmp:
+			key = cmp_to_key(cmp)
+		valueslist.sort(key=key, reverse=reverse)
 		return data.set_RGB_XYZ_values(valueslist)
 	
 	@property
@@ -903,7 +1046,204 @@ class CGATS(dict):
 					self[key + inc] = self[key]
 					if key == len(self) - 1:
 						break
-	
+
+	def get_device_values_set(self, fields=("RGB_R", "RGB_G", "RGB_B"),
+							  digits=4):
+		"""
+		Return the set of DATA sample values for fields.
+
+		Each member is a tuple of the sample's values rounded to digits.
+
+		"""
+		if self.type != 'DATA':
+			data = self.queryv1("DATA")
+			if data is None:
+				return set()
+			return data.get_device_values_set(fields, digits)
+		return set(tuple(round(value, digits) for value in values)
+				   for key, values in self._sample_rows(fields))
+
+	def insert_samples(self, samples, key=None, unique_fields=None, digits=4):
+		"""
+		Insert samples into DATA at index key (default: append).
+
+		samples can be CGATS SAMPLE instances (which are moved) or dicts
+		(missing DATA_FORMAT fields are set to 0.0). If unique_fields is
+		given, samples whose values for these fields (rounded to digits)
+		already occur in DATA or earlier in samples are omitted.
+		Return the list of inserted SAMPLE instances.
+
+		"""
+		if self.type != 'DATA':
+			data = self.queryv1("DATA")
+			if data is None:
+				raise CGATSKeyError("DATA")
+			return data.insert_samples(samples, key, unique_fields, digits)
+		if unique_fields:
+			seen = self.get_device_values_set(unique_fields, digits)
+			unique = []
+			for sample in samples:
+				values = tuple(round(sample.get(field, 0.0), digits)
+							   for field in unique_fields)
+				if not values in seen:
+					seen.add(values)
+					unique.append(sample)
+			samples = unique
+		if not samples:
+			return []
+		if key is None or key > len(self):
+			key = len(self)
+		data_format = self.parent['DATA_FORMAT']
+		self._materialize()
+		# Shift following rows (like moveby1, but without setting the
+		# modified state for every moved row)
+		inc = len(samples)
+		for i in range(len(self) - 1, key - 1, -1):
+			dataset = dict.get(self, i)
+			object.__setattr__(dataset, 'key', i + inc)
+			dict.__setitem__(self, i + inc, dataset)
+		inserted = []
+		for i, sample in enumerate(samples):
+			if not isinstance(sample, CGATS):
+				dataset = CGATS()
+				for label in list(data_format.values()):
+					dataset[label] = sample.get(label, 0.0)
+				dataset.type = 'SAMPLE'
+				sample = dataset
+			sample.key = key + i
+			sample.parent = self
+			sample.root = self.root
+			self[sample.key] = sample
+			inserted.append(sample)
+		return inserted
+
+	def _format_rows(self, fields):
+		""" Return the DATA lines formatted straight from the columns. """
+		columns = []
+		for item in fields:
+			values = self._columns[item]
+			if item.upper() in ('INDEX', 'SAMPLE_ID', 'SAMPLEID'):
+				# SAMPLE rows don't hold DATA, so their NUMBER_OF_SETS is 0
+				values = [_sample_id_value(item, value, key, 0)
+						  for key, value in enumerate(values)]
+			elif not isinstance(values, list):
+				values = values.tolist()
+			columns.append([rpad(value, self.vmaxlen +
+									(1 if isinstance(value, (int, float)) and
+										  value < 0 else 0))
+							for value in values])
+		return [' '.join(row) for row in zip(*columns)]
+
+	def _materialize(self):
+		""" Turn columnar DATA into SAMPLE rows. """
+		columns = self._columns
+		if columns is None:
+			return
+		modified = self.modified
+		generation = self.root._generation
+		object.__setattr__(self, '_columns', None)
+		object.__setattr__(self, '_nrows', 0)
+		items = list(columns.keys())
+		values = [column if isinstance(column, list) else column.tolist()
+				  for column in list(columns.values())]
+		for key, row in enumerate(zip(*values)):
+			dataset = CGATS()
+			dict.update(dataset, list(zip(items, row)))
+			dataset._keys = list(items)
+			dataset.key = key
+			dataset.parent = self
+			dataset.root = self.root
+			dataset.type = 'SAMPLE'
+			dict.__setitem__(self, key, dataset)
+		self.setmodified(modified)
+		# Contents didn't change, so indexes stay valid
+		object.__setattr__(self.root, '_generation', generation)
+
+	def set_columns(self, lines):
+		"""
+		Parse the lines of a DATA block into columns.
+		
+		Numeric fields are held as NumPy arrays until rows are accessed.
+		Return False if the block needs to be parsed line by line (quoted
+		values, comments, irregular rows or NumPy not being available).
+		
+		"""
+		if self.type != 'DATA' or dict.__len__(self):
+			return False
+		fields = self.parent.get('DATA_FORMAT')
+		if not fields:
+			return False
+		block = '\n'.join(lines)
+		if ('"' in block or '#' in block or 'BEGIN_' in block or
+			'END_' in block):
+			return False
+		try:
+			import numpy
+		except ImportError:
+			return False
+		block = _control_chars_multiline_re.sub('',
+												block.replace("1.#IND00",
+															  "NaN"))
+		fields = list(fields.values())
+		rows = [values for values in (line.split() for line in
+									  block.split('\n')) if values]
+		if not rows or any(len(values) != len(fields) for values in rows):
+			return False
+		table = numpy.array(rows)
+		columns = OrderedDict()
+		vmaxlen = self.vmaxlen
+		for i, item in enumerate(fields):
+			column = table[:, i]
+			if item.upper() in ('INDEX', 'SAMPLE_ID', 'SAMPLEID'):
+				if self.root.normalize_fields and item.upper() == 'SAMPLEID':
+					item = 'SAMPLE_ID'
+				# allow alphanumeric INDEX / SAMPLE_ID
+				values = []
+				for value in column.tolist():
+					match = _number_re.match(value)
+					if match:
+						if match.groups()[0]:
+							value = float(value)
+						else:
+							value = int(value)
+					values.append(value)
+				column = values
+			elif item.upper() not in ('SAMPLE_NAME', 'SAMPLE_LOC',
+									  'SAMPLENAME'):
+				try:
+					column = column.astype(numpy.float64)
+				except ValueError:
+					return False
+				if (self.parent.type != "CAL" and
+					item.startswith("RGB_") or
+					item.startswith("CMYK_")):
+					# Assuming 0..100, 4 decimal digits is enough for
+					# roughly 19 bits integer device values. Only values
+					# that aren't already at that precision need the exact
+					# (string based) check.
+					for j in numpy.flatnonzero(column.round(4) !=
+											   column).tolist():
+						value = column[j].item()
+						parts = str(abs(value)).split(".")
+						if len(parts) == 2 and len(parts[-1]) > 4:
+							column[j] = round(value, 4)
+				for value in numpy.unique(numpy.abs(column)).tolist():
+					parts = str(value).split("e")
+					lencheck = len(parts[0])
+					if len(parts) > 1:
+						lencheck += abs(int(parts[1]))
+					if lencheck > vmaxlen:
+						vmaxlen = lencheck
+			else:
+				if self.root.normalize_fields and item.upper() == 'SAMPLENAME':
+					item = 'SAMPLE_NAME'
+				column = column.tolist()
+			columns[item] = column
+		self._columns = columns
+		self._nrows = len(rows)
+		self.vmaxlen = vmaxlen
+		return True
+
 	def add_data(self, data, key=None):
 		"""
 		Add data to the CGATS structure.
@@ -1435,6 +1775,9 @@ Transform {
 		children = []
 		sqrt3_100 = math.sqrt(3) * 100
 		sqrt3_50 = math.sqrt(3) * 50
+		Lab2RGB = colormath.ColorSpaceTransform(pcs="Lab", inverse=True,
+												scale=.7,
+												noadapt=not normalize_RGB_white)
 		for entry in data.values():
 			X, Y, Z = colormath.adapt(entry["XYZ_X"],
 									  entry["XYZ_Y"],
@@ -1523,14 +1866,11 @@ Transform {
 			if RGB_black_offset != 40:
 				# Keep reference hue and saturation
 				# Lab to sRGB using reference black offset of 40 like Argyll CMS
-				R, G, B = colormath.Lab2RGB(L * (100.0 - 40.0) / 100.0 + 40.0,
-											a, b, scale=.7,
-											noadapt=not normalize_RGB_white)
+				R, G, B = Lab2RGB(L * (100.0 - 40.0) / 100.0 + 40.0, a, b)
 				H_ref, S_ref, V_ref = colormath.RGB2HSV(R, G, B)
 			# Lab to sRGB using actual black offset
-			R, G, B = colormath.Lab2RGB(L * (100.0 - RGB_black_offset) / 100.0 +
-										RGB_black_offset, a, b, scale=.7,
-										noadapt=not normalize_RGB_white)
+			R, G, B = Lab2RGB(L * (100.0 - RGB_black_offset) / 100.0 +
+							  RGB_black_offset, a, b)
 			if RGB_black_offset != 40:
 				H, S, V = colormath.RGB2HSV(R, G, B)
 				# Use reference H and S to go back to RGB
@@ -1605,7 +1945,17 @@ Transform {
 			if type(query) not in (list, tuple):
 				query = (query, )
 		
+		if (self.type == 'DATA' and query and
+			all(isinstance(query_key, str) for query_key in query)):
+			# Only samples can match, look them up in the index
+			keys = self._query_samples(query, query_value)
+			if keys is not None:
+				return self._query_result(keys, query, get_value, get_first,
+										  modified)
+		
 		items = [self] + [self[key] for key in self]
+		seen = set()  # Hashable keys of result values
+		unhashable = []  # Result values which can't be hashed
 		for item in items:
 			if isinstance(item, (dict, list, tuple)):
 			
@@ -1662,14 +2012,119 @@ Transform {
 							result = result_n
 							break
 						elif len(result_n):
+							# Keep track of result values in a set instead of
+							# comparing against all of them
+							for i in range(len(seen) + len(unhashable),
+										   len(result)):
+								_query_seen_add(seen, unhashable,
+												dict.get(result, i))
 							for i in result_n:
-								n = len(result)
-								if result_n[i] not in list(result.values()):
-									result[n] = result_n[i]
+								value = result_n[i]
+								if not _query_seen_add(seen, unhashable,
+													   value):
+									result[len(result)] = value
 		
-		if isinstance(result, CGATS):
+		if isinstance(result, CGATS) and result.root is result:
 			result.setmodified(modified)
 		return result
+
+	def _query_result(self, keys, query, get_value, get_first, modified):
+		""" Return query result for the samples at keys of DATA. """
+		if get_first:
+			result = None
+			keys = keys[:1]
+		else:
+			result = CGATS()
+		for key in keys:
+			if get_value:
+				result_n = CGATS()
+				for query_key in query:
+					result_n[len(result_n)] = self._sample_value(key,
+																 query_key)
+				if len(result_n) == 1:
+					result_n = result_n[0]
+			else:
+				result_n = self[key]
+			if get_first:
+				result = result_n
+			else:
+				result[len(result)] = result_n
+		if isinstance(result, CGATS) and result.root is result:
+			result.setmodified(modified)
+		return result
+
+	def _query_samples(self, query, query_value):
+		"""
+		Return keys of DATA samples matching query, in iteration order.
+		
+		Uses a hash table per combination of queried fields, which is kept
+		until the document changes. Return None if the query values can't
+		be hashed.
+		
+		"""
+		fields = tuple(query)
+		values = []
+		valued = []
+		for i, query_key in enumerate(fields):
+			if query_value is None and isinstance(query, dict):
+				current_query_value = query[query_key]
+			else:
+				current_query_value = query_value
+			if current_query_value != None:
+				values.append(current_query_value)
+				valued.append(i)
+		if not self._index or self._index[0] != self.root._generation:
+			self._index = (self.root._generation, {})
+		index = self._index[1]
+		table = index.get((fields, tuple(valued)))
+		if table is None:
+			table = index[(fields, tuple(valued))] = {}
+			for key, row in self._sample_rows(fields):
+				table.setdefault(tuple(row[i] for i in valued), []).append(key)
+		try:
+			return table.get(tuple(values), [])
+		except TypeError:
+			return None
+
+	def _sample_rows(self, fields):
+		"""
+		Yield (key, values) for each DATA sample having all fields.
+		
+		Values are what sample[field] would return.
+		
+		"""
+		if self._columns is not None:
+			if not all(field in self._columns for field in fields):
+				return
+			columns = []
+			for field in fields:
+				values = self._columns[field]
+				if field.upper() in ('INDEX', 'SAMPLE_ID', 'SAMPLEID'):
+					values = [_sample_id_value(field, value, key, 0)
+							  for key, value in enumerate(values)]
+				elif not isinstance(values, list):
+					values = values.tolist()
+				columns.append(values)
+			for key, row in enumerate(zip(*columns)):
+				yield key, row
+			return
+		for key in self:
+			sample = dict.get(self, key)
+			if (isinstance(sample, dict) and
+				all(field in sample for field in fields)):
+				yield key, tuple(sample[field] for field in fields)
+
+	def _sample_value(self, key, field):
+		""" Return sample[field] for the DATA sample at key. """
+		if self._columns is None:
+			return self[key][field]
+		value = self._columns[field][key]
+		if field.upper() in ('INDEX', 'SAMPLE_ID', 'SAMPLEID'):
+			# SAMPLE rows don't hold DATA, so their NUMBER_OF_SETS is 0
+			return _sample_id_value(field, value, key, 0)
+		if not isinstance(value, str):
+			value = value.item()
+		return value
 	
 	def queryi(self, query, query_value=None):
 		""" Query and return matching items. See also query method. """
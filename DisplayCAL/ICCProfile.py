@@ -7,16 +7,22 @@ import atexit
 import binascii
 import ctypes
 import datetime
+import json
 import locale
 import math
+import mmap
 import os
 import re
+import shutil
 import struct
 import sys
+import tempfile
+import threading
 import warnings
 import zlib
 
-from time import localtime, mktime, strftime
+from array import array
+from time import localtime, mktime, strftime, time
 from collections import UserString
 from weakref import WeakValueDictionary
 if sys.platform == "win32":
@@ -47,8 +53,9 @@ import colormath
 import edid
 import imfile
 from colormath import NumberTuple
-from defaultpaths import iccprofiles, iccprofiles_home
+from defaultpaths import cache, iccprofiles, iccprofiles_home
 from encoding import get_encodings
+from meta import name as appname
 from options import test_input_curve_clipping
 from ordereddict import OrderedDict
 try:
@@ -2472,90 +2479,100 @@ def _mp_hdr_tonemap(HDR_XYZ, thread_abort_event, progress_queue, rgb_space,
 	
 	This should be spawned as a multiprocessing process
 	
+	Out of gamut colors are desaturated in ICtCp by 1% per iteration until
+	they fit. All colors of the slice are iterated at once (colormath.batch).
+	
 	"""
-	prevperc = 0
-	amount = len(HDR_XYZ)
-	dI = 0
-	dI_max = 0
-	dC = 0
-	dC_max = 0
-	I_reduced_count = 0
-	its_hi = 0  # Highest number pf iterations seen per color
+	import numpy
+	batch = colormath.batch
+	# Collect the XYZ lists to tonemap (they are changed in-place)
+	XYZ_lists = []
 	for i, (RGB_in, ICtCp_XYZ, RGB_ICtCp_XYZ) in enumerate(HDR_XYZ):
+		if sat == 1 or ICtCp_XYZ == RGB_ICtCp_XYZ:
+			# Set ICtCp_XYZ to the same object as RGB_ICtCp_XYZ so that
+			# both will point to the same changed data
+			HDR_XYZ[i] = (RGB_in, RGB_ICtCp_XYZ, RGB_ICtCp_XYZ)
+			XYZ_tonemap = (RGB_ICtCp_XYZ, )
+		else:
+			XYZ_tonemap = (ICtCp_XYZ, RGB_ICtCp_XYZ)
+		if not all(v == RGB_in[0] for v in RGB_in):
+			XYZ_lists.extend(XYZ_tonemap)
+	count = len(XYZ_lists)
+	XYZ_in = numpy.array(XYZ_lists, dtype=numpy.float64).reshape((count, 3))
+	XYZ = XYZ_in.copy()
+	ICtCp = numpy.zeros((count, 3))
+	ICtCp_in = numpy.zeros((count, 3))
+	its = numpy.zeros(count, dtype=int)  # Iterations per color
+	reduced = numpy.zeros(count, dtype=bool)  # Desaturated at least once
+	active = numpy.arange(count)
+	prevperc = 0
+	while len(active):
 		if thread_abort_event and thread_abort_event.is_set():
 			return [False]
-		is_neutral = all(v == RGB_in[0] for v in RGB_in)
-		for j, XYZ in enumerate((ICtCp_XYZ, RGB_ICtCp_XYZ)):
-			if j == 0 and (sat == 1 or ICtCp_XYZ == RGB_ICtCp_XYZ):
-				# Set ICtCp_XYZ to the same object as RGB_ICtCp_XYZ which we
-				# are going to change in-place in the next iteration of the loop
-				# so that at the end of this loop, both will point to the same
-				# changed data
-				ICtCp_XYZ = RGB_ICtCp_XYZ
-				continue
-			X, Y, Z = XYZ
-			H = None
-			its = 10000  # Remaining iterations (limit)
-			while not is_neutral and its:
-				X_D50, Y_D50, Z_D50 = colormath.adapt(*(v / maxv for v in (X, Y, Z)),
-													  whitepoint_source=rgb_space[1],
-													  cat=cat)
-				negative_clip = min(X_D50, Y_D50, Z_D50) < 0
-				positive_clip = round(X_D50, 4) > 0.9642 or Y_D50 > 1 or round(Z_D50, 4) > 0.8249
-				if not (negative_clip or positive_clip):
-					break
-				if H is None:
-					# Record hue angle
-					H = colormath.RGB2HSV(*RGB_in)[0]
-					# This is the initial intensity, and hue + saturation
-					I, Ct, Cp = colormath.XYZ2ICtCp(X, Y, Z)
-					Io, Cto, Cpo = I, Ct, Cp
-					Co = colormath.Lab2LCHab(I, Ct, Cp)[1]
-				# Desaturate
-				Ct *= 0.99
-				Cp *= 0.99
-				# Update XYZ
-				X, Y, Z = colormath.ICtCp2XYZ(I, Ct, Cp)
-				if Y > XYZ[1]:
-					# Desaturating CtCp increases Y!
-					# As we desaturate different amounts per color,
-					# restore initial Y if lower than adjusted Y
-					# to keep luminance relation
-					X, Y, Z = (v / Y * XYZ[1] for v in (X, Y, Z))
-					I, Ct, Cp = colormath.XYZ2ICtCp(X, Y, Z)
-				its -= 1
-			if H is not None and round(Io - I, 4):
-				# Intensity was reduced by >= 0.0001, gather statistics
-				C = colormath.Lab2LCHab(I, Ct, Cp)[1]
-				dI += Io - I
-				dI_max = max(dI_max, Io - I)
-				dC += Co - C
-				dC_max = max(dC_max, Co - C)
-				I_reduced_count += 1
-			if not its:
-				# Max iterations exceeded, print diagnostics
-				# XXX: This should not happen (testing OK)
-				oX_D50, oY_D50, oZ_D50 = colormath.adapt(*(v / maxv for v in XYZ),
-														 whitepoint_source=rgb_space[1],
-														 cat=cat)
-				X_D50, Y_D50, Z_D50 = colormath.adapt(*(v / maxv for v in (X, Y, Z)),
-													  whitepoint_source=rgb_space[1],
-													  cat=cat)
-				safe_print("Reached iteration limit, XYZ %.4f %.4f %.4f -> %.4f %.4f %.4f" %
-						   (oX_D50, oY_D50, oZ_D50, X_D50, Y_D50, Z_D50))
-			its_hi = max(its_hi, 10000 - its)
-			XYZ[:] = X, Y, Z
-		HDR_XYZ[i] = (RGB_in, ICtCp_XYZ, RGB_ICtCp_XYZ)
-		perc = round((i + 1.0) / amount * 50)
+		XYZ_D50 = batch.adapt(XYZ[active] / maxv,
+							  whitepoint_source=rgb_space[1], cat=cat)
+		negative_clip = XYZ_D50.min(axis=1) < 0
+		positive_clip = ((numpy.round(XYZ_D50[:, 0], 4) > 0.9642) |
+						 (XYZ_D50[:, 1] > 1) |
+						 (numpy.round(XYZ_D50[:, 2], 4) > 0.8249))
+		# Limit to 10000 iterations per color
+		active = active[(negative_clip | positive_clip) & (its[active] < 10000)]
+		if len(active):
+			first = active[~reduced[active]]
+			if len(first):
+				# This is the initial intensity, and hue + saturation
+				ICtCp[first] = ICtCp_in[first] = batch.XYZ2ICtCp(XYZ[first])
+				reduced[first] = True
+			# Desaturate
+			ICtCp[active, 1:] *= 0.99
+			# Update XYZ
+			XYZ_a = batch.ICtCp2XYZ(ICtCp[active])
+			Y_in = XYZ_in[active, 1]
+			brighter = XYZ_a[:, 1] > Y_in
+			if brighter.any():
+				# Desaturating CtCp increases Y!
+				# As we desaturate different amounts per color,
+				# restore initial Y if lower than adjusted Y
+				# to keep luminance relation
+				XYZ_a[brighter] = (XYZ_a[brighter] /
+								   XYZ_a[brighter, 1:2] *
+								   Y_in[brighter, numpy.newaxis])
+				ICtCp[active[brighter]] = batch.XYZ2ICtCp(XYZ_a[brighter])
+			XYZ[active] = XYZ_a
+			its[active] += 1
+		perc = round((count - len(active)) / float(count) * 50)
 		if progress_queue and perc > prevperc:
 			progress_queue.put(perc - prevperc)
 			prevperc = perc
-	if I_reduced_count:
+	if progress_queue and prevperc < 50:
+		progress_queue.put(50 - prevperc)
+	for k in numpy.flatnonzero(its == 10000):
+		# Max iterations exceeded, print diagnostics
+		# XXX: This should not happen (testing OK)
+		oX_D50, oY_D50, oZ_D50 = colormath.adapt(*(XYZ_in[k] / maxv),
+												 whitepoint_source=rgb_space[1],
+												 cat=cat)
+		X_D50, Y_D50, Z_D50 = colormath.adapt(*(XYZ[k] / maxv),
+											  whitepoint_source=rgb_space[1],
+											  cat=cat)
+		safe_print("Reached iteration limit, XYZ %.4f %.4f %.4f -> %.4f %.4f %.4f" %
+				   (oX_D50, oY_D50, oZ_D50, X_D50, Y_D50, Z_D50))
+	its_hi = its.max() if count else 0  # Highest number of iterations
+	# Intensity was reduced by >= 0.0001, gather statistics
+	dI = ICtCp_in[:, 0] - ICtCp[:, 0]
+	reduced &= numpy.round(dI, 4) != 0
+	if reduced.any():
 		# Intensity was reduced, print informational statistics
+		dI = dI[reduced]
+		dC = (numpy.hypot(ICtCp_in[:, 1], ICtCp_in[:, 2]) -
+			  numpy.hypot(ICtCp[:, 1], ICtCp[:, 2]))[reduced]
 		safe_print("Max iterations %i dI avg %.4f max %.4f dC avg %.4f max %.4f" %
-				   (its_hi, dI / I_reduced_count, dI_max, dC / I_reduced_count, dC_max))
+				   (its_hi, dI.mean(), max(dI.max(), 0), dC.mean(),
+					max(dC.max(), 0)))
 	elif its_hi:
 		safe_print("Max iterations", its_hi)
+	for XYZ_list, values in zip(XYZ_lists, XYZ.tolist()):
+		XYZ_list[:] = values
 	return HDR_XYZ
 
 
@@ -2634,6 +2651,15 @@ def uInt16Number_tohex(num):
 	return struct.pack(">H", int(round(num)))
 
 
+def uInt16Numbers(binaryString):
+	""" Decode a string of big-endian uInt16Numbers to an array('H') """
+	numbers = array("H")
+	numbers.frombytes(binaryString)
+	if sys.byteorder == "little":
+		numbers.byteswap()
+	return numbers
+
+
 def uInt32Number(binaryString):
 	return struct.unpack(">I", binaryString)[0]
 
@@ -2748,14 +2774,22 @@ class LazyLoadTagAODict(AODict):
 		self.profile = profile
 		AODict.__init__(self)
 
+	def __delitem__(self, key):
+		AODict.__delitem__(self, key)
+		self.profile._tags_modified = True
+
 	def __getitem__(self, key):
 		tag = AODict.__getitem__(self, key)
 		if isinstance(tag, ICCProfileTag):
-			# Return already parsed tag
+			# Return already parsed tag. The caller may change it in place.
+			self.profile._tags_modified = True
 			return tag
 		# Load and parse tag data
 		tagSignature = key
 		typeSignature, tagDataOffset, tagDataSize, tagData = tag
+		if isinstance(tagData, memoryview):
+			# View into the profile's file mapping
+			tagData = tagData.tobytes()
 		try:
 			if tagSignature in tagSignature2Tag:
 				tag = tagSignature2Tag[tagSignature](tagData, tagSignature)
@@ -2785,11 +2819,19 @@ class LazyLoadTagAODict(AODict):
 		else:
 			AODict.__setattr__(self, name, value)
 
+	def __setitem__(self, key, value):
+		AODict.__setitem__(self, key, value)
+		self.profile._tags_modified = True
+
 	def get(self, key, default=None):
 		if key in self:
 			return self[key]
 		return default
 
+	def pop(self, key, *args):
+		self.profile._tags_modified = True
+		return AODict.pop(self, key, *args)
+
 
 class ICCProfileTag(object):
 
@@ -2946,6 +2988,221 @@ class Illuminant(ADict):
 		self.description = illuminants[self.type]
 
 
+class CLUT(object):
+
+	"""
+	Compact cLUT storage with a list-compatible view
+	
+	The cLUT values are held in a flat array ('H' while all values are
+	16-bit integers, 'd' otherwise). Indexing works like for the nested lists
+	used elsewhere, i.e. clut[row][column][channel], but returns views that
+	write through to the flat array.
+	
+	"""
+
+	def __init__(self, data, gridsteps, channels):
+		self.data = data
+		self.gridsteps = gridsteps
+		self.channels = channels
+		self._rowlen = gridsteps * channels
+
+	@classmethod
+	def frombytes(cls, binaryString, gridsteps, channels):
+		""" Create from big-endian 16-bit tag data """
+		return cls(uInt16Numbers(binaryString), gridsteps, channels)
+
+	@classmethod
+	def fromlist(cls, clut):
+		""" Create from nested lists clut[row][column][channel] """
+		values = [v for row in clut for column in row for v in column]
+		try:
+			data = array("H", values)
+		except (TypeError, OverflowError):
+			data = array("d", values)
+		return cls(data, len(clut[0]), len(clut[0][0]))
+
+	@classmethod
+	def fromarray(cls, ndarray):
+		""" Create from a NumPy array of shape (rows, gridsteps, channels) """
+		import numpy
+		if (ndarray.dtype.kind in "ui" and
+			(not ndarray.size or (ndarray.min() >= 0 and
+								  ndarray.max() <= 65535))):
+			data = array("H", ndarray.astype(numpy.uint16).tobytes())
+		else:
+			data = array("d", ndarray.astype(numpy.float64).tobytes())
+		return cls(data, ndarray.shape[1], ndarray.shape[2])
+
+	def asarray(self):
+		"""
+		Return a NumPy array of shape (rows, gridsteps, channels) sharing
+		memory with the flat array
+		
+		"""
+		import numpy
+		return numpy.frombuffer(self.data, self.data.typecode).reshape(
+			(-1, self.gridsteps, self.channels))
+
+	def tobytes(self):
+		""" Return big-endian 16-bit tag data """
+		data = self.data
+		if data.typecode != "H":
+			data = array("H", (int(round(v)) for v in data))
+		elif sys.byteorder == "little":
+			data = array("H", data)
+		if sys.byteorder == "little":
+			data.byteswap()
+		return data.tobytes()
+
+	def tolist(self):
+		return [row.tolist() for row in self]
+
+	def _set(self, index, value):
+		try:
+			self.data[index] = value
+		except (TypeError, OverflowError):
+			# Non-integer or out of range, switch to float storage
+			self.data = array("d", self.data)
+			self.data[index] = value
+
+	def _setrow(self, i, row):
+		offset = i * self._rowlen
+		for j, column in enumerate(row):
+			for k, v in enumerate(column):
+				self._set(offset + j * self.channels + k, v)
+
+	def append(self, row):
+		i = len(self)
+		self.data.extend(array(self.data.typecode, [0] * self._rowlen))
+		self._setrow(i, row)
+
+	def __eq__(self, other):
+		if isinstance(other, CLUT):
+			other = other.tolist()
+		return self.tolist() == other
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			# Slices are copies, like for lists (as far as the nested row
+			# lists are concerned, the important thing is that they can be
+			# sent to other processes cheaply)
+			return [self[j].tolist() for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		if i < 0 or i >= len(self):
+			raise IndexError("cLUT row index out of range")
+		return CLUTRow(self, i)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield CLUTRow(self, i)
+
+	def __len__(self):
+		return len(self.data) // self._rowlen
+
+	def __setitem__(self, i, row):
+		if i < 0:
+			i += len(self)
+		self._setrow(i, row)
+
+
+class CLUTRow(object):
+
+	""" View of a cLUT row (see CLUT) """
+
+	def __init__(self, clut, i):
+		self.clut = clut
+		self.offset = i * clut._rowlen
+
+	def __eq__(self, other):
+		return self.tolist() == list(other)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __getitem__(self, j):
+		if isinstance(j, slice):
+			return [self[n] for n in range(*j.indices(len(self)))]
+		if j < 0:
+			j += self.clut.gridsteps
+		if j < 0 or j >= self.clut.gridsteps:
+			raise IndexError("cLUT column index out of range")
+		return CLUTEntry(self.clut, self.offset + j * self.clut.channels)
+
+	def __iter__(self):
+		for j in range(self.clut.gridsteps):
+			yield CLUTEntry(self.clut, self.offset + j * self.clut.channels)
+
+	def __len__(self):
+		return self.clut.gridsteps
+
+	def __repr__(self):
+		return repr(self.tolist())
+
+	def __setitem__(self, j, column):
+		if j < 0:
+			j += self.clut.gridsteps
+		offset = self.offset + j * self.clut.channels
+		for k, v in enumerate(column):
+			self.clut._set(offset + k, v)
+
+	def tolist(self):
+		return [entry.tolist() for entry in self]
+
+
+class CLUTEntry(object):
+
+	""" View of a cLUT grid point's channel values (see CLUT) """
+
+	def __init__(self, clut, offset):
+		self.clut = clut
+		self.offset = offset
+
+	def __eq__(self, other):
+		return self.tolist() == list(other)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __getitem__(self, k):
+		if isinstance(k, slice):
+			return self.tolist()[k]
+		if k < 0:
+			k += self.clut.channels
+		if k < 0 or k >= self.clut.channels:
+			raise IndexError("cLUT channel index out of range")
+		return self.clut.data[self.offset + k]
+
+	def __iter__(self):
+		return iter(self.tolist())
+
+	def __len__(self):
+		return self.clut.channels
+
+	def __repr__(self):
+		return repr(self.tolist())
+
+	def __setitem__(self, k, v):
+		if isinstance(k, slice):
+			values = self.tolist()
+			values[k] = v
+			if len(values) != self.clut.channels:
+				raise ValueError("cLUT entry size can't be changed")
+			for n, v in enumerate(values):
+				self.clut._set(self.offset + n, v)
+			return
+		if k < 0:
+			k += self.clut.channels
+		self.clut._set(self.offset + k, v)
+
+	def tolist(self):
+		return self.clut.data[self.offset:
+							  self.offset + self.clut.channels].tolist()
+
+
 class LUT16Type(ICCProfileTag):
 
 	def __init__(self, tagData=None, tagSignature=None, profile=None):
@@ -3049,11 +3306,10 @@ class LUT16Type(ICCProfileTag):
 		def fget(self):
 			if self._clut is None:
 				i, o, g, n = self._i, self._o, self._g, self._n
-				tagData = self._tagData
-				self._clut = [[[uInt16Number(tagData[52 + n * i * 2 + o * 2 * (g * x + y) + z * 2:
-													 54 + n * i * 2 + o * 2 * (g * x + y) + z * 2])
-								for z in range(o)]
-							   for y in range(g)] for x in range(g ** i / g)]
+				offset = 52 + n * i * 2
+				self._clut = CLUT.frombytes(self._tagData[offset:
+														  offset + g ** i * o * 2],
+											g, o)
 			return self._clut
 		
 		def fset(self, value):
@@ -3068,6 +3324,20 @@ class LUT16Type(ICCProfileTag):
 			raise NotImplementedError("clut_writepng: output channels != 3")
 		imfile.write(self.clut, stream_or_filename)
 
+	def clut_asarray(self):
+		"""
+		Return the cLUT as NumPy array of shape
+		(<grid steps> ** (<input channels> - 1), <grid steps>, <output channels>)
+		
+		If the cLUT uses compact storage, the array shares its memory.
+		
+		"""
+		clut = self.clut
+		if not isinstance(clut, CLUT):
+			import numpy
+			return numpy.array(clut)
+		return clut.asarray()
+
 	def clut_writecgats(self, stream_or_filename):
 		""" Write the cLUT as CGATS """
 		# TODO:
@@ -3129,10 +3399,8 @@ BEGIN_DATA
 		def fget(self):
 			if self._input is None:
 				i, n = self._i, self._n
-				tagData = self._tagData
-				self._input = [[uInt16Number(tagData[52 + n * 2 * z + y * 2:
-													 54 + n * 2 * z + y * 2])
-								for y in range(n)]
+				entries = uInt16Numbers(self._tagData[52:52 + n * i * 2])
+				self._input = [entries[n * z:n * (z + 1)].tolist()
 							   for z in range(i)]
 			return self._input
 		
@@ -3178,42 +3446,53 @@ BEGIN_DATA
 		"""
 		Apply function to channel values of each cLUT row
 		
+		colormath.smooth_avg is applied to all rows at once.
+		
 		"""
-		clutres = len(self.clut[0])
-		block = -1
-		for i, row in enumerate(self.clut):
-			channels = {}
+		import numpy
+		clut = self.clut_asarray().astype(numpy.float64)
+		rows, clutres, channels = clut.shape
+		protect = None
+		if protect_gray_axis or protect_dark or protect_black or exclude:
+			protect = numpy.zeros((rows, clutres), dtype=bool)
+			if exclude:
+				for i, j in exclude:
+					if i < rows and j < clutres:
+						protect[i, j] = True
+			if protect_gray_axis:
+				block = numpy.arange(int(math.ceil(rows / float(clutres))))
+				if pcs == "XYZ":
+					gray_col_i = block
+				else:
+					# L*a*b*
+					gray_col_i = numpy.repeat(clutres // 2, len(block))
+				gray_row_i = block * clutres + gray_col_i
+				inrange = gray_row_i < rows
+				protect[gray_row_i[inrange], gray_col_i[inrange]] = True
+			if protect_dark:
+				total = clut[..., 0].copy()
+				for k in range(1, channels):
+					total += clut[..., k]
+				protect |= total < 65535 * .03125 * 3
+			if protect_black:
+				protect |= (clut == 0).all(axis=2)
+			if debug:
+				for i, j in numpy.argwhere(protect).tolist():
+					safe_print("protect", i, j, clut[i, j].tolist())
+		if (fn is colormath.smooth_avg and
+			(protect is not None or not "protect" in fnkwargs)):
+			kwargs = dict(fnkwargs, protect=protect)
 			for k in indexes:
-				channels[k] = []
-			if protect_gray_axis or protect_dark or protect_black or exclude:
-				if i % clutres == 0:
-					block += 1
-					if pcs == "XYZ":
-						gray_col_i = block
-					else:
-						# L*a*b*
-						gray_col_i = clutres // 2
-					gray_row_i = i + gray_col_i
-				fnkwargs["protect"] = []
-			for j, column in enumerate(row):
-				is_exclude = exclude and (i, j) in exclude
-				if is_exclude or (protect_gray_axis and
-								  (i == gray_row_i and j == gray_col_i)):
-					if debug:
-						safe_print("protect", "exclude" if is_exclude else "gray", i, j, column)
-					fnkwargs["protect"].append(j)
-				elif ((protect_dark and sum(column) < 65535 * .03125 * 3) or
-					  (protect_black and min(column) == max(column) == 0)):
-					if debug:
-						safe_print("protect dark", i, j, column)
-					fnkwargs["protect"].append(j)
-				for k in indexes:
-					channels[k].append(column[k])
-			for k, values in channels.items():
-				channels[k] = fn(values, *fnargs, **fnkwargs)
-			for j, column in enumerate(row):
+				clut[..., k] = colormath.batch.smooth_avg(clut[..., k], *fnargs,
+														  **kwargs)
+		else:
+			for i in range(rows):
+				if protect is not None:
+					fnkwargs["protect"] = numpy.nonzero(protect[i])[0].tolist()
 				for k in indexes:
-					column[k] = channels[k][j]
+					clut[i, :, k] = fn(clut[i, :, k].tolist(), *fnargs,
+									   **fnkwargs)
+		self.clut = CLUT.fromarray(clut)
 
 	def clut_shift_columns(self, order=(1, 2, 0)):
 		"""
@@ -3222,19 +3501,12 @@ BEGIN_DATA
 		"""
 		if len(self.input) != 3:
 			raise NotImplementedError("input channels != 3")
-		steps = len(self.clut[0])
-		clut = []
-		coord = [0, 0, 0]
-		for a in range(steps):
-			coord[order[0]] = a
-			for b in range(steps):
-				coord[order[1]] = b
-				clut.append([])
-				for c in range(steps):
-					coord[order[2]] = c
-					z, y, x = coord
-					clut[-1].append(self.clut[z * steps + y][x])
-		self.clut = clut
+		clut = self.clut_asarray()
+		steps, channels = clut.shape[1:]
+		clut = clut.reshape((steps, steps, steps, channels))
+		clut = clut.transpose(tuple(order) + (3, )).reshape((-1, steps,
+															 channels))
+		self.clut = CLUT.fromarray(clut)
 	
 	@Property
 	def matrix():
@@ -3262,12 +3534,9 @@ BEGIN_DATA
 		def fget(self):
 			if self._output is None:
 				i, o, g, n, m = self._i, self._o,self._g,  self._n, self._m
-				tagData = self._tagData
-				self._output = [[uInt16Number(tagData[52 + n * i * 2 + m * 2 * z + y * 2 +
-													  g ** i * o * 2:
-													  54 + n * i * 2 + m * 2 * z + y * 2 +
-													  g ** i * o * 2])
-								 for y in range(m)]
+				offset = 52 + n * i * 2 + g ** i * o * 2
+				entries = uInt16Numbers(self._tagData[offset:offset + m * o * 2])
+				self._output = [entries[m * z:m * (z + 1)].tolist()
 								for z in range(o)]
 			return self._output
 		
@@ -3312,6 +3581,96 @@ BEGIN_DATA
 
 		if logfile:
 			logfile.write("Smoothing %s...\n" % sig)
+		if debug:
+			self._smooth_debug(pcs, debug)
+		else:
+			self._smooth(pcs)
+
+		if diagpng and filename:
+			self.clut_writepng(fname + ".%s.post.CLUT.smooth.png" %
+							   sig)
+
+	def _smooth(self, pcs):
+		"""
+		Smooth the cLUT (see smooth)
+		
+		Each 2D grid (grid points with the same first index) is filtered in
+		place in row-major order, i.e. already smoothed grid points above
+		and to the left are used when smoothing the next one. Grid points on
+		a line x + 2 * y = const don't depend on each other, so each line
+		is filtered at once for all 2D grids.
+		
+		"""
+		import numpy
+		clut = self.clut_asarray().astype(numpy.float64)
+		clutres = clut.shape[1]
+		RGB = clut.reshape((clutres, clutres, clutres, -1))[..., :3]
+		# Don't smooth dark colors and gray axis
+		skip = RGB[..., 0] + RGB[..., 1] + RGB[..., 2] < 65535 * .03125 * 3
+		i = numpy.arange(clutres)
+		if pcs == "XYZ":
+			skip[i, i, i] = True
+		elif clutres // 2 != clutres / 2.0:
+			# For CIELab cLUT, gray will only
+			# fall on a cLUT point if uneven cLUT res
+			skip[:, clutres // 2, clutres // 2] = True
+		if pcs == "Lab":
+			# Smoothing factor for L*a*b* -> RGB cLUT above 50%
+			plus_smooth = numpy.where(i > clutres / 2.0, 0.25, 0.5)
+		else:
+			plus_smooth = numpy.repeat(0.5, clutres)
+		plus_smooth = plus_smooth[:, numpy.newaxis, numpy.newaxis]
+		# Box filter neighbours (y, x offsets) in the order they are summed up.
+		# Center pixel weight = 1.0, surround = 2/3, corners = 1/3
+		box = [((0, -1), 2 / 3.0), ((1, -1), 1 / 3.0),
+			   ((0, 1), 2 / 3.0), ((-1, 1), 1 / 3.0),
+			   ((-1, 0), 2 / 3.0), ((1, 1), 1 / 3.0),
+			   ((1, 0), 2 / 3.0), ((-1, -1), 1 / 3.0)]
+		last = clutres - 1
+		for t in range(last * 3 + 1):
+			y = numpy.arange(clutres)
+			x = t - 2 * y
+			inrange = (x >= 0) & (x < clutres)
+			y, x = y[inrange], x[inrange]
+			edge = (x == 0) | (x == last) | (y == 0) | (y == last)
+			# Use either "plus"-shaped or box filter depending if one
+			# channel is fully saturated
+			for is_edge in (True, False):
+				yi, xi = y[edge == is_edge], x[edge == is_edge]
+				if not len(yi):
+					continue
+				center = RGB[:, yi, xi]
+				smoothed = center.copy()
+				if is_edge:
+					# Filter with a "plus" (+) shape.
+					# Omit corners and perpendicular axis
+					count = numpy.ones(len(yi))
+					for c, offsets in ((xi, ((0, -1), (0, 1))),
+									   (yi, ((-1, 0), (1, 0)))):
+						use = ((c > 0) & (c < last))[:, numpy.newaxis]
+						count += use[:, 0] * 2
+						for n, m in offsets:
+							RGBn = RGB[:, numpy.clip(yi + n, 0, last),
+									   numpy.clip(xi + m, 0, last)]
+							smoothed += numpy.where(use, RGBn * plus_smooth +
+													center * (1 - plus_smooth),
+													0.0)
+					smoothed /= count[:, numpy.newaxis]
+				else:
+					for (n, m), smooth in box:
+						smoothed += (RGB[:, yi + n, xi + m] * smooth +
+									 center * (1 - smooth))
+					smoothed /= float(len(box) + 1)
+				RGB[:, yi, xi] = numpy.where(skip[:, yi, xi, numpy.newaxis],
+											 center, smoothed)
+		self.clut = CLUT.fromarray(numpy.minimum(clut, 65535))
+
+	def _smooth_debug(self, pcs, debug):
+		"""
+		Visualize the filters of smooth() in the cLUT
+		
+		"""
+		clutres = len(self.clut[0])
 		# Create a list of <clutres> number of 2D grids, each one with a
 		# size of (width x height) <clutres> x <clutres>
 		grids = []
@@ -3392,10 +3751,6 @@ BEGIN_DATA
 				self.clut[i * clutres + j] = [[min(v, 65535) for v in RGB]
 											   for RGB in row]
 
-		if diagpng and filename:
-			self.clut_writepng(fname + ".%s.post.CLUT.smooth.png" %
-							   sig)
-
 	def smooth2(self, diagpng=2, pcs=None, filename=None, logfile=None,
 				window=(1 / 16.0, 1, 1 / 16.0)):
 		""" Apply extra smoothing to the cLUT """
@@ -3498,9 +3853,12 @@ BEGIN_DATA
 					   uInt16Number_tohex(len(self.output and self.output[0]))]
 			for entries in self.input:
 				tagData.extend(uInt16Number_tohex(v) for v in entries)
-			for block in self.clut:
-				for entries in block:
-					tagData.extend(uInt16Number_tohex(v) for v in entries)
+			if isinstance(self.clut, CLUT):
+				tagData.append(self.clut.tobytes())
+			else:
+				for block in self.clut:
+					for entries in block:
+						tagData.extend(uInt16Number_tohex(v) for v in entries)
 			for entries in self.output:
 				tagData.extend(uInt16Number_tohex(v) for v in entries)
 			return "".join(tagData)
@@ -3642,6 +4000,7 @@ class CurveType(ICCProfileTag, list):
 
 	def _reset(self):
 		self._transfer_function = {}
+		self._trc_candidates = {}
 		self._bt1886 = {}
 	
 	def append(self, object):
@@ -3655,10 +4014,15 @@ class CurveType(ICCProfileTag, list):
 		bp_in = colormath.xyY2XYZ(D50_xyY[0], D50_xyY[1], self[0] / 65535.0)
 		bp_out = colormath.xyY2XYZ(D50_xyY[0], D50_xyY[1], black_Y_out)
 		wp_out = colormath.xyY2XYZ(D50_xyY[0], D50_xyY[1], self[-1] / 65535.0)
-		for i, v in enumerate(self):
-			X, Y, Z = colormath.xyY2XYZ(D50_xyY[0], D50_xyY[1], v / 65535.0)
-			self[i] = colormath.apply_bpc(X, Y, Z, bp_in, bp_out,
-										  wp_out, weight)[1] * 65535.0
+		if weight:
+			for i, v in enumerate(self):
+				X, Y, Z = colormath.xyY2XYZ(D50_xyY[0], D50_xyY[1], v / 65535.0)
+				self[i] = colormath.apply_bpc(X, Y, Z, bp_in, bp_out,
+											  wp_out, weight)[1] * 65535.0
+			return
+		XYZ = self._neutral_XYZ(D50_xyY[:2])
+		XYZ = colormath.batch.apply_bpc(XYZ, bp_in, bp_out, wp_out)
+		self[:] = (XYZ[:, 1] * 65535.0).tolist()
 	
 	def extend(self, iterable):
 		list.extend(self, iterable)
@@ -3676,28 +4040,33 @@ class CurveType(ICCProfileTag, list):
 			if average or least_squares:
 				return values[0]
 			return [values[0]]
+		import numpy
+		y = numpy.array(self, dtype=numpy.float64)
+		maxv = len(self) - 1.0
 		if lstar_slice:
 			start = slice[0] * 100
 			end = slice[1] * 100
-			values = []
-			for i, y in enumerate(self):
-				n = colormath.XYZ2Lab(0, y / 65535.0 * 100, 0)[0]
-				if n >= start and n <= end:
-					values.append((i / (len(self) - 1.0) * 65535.0, y))
+			XYZ = numpy.zeros((len(self), 3))
+			XYZ[:, 1] = y / 65535.0 * 100
+			L = colormath.batch.XYZ2Lab(XYZ)[:, 0]
+			i = numpy.nonzero((L >= start) & (L <= end))[0]
 		else:
-			maxv = len(self) - 1.0
 			maxi = int(maxv)
 			starti = int(round(slice[0] * maxi))
 			endi = int(round(slice[1] * maxi)) + 1
-			values = list(zip([(v / maxv) * 65535 for v in range(starti, endi)],
-						 self[starti:endi]))
+			i = numpy.arange(starti, endi)
+		values = numpy.column_stack((i / maxv * 65535.0, y[i]))
 		vmin = 0
 		vmax = 65535.0
 		if use_vmin_vmax:
 			if len(self) > 2:
 				vmin = self[0]
 				vmax = self[-1]
-		return colormath.get_gamma(values, 65535.0, vmin, vmax, average, least_squares)
+		gamma = colormath.batch.get_gamma(values, 65535.0, vmin, vmax, average,
+										  least_squares)
+		if average or least_squares:
+			return float(gamma)
+		return gamma[~numpy.isnan(gamma)].tolist()
 	
 	def get_transfer_function(self, best=True, slice=(0.05, 0.95), black_Y=None,
 							  outoffset=None):
@@ -3711,11 +4080,55 @@ class CurveType(ICCProfileTag, list):
 		if not len(self):
 			# Identity
 			return ("Gamma 1.0", 1.0, 1.0), 1.0
-		transfer_function = self._transfer_function.get((best, slice))
+		cachekey = best, slice, black_Y, outoffset
+		transfer_function = self._transfer_function.get(cachekey)
 		if transfer_function:
 			return transfer_function
-		trc = CurveType()
+		import numpy
+		otrc, candidates = self._get_trc_candidates(black_Y, outoffset)
+		vmin = otrc[0]
+		vmax = otrc[-1]
+		i = numpy.arange(len(self))
+		x = i / (len(self) - 1.0) * 65535.0
+		start = slice[0] * len(self)
+		end = slice[1] * len(self)
+		n = colormath.batch.get_gamma(numpy.column_stack((x, otrc)), 65535.0,
+									  vmin, vmax, False)
+		valid = (i >= start) & (i <= end) & ~numpy.isnan(n)
 		match = {}
+		for key, trc in candidates:
+			if numpy.array_equal(otrc, trc):
+				match[key] = 1.0
+				continue
+			n2 = colormath.batch.get_gamma(numpy.column_stack((x, trc)),
+										   65535.0, vmin, vmax, False)
+			use = valid & ~numpy.isnan(n2) & (n2 != 0)
+			count = int(use.sum())
+			if count:
+				m = 1 - numpy.abs(n[use] - n2[use]) / ((n[use] + n2[use]) / 2.0)
+				match[key] = sum(m.tolist()) / count
+			else:
+				match[key] = 0.0
+		if not best:
+			self._transfer_function[cachekey] = match
+			return match
+		match, (name, exp, outoffset) = sorted(zip(list(match.values()), list(match.keys())))[-1]
+		self._transfer_function[cachekey] = (name, exp, outoffset), match
+		return (name, exp, outoffset), match
+	
+	def _get_trc_candidates(self, black_Y=None, outoffset=None):
+		"""
+		Return the black point compensated TRC and a list of candidate
+		transfer functions to compare it against as (key, curve) tuples
+		
+		The candidates only depend on the TRC, black_Y and outoffset, so they
+		are computed once and cached until the TRC is changed.
+		
+		"""
+		cachekey = black_Y, outoffset
+		if cachekey in self._trc_candidates:
+			return self._trc_candidates[cachekey]
+		import numpy
 		otrc = CurveType()
 		otrc[:] = self
 		if otrc[0]:
@@ -3730,10 +4143,6 @@ class CurveType(ICCProfileTag, list):
 		if black_Y is None:
 			black_Y = self[0] / 65535.0
 		black_cdm2 = black_Y * white_cdm2
-		maxv = len(otrc) - 1.0
-		maxi = int(maxv)
-		starti = int(round(0.4 * maxi))
-		endi = int(round(0.6 * maxi))
 		gamma = otrc.get_gamma(True, slice=(0.4, 0.6), lstar_slice=False)
 		egamma = colormath.get_gamma([(0.5, 0.5 ** gamma)], vmin=-black_Y)
 		outoffset_unspecified = outoffset is None
@@ -3753,6 +4162,8 @@ class CurveType(ICCProfileTag, list):
 			for i in range(100):
 				tfs.append(("Gamma %.2f %i%%" % (round(gamma, 2), i),
 							gamma, i / 100.0))
+		trc = CurveType()
+		candidates = []
 		for name, exp, outoffset in tfs:
 			if name in ("DICOM", "Rec. 1886", "SMPTE 2084", "HLG"):
 				try:
@@ -3772,33 +4183,23 @@ class CurveType(ICCProfileTag, list):
 				trc.set_trc(exp, len(self), vmin, vmax)
 			if trc[0] and trc[-1] - trc[0]:
 				trc.apply_bpc()
-			if otrc == trc:
-				match[(name, exp, outoffset)] = 1.0
-			else:
-				match[(name, exp, outoffset)] = 0.0
-				count = 0
-				start = slice[0] * len(self)
-				end = slice[1] * len(self)
-				for i, n in enumerate(otrc):
-					##n = colormath.XYZ2Lab(0, n / 65535.0 * 100, 0)[0]
-					if i >= start and i <= end:
-						n = colormath.get_gamma([(i / (len(self) - 1.0) * 65535.0, n)], 65535.0, vmin, vmax, False)
-						if n:
-							n = n[0]
-							##n2 = colormath.XYZ2Lab(0, trc[i] / 65535.0 * 100, 0)[0]
-							n2 = colormath.get_gamma([(i / (len(self) - 1.0) * 65535.0, trc[i])], 65535.0, vmin, vmax, False)
-							if n2 and n2[0]:
-								n2 = n2[0]
-								match[(name, exp, outoffset)] += 1 - (max(n, n2) - min(n, n2)) / ((n + n2) / 2.0)
-								count += 1
-				if count:
-					match[(name, exp, outoffset)] /= count
-		if not best:
-			self._transfer_function[(best, slice)] = match
-			return match
-		match, (name, exp, outoffset) = sorted(zip(list(match.values()), list(match.keys())))[-1]
-		self._transfer_function[(best, slice)] = (name, exp, outoffset), match
-		return (name, exp, outoffset), match
+			candidates.append(((name, exp, outoffset),
+							   numpy.array(trc, dtype=numpy.float64)))
+		result = numpy.array(otrc, dtype=numpy.float64), candidates
+		self._trc_candidates[cachekey] = result
+		return result
+	
+	def _neutral_XYZ(self, xy):
+		"""
+		Return XYZ array (shape (len(self), 3)) of chromaticity xy, using the
+		TRC entries scaled to 0..1 as Y
+		
+		"""
+		import numpy
+		Y = numpy.array(self, dtype=numpy.float64) / 65535.0
+		xyY = numpy.column_stack((numpy.full_like(Y, xy[0]),
+								  numpy.full_like(Y, xy[1]), Y))
+		return colormath.batch.xyY2XYZ(xyY)
 	
 	def insert(self, object):
 		list.insert(self, object)
@@ -3825,27 +4226,27 @@ class CurveType(ICCProfileTag, list):
 		level of the display.
 		
 		"""
-		bt1886 = self._bt1886.get((gamma, black_Y, outoffset))
-		if bt1886:
-			return bt1886
-		if gamma_type in ("b", "g"):
-			# Get technical gamma needed to achieve effective gamma
-			gamma = colormath.xicc_tech_gamma(gamma, black_Y, outoffset)
-		rXYZ = colormath.RGB2XYZ(1.0, 0, 0)
-		gXYZ = colormath.RGB2XYZ(0, 1.0, 0)
-		bXYZ = colormath.RGB2XYZ(0, 0, 1.0)
-		mtx = colormath.Matrix3x3([[rXYZ[0], gXYZ[0], bXYZ[0]],
-								   [rXYZ[1], gXYZ[1], bXYZ[1]],
-								   [rXYZ[2], gXYZ[2], bXYZ[2]]])
+		cachekey = gamma, black_Y, outoffset, gamma_type
+		bt1886 = self._bt1886.get(cachekey)
 		wXYZ = colormath.RGB2XYZ(1.0, 1.0, 1.0)
 		x, y = colormath.XYZ2xyY(*wXYZ)[:2]
-		XYZbp = colormath.xyY2XYZ(x, y, black_Y)
-		bt1886 = colormath.BT1886(mtx, XYZbp, outoffset, gamma)
-		self._bt1886[(gamma, black_Y, outoffset)] = bt1886
+		if not bt1886:
+			if gamma_type in ("b", "g"):
+				# Get technical gamma needed to achieve effective gamma
+				gamma = colormath.xicc_tech_gamma(gamma, black_Y, outoffset)
+			rXYZ = colormath.RGB2XYZ(1.0, 0, 0)
+			gXYZ = colormath.RGB2XYZ(0, 1.0, 0)
+			bXYZ = colormath.RGB2XYZ(0, 0, 1.0)
+			mtx = colormath.Matrix3x3([[rXYZ[0], gXYZ[0], bXYZ[0]],
+									   [rXYZ[1], gXYZ[1], bXYZ[1]],
+									   [rXYZ[2], gXYZ[2], bXYZ[2]]])
+			XYZbp = colormath.xyY2XYZ(x, y, black_Y)
+			bt1886 = colormath.BT1886(mtx, XYZbp, outoffset, gamma)
 		self.set_trc(-709, size)
-		for i, v in enumerate(self):
-			X, Y, Z = colormath.xyY2XYZ(x, y, v / 65535.0)
-			self[i] = bt1886.apply(X, Y, Z)[1] * 65535.0
+		XYZ = colormath.batch.apply_bt1886(self._neutral_XYZ((x, y)), bt1886)
+		self[:] = (XYZ[:, 1] * 65535.0).tolist()
+		# Changing the curve resets the cache, so only store it afterwards
+		self._bt1886[cachekey] = bt1886
 	
 	def set_dicom_trc(self, black_cdm2=.05, white_cdm2=100, size=None):
 		"""
@@ -3874,13 +4275,11 @@ class CurveType(ICCProfileTag, list):
 			size = len(self)
 		if size < 2:
 			size = 1024
-		self[:] = []
-		for i in range(size):
-			v = math.pow(10, colormath.DICOM(black_jndi +
-											 (float(i) / (size - 1)) *
-											 (white_jndi -
-											  black_jndi))) / white_dicomY
-			self.append(v * 65535)
+		import numpy
+		jndi = (black_jndi + (numpy.arange(size) / (size - 1.0)) *
+				(white_jndi - black_jndi))
+		v = 10 ** colormath.batch.DICOM(jndi) / white_dicomY
+		self[:] = (v * 65535).tolist()
 	
 	def set_hlg_trc(self, black_cdm2=0, white_cdm2=100, system_gamma=1.2,
 					ambient_cdm2=5, maxsignal=1.0, size=None):
@@ -3948,10 +4347,10 @@ class CurveType(ICCProfileTag, list):
 			raise ValueError("The black level of %f cd/m2 is out of range "
 							 "for SMPTE 2084. Valid range begins at 0 cd/m2." %
 							 black_cdm2)
-		if max(white_cdm2, master_white_cdm2) > 10000:
+		if max(white_cdm2, master_white_cdm2 or 0) > 10000:
 			raise ValueError("The white level of %f cd/m2 is out of range "
 							 "for SMPTE 2084. Valid range is up to 10000 cd/m2." %
-							 max(white_cdm2, master_white_cdm2))
+							 max(white_cdm2, master_white_cdm2 or 0))
 		values = []
 		maxv = white_cdm2 / 10000.0
 		maxi = colormath.specialpow(maxv, 1.0 / -2084)
@@ -3972,13 +4371,13 @@ class CurveType(ICCProfileTag, list):
 			size = len(self)
 		if size < 2:
 			size = 1024
-		for i in range(size):
-			n = i / (size - 1.0)
-			if rolloff:
-				n = bt2390.apply(n)
-			v = colormath.specialpow(n * (maxi / maxi_out), -2084)
-			values.append(min(v / maxv, 1.0))
-		self[:] = [min(v * 65535, 65535) for v in values]
+		import numpy
+		n = numpy.arange(size) / (size - 1.0)
+		if rolloff:
+			n = numpy.array([bt2390.apply(v) for v in n.tolist()])
+		v = colormath.batch.specialpow(n * (maxi / maxi_out), -2084)
+		values = numpy.minimum(v / maxv, 1.0)
+		self[:] = numpy.minimum(values * 65535, 65535).tolist()
 		if black_cdm2 and not rolloff:
 			self.apply_bpc(black_cdm2 / white_cdm2)
 	
@@ -4001,12 +4400,14 @@ class CurveType(ICCProfileTag, list):
 				return
 			else:
 				size = 1024
-		self[:] = []
-		if not callable(power):
-			exp = power
-			power = lambda a: colormath.specialpow(a, exp)
-		for i in range(0, size):
-			self.append(vmin + power(float(i) / (size - 1)) * (vmax - vmin))
+		import numpy
+		if callable(power):
+			values = numpy.array([power(float(i) / (size - 1))
+								  for i in range(size)])
+		else:
+			values = colormath.batch.specialpow(numpy.arange(size) /
+												(size - 1.0), power)
+		self[:] = (vmin + values * (vmax - vmin)).tolist()
 	
 	def smooth_cr(self, length=64):
 		"""
@@ -4024,7 +4425,7 @@ class CurveType(ICCProfileTag, list):
 		          Defaults to (1.0, 1.0, 1.0)
 		
 		"""
-		self[:] = colormath.smooth_avg(self, passes, window)
+		self[:] = colormath.batch.smooth_avg(self, passes, window).tolist()
 	
 	def sort(self, cmp=None, key=None, reverse=False):
 		list.sort(self, cmp, key, reverse)
@@ -5065,32 +5466,40 @@ class VideoCardGammaTableType(VideoCardGammaType):
 		table precision bits.
 		
 		"""
+		import numpy
 		oldmax = math.pow(256, self.entrySize) - 1
 		if bits in (8, 16, 32, 64):
-			self.entrySize = bits / 8
+			self.entrySize = bits // 8
 		bitv = 2.0 ** bits
 		newmax = math.pow(256, self.entrySize) - 1
-		for i, channel in enumerate(self.data):
-			for j, value in enumerate(channel):
-				channel[j] = int(quantizer(value / oldmax * bitv) / bitv * newmax)
+		data = numpy.array(self.data, dtype=numpy.float64) / oldmax * bitv
+		# Python 3 round() rounds half to even like numpy.rint
+		ufunc = {round: numpy.rint,
+				 math.floor: numpy.floor,
+				 math.ceil: numpy.ceil,
+				 int: numpy.trunc}.get(quantizer)
+		if ufunc:
+			data = ufunc(data)
+		else:
+			data = numpy.array([[quantizer(value) for value in channel]
+								for channel in data.tolist()])
+		data = data / bitv * newmax
+		self.data = [[int(value) for value in channel]
+					 for channel in data.tolist()]
 	
 	def resize(self, length=128):
-		data = [[], [], []]
-		for i, channel in enumerate(self.data):
-			for j in range(0, length):
-				j *= (len(channel) - 1) / float(length - 1)
-				if int(j) != j:
-					floor = channel[int(math.floor(j))]
-					ceil = channel[min(int(math.ceil(j)), len(channel) - 1)]
-					interpolated = range(floor, ceil + 1)
-					fraction = j - int(j)
-					index = int(round(fraction * (ceil - floor)))
-					v = interpolated[index]
-				else:
-					v = channel[int(j)]
-				data[i].append(v)
-		self.data = data
-		self.entryCount = len(data[0])
+		import numpy
+		table = numpy.array(self.data)
+		count = table.shape[-1]
+		j = numpy.arange(length) * ((count - 1) / float(length - 1))
+		floor = numpy.floor(j).astype(int)
+		ceil = numpy.minimum(numpy.ceil(j).astype(int), count - 1)
+		# Linear interpolation, rounded to the nearest integer
+		fraction = j - floor
+		data = table[:, floor] + numpy.rint(fraction * (table[:, ceil] -
+														table[:, floor]))
+		self.data = data.astype(table.dtype).tolist()
+		self.entryCount = length
 	
 	def resized(self, length=128):
 		resized = self.__class__(self.tagData, self.tagSignature)
@@ -5118,8 +5527,8 @@ class VideoCardGammaTableType(VideoCardGammaType):
 		          Defaults to (1.0, 1.0, 1.0)
 		
 		"""
-		for i, channel in enumerate(self.data):
-			self.data[i] = colormath.smooth_avg(channel, passes, window)
+		self.data = colormath.batch.smooth_avg(self.data, passes,
+											   window).tolist()
 		self.entryCount = len(self.data[0])
 	
 	@Property
@@ -5737,11 +6146,31 @@ class ICCProfile(object):
 	loading of the tags will be deferred to when they are accessed the
 	first time.
 	
+	If the 'use_mmap' keyword argument is True (default False), a profile
+	file is not read into memory, but copied to an anonymous temporary file
+	which is mapped read-only. Tags then only reference their data in the
+	mapping until they are accessed (and parsed) the first time, and
+	unchanged tags are written back directly from the mapping. The private
+	copy can't be truncated by others (which would crash with SIGBUS when
+	reading the mapping), and the profile file itself stays free to be
+	overwritten.
+	
+	The serialized tags are cached (see _serialize_tags) until a tag is
+	set, deleted or handed out by 'tags' (it may be changed in place), or
+	a header field that tags can depend on is changed. Tags that were
+	obtained before the profile was last serialized and changed in place
+	afterwards need to be accessed through 'tags' again or re-assigned.
+	
 	"""
 
+	# Header fields the encoding of tags can depend on
+	_tag_header_fields = frozenset(["version", "profileClass", "colorSpace",
+									"connectionColorSpace"])
+
 	_recent = []
 
-	def __new__(cls, profile=None, load=True, use_cache=False):
+	def __new__(cls, profile=None, load=True, use_cache=False,
+				use_mmap=False):
 
 		key = None
 
@@ -5754,15 +6183,9 @@ class ICCProfile(object):
 					not os.path.sep in profile and
 					(not isinstance(os.path.altsep, str) or
 					 not os.path.altsep in profile)):
-					for path in iccprofiles_home + [x for x in iccprofiles if x not in iccprofiles_home]:
-						if os.path.isdir(path):
-							for path, dirs, files in os.walk(path):
-								path = os.path.join(path, profile)
-								if os.path.isfile(path):
-									profile = path
-									break
-							if profile == path:
-								break
+					path = get_profile_index().find(profile)
+					if path:
+						profile = path
 				if use_cache:
 					stat = os.stat(profile)
 					# NOTE under Python 2.x Windows, st_ino is always zero!
@@ -5800,8 +6223,13 @@ class ICCProfile(object):
 		self.ID = "\0" * 16
 		self._data = ""
 		self._file = None
+		self._map = None  # Read-only file mapping
+		self._use_mmap = use_mmap
 		self._tagoffsets = []  # Original tag offsets
 		self._tags = LazyLoadTagAODict(self)
+		self._serialized = None  # Cached tag table and data
+		self._serializedID = None  # Cached (header, ID)
+		self._tags_modified = True  # Whether _serialized may be outdated
 		self.fileName = None
 		self.is_loaded = False
 		self.size = 0
@@ -6008,7 +6436,12 @@ class ICCProfile(object):
 		
 		"""
 		return len(self.tags)
-	
+
+	def __setattr__(self, name, value):
+		if name in self._tag_header_fields:
+			object.__setattr__(self, "_tags_modified", True)
+		object.__setattr__(self, name, value)
+
 	@property
 	def data(self):
 		"""
@@ -6018,47 +6451,89 @@ class ICCProfile(object):
 		tag table and data) on-the-fly.
 		
 		"""
-		# Assemble tag table and tag data
-		tagCount = len(self.tags)
-		tagTable = OrderedDict()
-		tagTableSize = tagCount * 12
-		tagsData = []
-		tagsDataOffset = []
-		tagDataOffset = 128 + 4 + tagTableSize
-		tags = []
+		return "".join([chunk.tobytes() if isinstance(chunk, memoryview)
+						else chunk for chunk in self._serialize()])
+
+	def _serialize(self):
+		"""
+		Return the profile as list of chunks (header, tag count and table,
+		tag data and padding).
+		
+		"""
+		tagTable, tagsData, tagDataSize = self._serialize_tags()
+		header = self.header(len(tagTable) - 4, tagDataSize)
+		return [header, tagTable] + tagsData
+
+	def _serialize_tags(self):
+		"""
+		Assemble tag count and table and the list of tag data chunks.
+		
+		Identical tag data is only stored once (shared tags), looked up by
+		content. The result is cached as long as the tags and their data
+		stay the same. Return tag count and table, list of chunks and
+		tag data size.
+		
+		"""
 		# Order of tag table and actual tag data may be different.
 		# Keep order of tags according to original offsets (if any).
+		tags = []
 		for oOffset, tagSignature in sorted(self._tagoffsets):
-			if tagSignature in self.tags:
+			if tagSignature in self.tags and not tagSignature in tags:
 				tags.append(tagSignature)
-		# Keep tag table order
-		for tagSignature in self.tags:
-			tagTable[tagSignature] = tagSignature
+		tableSignatures = list(self.tags.keys())
+		for tagSignature in tableSignatures:
 			if not tagSignature in tags:
 				tags.append(tagSignature)
+		cached = self._serialized
+		if (cached and not self._tags_modified and
+			cached[0] == tableSignatures and cached[1] == tags and
+			cached[2] == self._tagoffsets):
+			# No tag has been set or handed out since, no need to re-encode
+			return cached[4]
+		tagDatas = []
 		for tagSignature in tags:
 			tag = AODict.__getitem__(self.tags, tagSignature)
 			if isinstance(tag, ICCProfileTag):
-				tagData = self.tags[tagSignature].tagData
+				tagDatas.append(tag.tagData)
 			else:
-				tagData = tag[3]
+				tagDatas.append(tag[3])
+		self._tags_modified = False
+		if (cached and cached[0] == tableSignatures and cached[1] == tags and
+			cached[2] == self._tagoffsets and
+			all(tagData is cachedData or tagData == cachedData
+				for tagData, cachedData in zip(tagDatas, cached[3]))):
+			return cached[4]
+		tagCount = len(tableSignatures)
+		tagTable = OrderedDict()
+		tagTableSize = tagCount * 12
+		tagsData = []
+		tagsDataOffset = {}
+		tagoffsets = set(self._tagoffsets)
+		tagDataOffset = 128 + 4 + tagTableSize
+		for tagSignature, tagData in zip(tags, tagDatas):
 			tagDataSize = len(tagData)
+			if ((tagDataOffset, tagSignature) not in tagoffsets and
+				tagData in tagsDataOffset):
+				tagTable[tagSignature] = (uInt32Number_tohex(tagsDataOffset[tagData]) +
+										  uInt32Number_tohex(tagDataSize))
+				continue
+			tagTable[tagSignature] = (uInt32Number_tohex(tagDataOffset) +
+									  uInt32Number_tohex(tagDataSize))
+			tagsDataOffset.setdefault(tagData, tagDataOffset)
+			tagsData.append(tagData)
 			# Pad all data with binary zeros so it lies on 4-byte boundaries
 			padding = int(math.ceil(tagDataSize / 4.0)) * 4 - tagDataSize
-			tagData += "\0" * padding
-			if (tagDataOffset, tagSignature) not in self._tagoffsets and tagData in tagsData:
-				tagTable[tagSignature] += uInt32Number_tohex(tagsDataOffset[tagsData.index(tagData)])
-			else:
-				tagTable[tagSignature] += uInt32Number_tohex(tagDataOffset)
-				tagsData.append(tagData)
-				tagsDataOffset.append(tagDataOffset)
-				tagDataOffset += tagDataSize + padding
-			tagTable[tagSignature] += uInt32Number_tohex(tagDataSize)
-		tagsData = "".join(tagsData)
-		header = self.header(tagTableSize, len(tagsData))
-		data = "".join([header, uInt32Number_tohex(tagCount), 
-						"".join(list(tagTable.values())), tagsData])
-		return data
+			if padding:
+				tagsData.append("\0" * padding)
+			tagDataOffset += tagDataSize + padding
+		tagTable = "".join([uInt32Number_tohex(tagCount)] +
+						   [tagSignature + tagTable[tagSignature]
+							for tagSignature in tableSignatures])
+		result = tagTable, tagsData, tagDataOffset - 128 - 4 - tagTableSize
+		self._serialized = (tableSignatures, tags, list(self._tagoffsets),
+							tagDatas, result)
+		self._serializedID = None
+		return result
 	
 	def header(self, tagTableSize, tagDataSize):
 		"Profile Header"
@@ -6110,11 +6585,18 @@ class ICCProfile(object):
 		"Profile Tag Table"
 		if not self._tags:
 			self.load()
-			if self._data and len(self._data) > 131:
+			if self._map is not None:
+				# Tag data is only referenced as views into the mapping
+				data = memoryview(self._map)[:self.size]
+			else:
+				data = self._data
+			if data and len(data) > 131:
 				# tag table and tagged element data
-				tagCount = uInt32Number(self._data[128:132])
+				tagCount = uInt32Number(data[128:132])
 				if debug: print("tagCount:", tagCount)
-				tagTable = self._data[132:132 + tagCount * 12]
+				tagTable = data[132:132 + tagCount * 12]
+				if isinstance(tagTable, memoryview):
+					tagTable = tagTable.tobytes()
 				self._tagoffsets = []
 				discard_len = 0
 				tags = {}
@@ -6140,7 +6622,7 @@ class ICCProfile(object):
 							if debug: print("    tagData start:", start)
 							end = tagDataOffset - discard_len + tagDataSize
 							if debug: print("    tagData end:", end)
-							tagData = self._data[start:end]
+							tagData = data[start:end]
 							if len(tagData) < tagDataSize:
 								safe_print("Warning: Tag data for tag %r "
 										   "is truncated (offet %i, expected "
@@ -6149,6 +6631,8 @@ class ICCProfile(object):
 											tagDataSize, len(tagData)))
 								tagDataSize = len(tagData)
 							typeSignature = tagData[:4]
+							if isinstance(typeSignature, memoryview):
+								typeSignature = typeSignature.tobytes()
 							if len(typeSignature) < 4:
 								safe_print("Warning: Tag type signature for "
 										   "tag %r is truncated (offet %i, "
@@ -6181,11 +6665,20 @@ class ICCProfile(object):
 		temporarily replaced with zeros.
 		
 		"""
-		data = self.data
-		data = data[:44] + "\0\0\0\0" + data[48:64] + "\0\0\0\0" + \
-			   data[68:84] + "\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0" + \
-			   data[100:]
-		ID = md5(data).digest()
+		chunks = self._serialize()
+		header = chunks[0]
+		header = header[:44] + "\0\0\0\0" + header[48:64] + "\0\0\0\0" + \
+				 header[68:84] + "\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0\0" + \
+				 header[100:]
+		if self._serializedID and self._serializedID[0] == header:
+			# Tags didn't change since the ID was last calculated
+			ID = self._serializedID[1]
+		else:
+			checksum = md5(header)
+			for chunk in chunks[1:]:
+				checksum.update(chunk)
+			ID = checksum.digest()
+			self._serializedID = header, ID
 		if setID:
 			if ID != self.ID:
 				# No longer reflects original profile
@@ -6771,10 +7264,34 @@ class ICCProfile(object):
 			if self._file.closed:
 				self._file = open(self._file.name, "rb")
 				self._file.seek(len(self._data))
-			self._data += self._file.read(self.size - len(self._data))
+			if self._use_mmap and self._map is None:
+				self._map = self._map_copy()
+			if self._map is None:
+				self._data += self._file.read(self.size - len(self._data))
 			self._file.close()
 			self.is_loaded = True
 	
+	def _map_copy(self):
+		"""
+		Copy the profile file to an anonymous temporary file and return a
+		read-only mapping of the copy, or None if that isn't possible.
+		
+		"""
+		try:
+			self._file.seek(0)
+			with tempfile.TemporaryFile() as tmp:
+				shutil.copyfileobj(self._file, tmp)
+				tmp.flush()
+				if tmp.tell() < self.size:
+					raise ICCProfileInvalidError("Not enough data")
+				# The mapping keeps its own handle to the copy
+				return mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ)
+		except (EnvironmentError, ValueError) as exception:
+			safe_print("Warning - could not map profile %s:" %
+					   self._file.name, exception)
+		finally:
+			self._file.seek(len(self._data))
+
 	def print_info(self):
 		safe_print("=" * 80)
 		safe_print("ICC profile information")
@@ -7368,7 +7885,8 @@ class ICCProfile(object):
 				self.fileName = stream_or_filename
 		else:
 			stream = stream_or_filename
-		stream.write(self.data)
+		for chunk in self._serialize():
+			stream.write(chunk)
 		if isinstance(stream_or_filename, str):
 			stream.close()
 
@@ -7388,3 +7906,241 @@ class ICCProfile(object):
 			except KeyError:
 				# GC was faster
 				pass
+
+
+class ICCProfileIndex(object):
+
+	"""
+	Persistent index of the profiles in a list of directories.
+	
+	Maps profile paths to header fields (profileClass, colorSpace,
+	connectionColorSpace, version, creator, ID as hex), description and tag
+	signatures. Entries are ADicts, so they can be queried like ICCProfile
+	objects. Directories are only re-listed when their modification time
+	changed, profiles are only re-parsed when their modification time or
+	size changed. The index can be used from several threads.
+	
+	"""
+
+	version = 1
+
+	# Seconds during which find() trusts the directory listings for names
+	# it already knows
+	check_interval = 5
+
+	profile_ext_re = re.compile(r"\.ic[cm]$", re.I)
+
+	def __init__(self, paths, filename=None):
+		self.paths = paths
+		self.filename = filename
+		self.dirs = {}  # Path -> [mtime, subdirectory names, file names]
+		self.profiles = {}  # Path -> ADict
+		self.modified = False
+		self.updated = 0  # time() of the last update
+		self._lock = threading.RLock()
+		if filename:
+			self.load()
+
+	def __contains__(self, path):
+		return path in self.profiles
+
+	def __getitem__(self, path):
+		return self.profiles[path]
+
+	def find(self, name):
+		"""
+		Return the path of the first file with basename name.
+		
+		Directories are searched in order, top-down. The directories are
+		checked for changes (and changed ones re-listed) if name isn't
+		found in the index or check_interval seconds have passed since the
+		last update.
+		
+		"""
+		with self._lock:
+			checked = time() - self.updated < self.check_interval
+			if not checked:
+				self.update(parse=False)
+			path = self._find(name)
+			if checked and (not path or not os.path.isfile(path)):
+				self.update(parse=False)
+				path = self._find(name)
+			return path
+
+	def _find(self, name):
+		for dirpath in self.walk():
+			if name in self.dirs[dirpath][2]:
+				return os.path.join(dirpath, name)
+
+	def get(self, path, default=None):
+		return self.profiles.get(path, default)
+
+	def items(self):
+		""" Return (path, entry) pairs of valid profiles in search order """
+		items = []
+		with self._lock:
+			for dirpath in self.walk():
+				for name in self.dirs[dirpath][2]:
+					path = os.path.join(dirpath, name)
+					entry = self.profiles.get(path)
+					if entry and "profileClass" in entry:
+						items.append((path, entry))
+		return items
+
+	def load(self):
+		try:
+			with open(self.filename, "r") as index:
+				data = json.load(index)
+		except (EnvironmentError, ValueError):
+			return
+		if not isinstance(data, dict) or data.get("version") != self.version:
+			return
+		with self._lock:
+			self.dirs = data.get("dirs", {})
+			self.profiles = dict((path, ADict(entry)) for path, entry in
+								 data.get("profiles", {}).items())
+
+	def save(self):
+		""" Write the index to disk if it changed """
+		with self._lock:
+			if not self.filename or not self.modified:
+				return
+			tmpfilename = self.filename + ".tmp"
+			try:
+				dirname = os.path.dirname(self.filename)
+				if not os.path.isdir(dirname):
+					os.makedirs(dirname)
+				with open(tmpfilename, "w") as index:
+					json.dump({"version": self.version, "dirs": self.dirs,
+							   "profiles": self.profiles}, index)
+				os.replace(tmpfilename, self.filename)
+			except EnvironmentError as exception:
+				safe_print("Warning - could not write profile index:",
+						   exception)
+			else:
+				self.modified = False
+
+	def update(self, parse=True):
+		"""
+		Bring the index up to date.
+		
+		If parse is False, only the directory listings are updated, which
+		is enough for name lookups.
+		
+		"""
+		with self._lock:
+			seen = set()
+			for path in self.paths:
+				self._update_dir(path, seen, parse)
+			for dirpath in list(self.dirs.keys()):
+				if dirpath not in seen:
+					del self.dirs[dirpath]
+					self.modified = True
+			for path in list(self.profiles.keys()):
+				dirpath, name = os.path.split(path)
+				if (dirpath not in self.dirs or
+					name not in self.dirs[dirpath][2]):
+					del self.profiles[path]
+					self.modified = True
+			self.updated = time()
+			self.save()
+
+	def walk(self):
+		""" Yield indexed directories in search order, top-down """
+		seen = set()
+		stack = list(reversed(self.paths))
+		while stack:
+			dirpath = stack.pop()
+			if dirpath in seen or dirpath not in self.dirs:
+				continue
+			seen.add(dirpath)
+			yield dirpath
+			stack.extend(os.path.join(dirpath, name) for name in
+						 reversed(self.dirs[dirpath][1]))
+
+	def _update_dir(self, dirpath, seen, parse):
+		if dirpath in seen:
+			return
+		try:
+			mtime = os.stat(dirpath).st_mtime
+		except EnvironmentError:
+			return
+		seen.add(dirpath)
+		listing = self.dirs.get(dirpath)
+		if not listing or listing[0] != mtime:
+			try:
+				names = sorted(os.listdir(dirpath))
+			except EnvironmentError:
+				names = []
+			dirs = []
+			files = []
+			for name in names:
+				path = os.path.join(dirpath, name)
+				if os.path.isdir(path):
+					if not os.path.islink(path):
+						dirs.append(name)
+				else:
+					files.append(name)
+			listing = self.dirs[dirpath] = [mtime, dirs, files]
+			self.modified = True
+		if parse:
+			for name in listing[2]:
+				if self.profile_ext_re.search(name):
+					self._update_profile(os.path.join(dirpath, name))
+		for name in listing[1]:
+			self._update_dir(os.path.join(dirpath, name), seen, parse)
+
+	def _update_profile(self, path):
+		try:
+			stat = os.stat(path)
+		except EnvironmentError:
+			return
+		entry = self.profiles.get(path)
+		if (entry and entry["mtime"] == stat.st_mtime and
+			entry["size"] == stat.st_size):
+			return
+		entry = ADict(mtime=stat.st_mtime, size=stat.st_size)
+		try:
+			profile = ICCProfile(path, load=False)
+		except (EnvironmentError, ICCProfileInvalidError):
+			pass
+		else:
+			try:
+				entry.update(profileClass=safe_unicode(profile.profileClass),
+							 colorSpace=safe_unicode(profile.colorSpace),
+							 connectionColorSpace=safe_unicode(profile.connectionColorSpace),
+							 version=profile.version,
+							 creator=safe_unicode(profile.creator),
+							 ID=safe_unicode(binascii.hexlify(safe_str(profile.ID))),
+							 description=safe_unicode(profile.getDescription(),
+													  "UTF-8"),
+							 tags=[safe_unicode(tagSignature) for tagSignature
+								   in profile.tags])
+			except Exception as exception:
+				safe_print("Warning - could not index profile %s:" % path,
+						   exception)
+				entry = ADict(mtime=stat.st_mtime, size=stat.st_size)
+			profile.close()
+		self.profiles[path] = entry
+		self.modified = True
+
+
+_profile_index = None
+_profile_index_lock = threading.Lock()
+
+
+def get_profile_index():
+	"""
+	Return the index of the installed profiles (iccprofiles_home and
+	iccprofiles directories)
+	
+	"""
+	global _profile_index
+	with _profile_index_lock:
+		if not _profile_index:
+			_profile_index = ICCProfileIndex(iccprofiles_home +
+											 [path for path in iccprofiles
+											  if path not in iccprofiles_home],
+											 os.path.join(cache, appname,
+														  "iccprofiles.json"))
+	return _profile_index
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental tokenizer for ArgyllCMS tool output
+
+Output is fed in chunks as it is read from the tool. Every line is
+classified once against precompiled patterns, and the resulting events are
+passed to the callbacks subscribed to their type.
+
+"""
+
+import re
+from collections import namedtuple
+
+
+# Event types
+INSTRUMENT = "instrument"  # groups: (name, )
+SERIAL = "serial"  # groups: (serial number, )
+PATCH = "patch"  # groups: (patch number, patch count)
+PATCH_COUNT = "patch_count"  # groups: (patch count, )
+READING = "reading"  # Interactive display adjustment reading ("/ Current")
+INSTRUMENT_REMOVABLE = "instrument_removable"
+RGB = "rgb"  # groups: (R, G, B) sent to the display, 0..1
+PROMPT = "prompt"  # groups: (prompt text, )
+
+
+Event = namedtuple("Event", ("type", "groups", "line"))
+
+
+# Precompiled patterns, also used to check raw output chunks
+INSTRUMENT_RE = re.compile(r"(?:Instrument Type|Product Name|Model|"
+						   r"Identificaton):\s+([^\r\n]+)", re.I)
+SERIAL_RE = re.compile(r"(?:Serial Number):\s+([^\r\n]+)", re.I)
+PATCH_RE = re.compile(r"patch (\d+) of (\d+)", re.I)
+PATCH_COUNT_RE = re.compile(r"Number of patches = (\d+)", re.I)
+READING_RE = re.compile(r"[/\\] current", re.I)
+INSTRUMENT_REMOVABLE_RE = re.compile(r"the instrument can be removed from "
+									 r"the screen", re.I)
+RGB_RE = re.compile(r"Current RGB(?:\s+\d+){3}((?:\s+\d+(?:\.\d+)){3})")
+XYZ_RE = re.compile(r"Result is XYZ:\s+(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)"
+					r"\s+(-?\d+(?:\.\d+)?)")
+PROMPT_RE = re.compile(r"press 1|space when done|key to take a reading|"
+					   r" or Q to |8\) Exit", re.I)
+
+_NEWLINE_RE = re.compile(r"\r\n|\r|\n")
+
+
+def _floats(match):
+	return tuple(float(v) for v in match.groups()[0].split())
+
+
+# (type, pattern, function returning the event groups for a match).
+# The order is the order in which events of a line are emitted.
+_RULES = [(INSTRUMENT, INSTRUMENT_RE, None),
+		  (SERIAL, SERIAL_RE, None),
+		  (PROMPT, PROMPT_RE, lambda match: (match.group(), )),
+		  (PATCH, PATCH_RE, lambda match: tuple(int(v) for v in match.groups())),
+		  (PATCH_COUNT, PATCH_COUNT_RE, lambda match: (int(match.group(1)), )),
+		  (READING, READING_RE, lambda match: ()),
+		  (INSTRUMENT_REMOVABLE, INSTRUMENT_REMOVABLE_RE, lambda match: ()),
+		  (RGB, RGB_RE, _floats)]
+
+# Prompts and progress are not terminated by a line break (Argyll starts
+# progress lines with a carriage return instead), so they are emitted as soon
+# as they appear in an incomplete line. Other events need the complete line.
+_PARTIAL_TYPES = (PROMPT, PATCH, PATCH_COUNT, READING, INSTRUMENT_REMOVABLE)
+
+# Patterns ending in a number. In an incomplete line, the number may continue
+# in the next chunk ("patch 12 of 4" + "5"), so they only match there if
+# something follows.
+_OPEN_ENDED_TYPES = (PATCH, PATCH_COUNT)
+
+
+def tokenize(line, types=None, partial=False):
+	"""
+	Classify a line of output. Return a list of events.
+	
+	types    Only check for these event types (default all)
+	partial  Whether the line is incomplete
+	
+	"""
+	events = []
+	for type, pattern, groups in _RULES:
+		if types is not None and type not in types:
+			continue
+		match = pattern.search(line)
+		if (match and partial and type in _OPEN_ENDED_TYPES and
+			match.end() == len(line)):
+			match = None
+		if match:
+			if groups:
+				groups = groups(match)
+			else:
+				groups = match.groups()
+			events.append(Event(type, groups, line))
+	return events
+
+
+class Tokenizer(object):
+
+	"""
+	Line tokenizer for output chunks
+	
+	Usage:
+	tokenizer = Tokenizer()
+	tokenizer.subscribe(callback, PATCH, RGB)  # callback(event)
+	tokenizer.feed(chunk)
+	
+	"""
+	
+	def __init__(self):
+		self.subscribers = {}
+		self.reset()
+	
+	def feed(self, txt):
+		""" Feed a chunk of output and dispatch events of completed lines """
+		lines = _NEWLINE_RE.split(self._partial + txt)
+		self._partial = lines.pop()
+		for line in lines:
+			self._dispatch(line, None)
+			self._emitted = set()
+		if self._partial:
+			self._dispatch(self._partial, _PARTIAL_TYPES)
+	
+	def reset(self):
+		""" Discard any incomplete line """
+		self._partial = ""
+		self._emitted = set()
+	
+	def subscribe(self, callback, *types):
+		"""
+		Call callback(event) for events of the given types (default all)
+		
+		"""
+		for type in types or [rule[0] for rule in _RULES]:
+			self.subscribers.setdefault(type, []).append(callback)
+	
+	def _dispatch(self, line, types):
+		if not line.strip():
+			return
+		for event in tokenize(line, types, types is not None):
+			if event.type in self._emitted:
+				# Already emitted for the incomplete line
+				continue
+			if types is not None:
+				self._emitted.add(event.type)
+			for callback in self.subscribers.get(event.type, []):
+				callback(event)
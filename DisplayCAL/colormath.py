@@ -13,6 +13,7 @@ import logging
 import math
 import sys
 import warnings
+import weakref
 
 
 def get_transfer_function_phi(alpha, gamma):
@@ -34,6 +35,127 @@ SRGB_K0 = 0.04045  # 0.055 / (2.4 - 1)
 SRGB_P = 12.92  # get_transfer_function_phi(0.055, 2.4)
 
 
+class LRUCache(object):
+
+	"""
+	Dictionary-like cache holding at most maxsize entries
+	
+	When full, the least recently used entry is discarded. Hits, misses and
+	evictions are counted. Caches are registered by name for
+	get_cache_info() and clear_caches().
+	
+	"""
+
+	instances = weakref.WeakSet()
+	missing = object()
+
+	def __init__(self, name, maxsize=128):
+		self.name = name
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._data = {}
+		LRUCache.instances.add(self)
+
+	def __contains__(self, key):
+		return key in self._data
+
+	def __getitem__(self, key):
+		value = self.get(key, self.missing)
+		if value is self.missing:
+			raise KeyError(key)
+		return value
+
+	def __len__(self):
+		return len(self._data)
+
+	def __setstate__(self, state):
+		# Unpickled (e.g. in a multiprocessing worker)
+		self.__dict__.update(state)
+		LRUCache.instances.add(self)
+
+	def __setitem__(self, key, value):
+		data = self._data
+		data.pop(key, None)
+		data[key] = value
+		while len(data) > self.maxsize:
+			try:
+				# Dictionaries keep insertion order, first key is the LRU one
+				del data[next(iter(data))]
+			except (KeyError, RuntimeError, StopIteration):
+				# Changed by another thread
+				break
+			self.evictions += 1
+
+	def clear(self):
+		self._data = {}
+
+	def get(self, key, default=None):
+		data = self._data
+		try:
+			# Re-insert to mark key as most recently used
+			value = data.pop(key)
+		except KeyError:
+			self.misses += 1
+			return default
+		data[key] = value
+		self.hits += 1
+		return value
+
+	def items(self):
+		return list(self._data.items())
+
+
+def _cache_key(value, refs):
+	"""
+	Return a hashable key for value
+	
+	Short lists and tuples are converted to tuples. Long ones (e.g. TRCs)
+	are keyed by identity instead, because converting them on every call
+	is slower than not caching at all. They are appended to refs, which
+	has to be cached together with the result so their ids can't be
+	re-used by other objects while cached.
+	
+	"""
+	if isinstance(value, (list, tuple)):
+		if len(value) > 16:
+			refs.append(value)
+			return ("id", id(value))
+		return tuple(_cache_key(item, refs) for item in value)
+	return value
+
+
+def clear_caches():
+	""" Clear all colormath caches """
+	for cache in list(LRUCache.instances):
+		cache.clear()
+
+
+def get_cache_info():
+	"""
+	Return statistics of the colormath caches
+	
+	Return a dictionary mapping cache names to dictionaries with the number
+	of cache instances, entries (size), maximum entries per instance
+	(maxsize), hits, misses and evictions. Caches with the same name (like
+	the lookup caches of Interp instances) are summed up.
+	
+	"""
+	info = {}
+	for cache in list(LRUCache.instances):
+		stats = info.setdefault(cache.name, {"instances": 0, "size": 0,
+											 "maxsize": cache.maxsize,
+											 "hits": 0, "misses": 0,
+											 "evictions": 0})
+		stats["instances"] += 1
+		stats["size"] += len(cache)
+		stats["hits"] += cache.hits
+		stats["misses"] += cache.misses
+		stats["evictions"] += cache.evictions
+	return info
+
+
 def specialpow(a, b, slope_limit=0):
 	"""
 	Wrapper for power, Rec. 601/709, SMPTE 240M, sRGB and L* functions
@@ -406,24 +528,22 @@ def wp_adaption_matrix(whitepoint_source=None, whitepoint_destination=None,
 	# based on formula http://brucelindbloom.com/Eqn_ChromAdapt.html
 	# cat = adaption matrix or predefined choice ('CAT02', 'Bradford', 
 	# 'Von Kries', 'XYZ Scaling', see cat_matrices), defaults to 'Bradford'
-	cachehash = (tuple(whitepoint_source) if isinstance(whitepoint_source,
-														(list, tuple))
-				 else whitepoint_source,
-				 tuple(whitepoint_destination) if isinstance(whitepoint_destination,
-															 (list, tuple))
-				 else whitepoint_destination,
-				 cat if isinstance(cat, str) else id(cat))
-	if cachehash in wp_adaption_matrix.cache:
-		return wp_adaption_matrix.cache[cachehash]
+	refs = []
+	cachehash = (_cache_key(whitepoint_source, refs),
+				 _cache_key(whitepoint_destination, refs),
+				 _cache_key(cat, refs))
+	cached = wp_adaption_matrix.cache.get(cachehash)
+	if cached is not None:
+		return cached[0]
 	cat = get_cat_matrix(cat)
 	wpam = cat.inverted() * LMS_wp_adaption_matrix(whitepoint_source, 
 												   whitepoint_destination, 
 												   cat) * cat
-	wp_adaption_matrix.cache[cachehash] = wpam
+	wp_adaption_matrix.cache[cachehash] = wpam, refs
 	return wpam
 
 
-wp_adaption_matrix.cache = {}
+wp_adaption_matrix.cache = LRUCache("wp_adaption_matrix.cache", 256)
 
 
 def adapt(X, Y, Z, whitepoint_source=None, whitepoint_destination=None, 
@@ -601,7 +721,7 @@ def smooth_avg(values, passes=1, window=None, protect=None):
 			tmpwindow = window
 			if not protect or j not in protect:
 				while j > 0 and j < len(values) - 1 and len(tmpwindow) >= 3:
-					tl = (len(tmpwindow) - 1) / 2
+					tl = (len(tmpwindow) - 1) // 2
 					# print j, tl, tmpwindow
 					if tl > 0 and j - tl >= 0 and j + tl <= len(values) - 1:
 						windowslice = values[j - tl:j + tl + 1]
@@ -1624,11 +1744,15 @@ def get_rgb_space(rgb_space=None, scale=1.0):
 	""" Return gamma, whitepoint, primaries and RGB -> XYZ matrix """
 	if not rgb_space:
 		rgb_space = "sRGB"
+	refs = []
 	if isinstance(rgb_space, str):
+		cachehash = rgb_space, scale
 		rgb_space = rgb_spaces[rgb_space]
-	cachehash = tuple(map(id, rgb_space[:5])), scale
-	if cachehash in get_rgb_space.cache:
-		return get_rgb_space.cache[cachehash]
+	else:
+		cachehash = _cache_key(rgb_space[:5], refs), scale
+	cached = get_rgb_space.cache.get(cachehash)
+	if cached is not None:
+		return cached[0]
 	gamma = rgb_space[0] or rgb_spaces["sRGB"][0]
 	whitepoint = get_whitepoint(rgb_space[1] or rgb_spaces["sRGB"][1], scale)
 	rx, ry, rY = rxyY = rgb_space[2] or rgb_spaces["sRGB"][2]
@@ -1636,7 +1760,7 @@ def get_rgb_space(rgb_space=None, scale=1.0):
 	bx, by, bY = bxyY = rgb_space[4] or rgb_spaces["sRGB"][4]
 	matrix = rgb_to_xyz_matrix(rx, ry, gx, gy, bx, by, whitepoint, scale)
 	rgb_space = gamma, whitepoint, rxyY, gxyY, bxyY, matrix
-	get_rgb_space.cache[cachehash] = rgb_space
+	get_rgb_space.cache[cachehash] = rgb_space, refs
 	return rgb_space
 
 
@@ -1656,7 +1780,7 @@ def get_rgb_space_primaries_wp_xy(rgb_space=None, digits=4):
 	return xy
 
 
-get_rgb_space.cache = {}
+get_rgb_space.cache = LRUCache("get_rgb_space.cache", 64)
 
 
 def get_standard_illuminant(illuminant_name="D50",
@@ -1665,8 +1789,9 @@ def get_standard_illuminant(illuminant_name="D50",
 							scale=1.0):
 	""" Return a standard illuminant as XYZ coordinates. """
 	cachehash = illuminant_name, tuple(priority), scale
-	if cachehash in get_standard_illuminant.cache:
-		return get_standard_illuminant.cache[cachehash]
+	illuminant = get_standard_illuminant.cache.get(cachehash)
+	if illuminant is not None:
+		return illuminant
 	illuminant = None
 	for standard_name in priority:
 		if not standard_name in standard_illuminants:
@@ -1680,7 +1805,8 @@ def get_standard_illuminant(illuminant_name="D50",
 	raise ValueError('Unrecognized illuminant "%s"' % illuminant_name)
 
 
-get_standard_illuminant.cache = {}
+get_standard_illuminant.cache = LRUCache("get_standard_illuminant.cache",
+										   64)
 
 
 def get_whitepoint(whitepoint=None, scale=1.0, planckian=False):
@@ -1690,8 +1816,9 @@ def get_whitepoint(whitepoint=None, scale=1.0, planckian=False):
 	if not whitepoint:
 		whitepoint = "D50"
 	cachehash = whitepoint, scale, planckian
-	if cachehash in get_whitepoint.cache:
-		return get_whitepoint.cache[cachehash]
+	cached = get_whitepoint.cache.get(cachehash)
+	if cached is not None:
+		return cached
 	if isinstance(whitepoint, str):
 		whitepoint = get_standard_illuminant(whitepoint)
 	elif isinstance(whitepoint, (float, int)):
@@ -1713,7 +1840,7 @@ def get_whitepoint(whitepoint=None, scale=1.0, planckian=False):
 	return whitepoint
 
 
-get_whitepoint.cache = {}
+get_whitepoint.cache = LRUCache("get_whitepoint.cache", 256)
 
 
 def make_monotonically_increasing(iterable, passes=0, window=None):
@@ -2245,13 +2372,15 @@ def XYZ2RGB(X, Y, Z, rgb_space=None, scale=1.0, round_=False, clamp=True,
 		if oetf:
 			RGB[i] = oetf(v)
 		elif isinstance(gamma, (list, tuple)):
-			key = id(gamma)
-			if not key in XYZ2RGB.interp:
+			refs = []
+			key = _cache_key(gamma, refs)
+			cached = XYZ2RGB.interp.get(key)
+			if cached is None:
 				ginterp = Interp(gamma, [n / float(len(gamma) - 1) for n in
 									     range(len(gamma))], use_numpy=True)
-				XYZ2RGB.interp[key] = ginterp
+				XYZ2RGB.interp[key] = ginterp, refs
 			else:
-				ginterp = XYZ2RGB.interp[key]
+				ginterp = cached[0]
 			RGB[i] = ginterp(v)
 		else:
 			RGB[i] = specialpow(v, 1.0 / gamma)
@@ -2261,7 +2390,7 @@ def XYZ2RGB(X, Y, Z, rgb_space=None, scale=1.0, round_=False, clamp=True,
 	return RGB
 
 
-XYZ2RGB.interp = {}
+XYZ2RGB.interp = LRUCache("XYZ2RGB.interp", 32)
 
 
 def XYZ2xyY(X, Y, Z, whitepoint=None):
@@ -2824,13 +2953,15 @@ class Interp(object):
 		self.fp = fp
 		self.left = left
 		self.right = right
-		self.lookup = {}
+		self.lookup = LRUCache("Interp.lookup", 65536)
 		self.use_numpy = use_numpy
 
 	def __call__(self, x):
-		if not x in self.lookup:
-			self.lookup[x] = self._interp(x)
-		return self.lookup[x]
+		y = self.lookup.get(x)
+		if y is None:
+			y = self._interp(x)
+			self.lookup[x] = y
+		return y
 
 	def _interp(self, x):
 		if self.use_numpy:
@@ -2840,6 +2971,143 @@ class Interp(object):
 		
 
 
+class ColorSpaceTransform(object):
+
+	"""
+	Precompiled conversion from an RGB space to XYZ or L*a*b* (or back)
+	
+	rgb_space can be anything get_rgb_space accepts, or an ICCProfile with
+	matrix/TRC tags. The RGB space, the forward and inverse matrix, the
+	per-channel transfer functions and the whitepoint adaptation are
+	resolved once. The results are the same as those of RGB2XYZ, RGB2Lab,
+	XYZ2RGB and Lab2RGB with the same arguments.
+	
+	Call the instance with three values to convert a single color, or with
+	an array of shape (..., 3) to convert many colors at once (requires
+	NumPy).
+	
+	"""
+
+	def __init__(self, rgb_space=None, pcs="XYZ", inverse=False, scale=1.0,
+				 round_=False, clamp=True, whitepoint=None, noadapt=False,
+				 cat="Bradford"):
+		if hasattr(rgb_space, "get_rgb_space"):
+			# ICCProfile
+			rgb_space = rgb_space.get_rgb_space()
+			if not rgb_space:
+				raise ValueError("Profile has no matrix/TRC tags")
+		if not pcs in ("XYZ", "Lab"):
+			raise ValueError("Invalid PCS %r" % pcs)
+		self.rgb_space = rgb_space
+		self.pcs = pcs
+		self.inverse = inverse
+		self.scale = scale
+		self.round_ = round_
+		self.clamp = clamp
+		self.noadapt = noadapt
+		(trc, rgb_whitepoint, rxyY, gxyY, bxyY,
+		 self.matrix) = get_rgb_space(rgb_space)
+		self.imatrix = self.matrix.inverted()
+		if not isinstance(trc, (list, tuple)):
+			trc = (trc, ) * 3
+		self.trc = trc
+		self._eotf = []
+		self._oetf = []
+		for gamma in trc:
+			if isinstance(gamma, (list, tuple)):
+				xp = [n / float(len(gamma) - 1) for n in range(len(gamma))]
+				self._eotf.append(lambda v, xp=xp, fp=gamma: interp(v, xp, fp))
+				self._oetf.append(Interp(gamma, xp, use_numpy=True))
+			else:
+				self._eotf.append(lambda v, gamma=gamma: specialpow(v, gamma))
+				self._oetf.append(lambda v, gamma=1.0 / gamma:
+								  specialpow(v, gamma))
+		# L*a*b* whitepoint as used by XYZ2Lab (scale 100) and Lab2XYZ
+		self.whitepoint = get_whitepoint(whitepoint)
+		self._Lab_whitepoint = get_whitepoint(whitepoint, 100)
+		if pcs == "Lab" and not noadapt:
+			if inverse:
+				self.adapt_matrix = wp_adaption_matrix(None, rgb_whitepoint,
+													   cat)
+			else:
+				self.adapt_matrix = wp_adaption_matrix(rgb_whitepoint,
+													   whitepoint, cat)
+		else:
+			self.adapt_matrix = None
+		self._arrays = None
+
+	def __call__(self, *values):
+		if len(values) == 1:
+			return self.apply(values[0])
+		if self.inverse:
+			if self.pcs == "Lab":
+				values = Lab2XYZ(*values, whitepoint=self.whitepoint)
+				if self.adapt_matrix:
+					values = self.adapt_matrix * values
+			RGB = self.imatrix * values
+			for i, v in enumerate(RGB):
+				if self.clamp:
+					v = min(1.0, max(0.0, v))
+				RGB[i] = self._oetf[i](v) * self.scale
+				if self.round_ is not False:
+					RGB[i] = round(RGB[i], self.round_)
+			return RGB
+		R, G, B = values
+		XYZ = self.matrix * (self._eotf[0](R), self._eotf[1](G),
+							 self._eotf[2](B))
+		if self.pcs == "Lab":
+			XYZ = [v * 100 for v in XYZ]
+			if self.adapt_matrix:
+				XYZ = self.adapt_matrix * XYZ
+			return XYZ2Lab(*XYZ, whitepoint=self._Lab_whitepoint)
+		return tuple(v * self.scale for v in XYZ)
+
+	def apply(self, values):
+		""" Convert an array of shape (..., 3) """
+		import numpy
+		import colormath_batch as batch
+		if not self._arrays:
+			self._arrays = (numpy.array(self.matrix).T,
+							numpy.array(self.imatrix).T,
+							self.adapt_matrix and
+							numpy.array(self.adapt_matrix).T,
+							[numpy.linspace(0, 1, len(gamma))
+							 if isinstance(gamma, (list, tuple)) else None
+							 for gamma in self.trc])
+		matrix, imatrix, adapt_matrix, xp = self._arrays
+		values = numpy.asarray(values, dtype=numpy.float64)
+		if self.inverse:
+			if self.pcs == "Lab":
+				values = batch.Lab2XYZ(values, self.whitepoint)
+				if adapt_matrix is not None:
+					values = values.dot(adapt_matrix)
+			RGB = values.dot(imatrix)
+			if self.clamp:
+				RGB = numpy.clip(RGB, 0.0, 1.0)
+			for i, gamma in enumerate(self.trc):
+				if xp[i] is not None:
+					RGB[..., i] = numpy.interp(RGB[..., i], gamma, xp[i])
+				else:
+					RGB[..., i] = batch.specialpow(RGB[..., i], 1.0 / gamma)
+			RGB *= self.scale
+			if self.round_ is not False:
+				RGB = numpy.round(RGB, self.round_)
+			return RGB
+		RGB = values.copy()
+		for i, gamma in enumerate(self.trc):
+			if xp[i] is not None:
+				RGB[..., i] = numpy.interp(RGB[..., i], xp[i], gamma)
+			else:
+				RGB[..., i] = batch.specialpow(RGB[..., i], gamma)
+		XYZ = RGB.dot(matrix)
+		if self.pcs == "Lab":
+			XYZ *= 100
+			if adapt_matrix is not None:
+				XYZ = XYZ.dot(adapt_matrix)
+			return batch.XYZ2Lab(XYZ, self._Lab_whitepoint)
+		return XYZ * self.scale
+
+
 class BT1886(object):
 	# Adapted from ArgyllCMS xicc/xicc.c
 
@@ -3518,25 +3786,19 @@ optimalcolors_Lab = [(52.40, 95.40, 10.58),
 def debug_caches():
 	from log import safe_print
 
-	for cache in ("XYZ2RGB.interp",
-				  "wp_adaption_matrix.cache",
-				  "get_rgb_space.cache",
-				  "get_standard_illuminant.cache",
-				  "get_whitepoint.cache"):
-		cn, ck = cache.split(".")
-		c = getattr(globals()[cn], ck)
-		count = 0
-		seen = {}
-		for k, v in c.items():
-			for kk, vv in c.items():
-				# Check for equality, not identity
-				if k != kk and v == vv and not kk in seen:
-					count += 1
-					seen[kk] = True
-		safe_print(cache, len(c), "entries", max(count - 1, 0), "duplicates")
-		if count > 1:
-			for k, v in c.items():
-				safe_print(k, v)
+	for name, stats in sorted(get_cache_info().items()):
+		safe_print(name, "%(size)i entries (max %(maxsize)i per instance, "
+				   "%(instances)i instances), %(hits)i hits, %(misses)i misses, "
+				   "%(evictions)i evictions" % stats)
+
+
+def __getattr__(name):
+	# Array versions of the conversion functions are available as
+	# colormath.batch. They require NumPy, so only import them on first use.
+	if name == "batch":
+		import colormath_batch
+		return colormath_batch
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 if "--debug-caches" in sys.argv[1:]:
@@ -0,0 +1,858 @@
+# -*- coding: utf-8 -*-
+
+"""
+Array-in/array-out counterparts of colormath functions (colormath.batch)
+
+Each function takes NumPy arrays (or anything numpy.asarray accepts) where
+the last axis holds the color components, e.g. an array of shape (N, 3) of
+XYZ or L*a*b* values, and returns an array of the same shape. Arguments
+other than the colors (whitepoints, RGB spaces etc.) have the same meaning
+as for the scalar functions in colormath, and the results match those of the
+scalar functions to within floating point precision.
+
+Transfer functions passed as 'eotf'/'oetf' need to accept and return arrays.
+
+Run this module as script to compare the speed of both implementations.
+
+"""
+
+import math
+import sys
+import time
+import warnings
+
+import numpy
+
+import colormath
+from colormath import (LSTAR_E, LSTAR_K, REC709_K0, REC709_P, SMPTE240M_K0,
+					   SMPTE240M_P, SMPTE2084_C1, SMPTE2084_C2, SMPTE2084_C3,
+					   SMPTE2084_M1, SMPTE2084_M2, SRGB_K0, SRGB_P)
+
+
+def _matrix(matrix):
+	return numpy.array(matrix, dtype=numpy.float64)
+
+
+def _dot(values, matrix):
+	""" Multiply each color in values by 3x3 matrix """
+	return numpy.asarray(values, dtype=numpy.float64).dot(_matrix(matrix).T)
+
+
+def _split(values):
+	values = numpy.asarray(values, dtype=numpy.float64)
+	return values[..., 0], values[..., 1], values[..., 2]
+
+
+def _stack(*components):
+	return numpy.stack(numpy.broadcast_arrays(*components), axis=-1)
+
+
+def specialpow(a, b, slope_limit=0):
+	"""
+	Wrapper for power, Rec. 601/709, SMPTE 240M, sRGB, L* and SMPTE 2084
+	functions (see colormath.specialpow)
+
+	"""
+	a = numpy.asarray(a, dtype=numpy.float64)
+	negative = a < 0.0
+	v = numpy.abs(a)
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		if b >= 0.0:
+			# Power curve
+			v = v ** b
+			v = numpy.where(negative, -v, v)
+			if slope_limit:
+				v = numpy.where(negative, numpy.minimum(v, a / slope_limit),
+								numpy.maximum(v, a / slope_limit))
+			return v
+		if b in (1.0 / -601, 1.0 / -709):
+			v = numpy.where(v < REC709_K0 / REC709_P, v * REC709_P,
+							1.099 * v ** 0.45 - 0.099)
+		elif b == 1.0 / -240:
+			v = numpy.where(v < SMPTE240M_K0 / SMPTE240M_P, v * SMPTE240M_P,
+							1.1115 * v ** 0.45 - 0.1115)
+		elif b == 1.0 / -3.0:
+			v = numpy.where(v <= LSTAR_E, 0.01 * v * LSTAR_K,
+							1.16 * v ** (1.0 / 3.0) - 0.16)
+		elif b == 1.0 / -2.4:
+			v = numpy.where(v <= SRGB_K0 / SRGB_P, v * SRGB_P,
+							1.055 * v ** (1.0 / 2.4) - 0.055)
+		elif b == 1.0 / -2084:
+			v = ((2413.0 * (v ** SMPTE2084_M1) + 107) /
+				 (2392.0 * (v ** SMPTE2084_M1) + 128)) ** SMPTE2084_M2
+		elif b == -2.4:
+			v = numpy.where(v <= SRGB_K0, v / SRGB_P,
+							((v + 0.055) / 1.055) ** 2.4)
+		elif b == -3.0:
+			v = numpy.where(v <= 0.08, 100.0 * v / LSTAR_K,
+							((v + 0.16) / 1.16) ** 3.0)
+		elif b == -240:
+			v = numpy.where(v < SMPTE240M_K0, v / SMPTE240M_P,
+							((0.1115 + v) / 1.1115) ** (1.0 / 0.45))
+		elif b in (-601, -709):
+			v = numpy.where(v < REC709_K0, v / REC709_P,
+							((v + .099) / 1.099) ** (1.0 / 0.45))
+		elif b == -2084:
+			p = v ** (1.0 / SMPTE2084_M2)
+			v = (numpy.maximum(p - SMPTE2084_C1, 0) /
+				 (SMPTE2084_C2 - SMPTE2084_C3 * p)) ** (1.0 / SMPTE2084_M1)
+		else:
+			raise ValueError("Invalid gamma %r" % b)
+	return numpy.where(negative, -v, v)
+
+
+def adapt(XYZ, whitepoint_source=None, whitepoint_destination=None,
+		  cat="Bradford"):
+	"""
+	Transform XYZ under source illuminant to XYZ under destination illuminant
+
+	"""
+	return _dot(XYZ, colormath.wp_adaption_matrix(whitepoint_source,
+												  whitepoint_destination, cat))
+
+
+def XYZ2Lab(XYZ, whitepoint=None, scale=100):
+	"""
+	Convert from XYZ to Lab.
+
+	The input Y value needs to be in the nominal range [0.0, scale].
+
+	"""
+	r = (numpy.asarray(XYZ, dtype=numpy.float64) /
+		 colormath.get_whitepoint(whitepoint, scale))
+	f = numpy.where(r > LSTAR_E, numpy.cbrt(r), (LSTAR_K * r + 16) / 116.0)
+	return _stack(116 * f[..., 1] - 16,
+				  500 * (f[..., 0] - f[..., 1]),
+				  200 * (f[..., 1] - f[..., 2]))
+
+
+def Lab2XYZ(Lab, whitepoint=None, scale=1.0):
+	"""
+	Convert from Lab to XYZ.
+
+	The output XYZ values are in the nominal range [0.0, scale].
+
+	"""
+	L, a, b = _split(Lab)
+	fy = (L + 16) / 116.0
+	fx = a / 500.0 + fy
+	fz = fy - b / 200.0
+	xr = numpy.where(fx ** 3 > LSTAR_E, fx ** 3, (116.0 * fx - 16) / LSTAR_K)
+	yr = numpy.where(L > LSTAR_K * LSTAR_E, fy ** 3, L / LSTAR_K)
+	zr = numpy.where(fz ** 3 > LSTAR_E, fz ** 3, (116.0 * fz - 16) / LSTAR_K)
+	return _stack(xr, yr, zr) * colormath.get_whitepoint(whitepoint, scale)
+
+
+def Lab2LCHab(Lab):
+	L, a, b = _split(Lab)
+	H = numpy.degrees(numpy.arctan2(b, a))
+	return _stack(L, numpy.hypot(a, b), numpy.where(H < 0, H + 360.0, H))
+
+
+def LCHab2Lab(LCH):
+	L, C, H = _split(LCH)
+	return _stack(L, C * numpy.cos(H * math.pi / 180.0),
+				  C * numpy.sin(H * math.pi / 180.0))
+
+
+def xyY2XYZ(xyY):
+	""" Convert from xyY to XYZ (see colormath.xyY2XYZ) """
+	x, y, Y = _split(xyY)
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		XYZ = _stack(x * Y / y, Y, (1 - x - y) * Y / y)
+	return numpy.where((y == 0)[..., numpy.newaxis], 0.0, XYZ)
+
+
+def apply_bpc(XYZ, bp_in=None, bp_out=None, wp_out="D50"):
+	"""
+	Apply black point compensation (see colormath.apply_bpc)
+
+	Weighting and pinning the chromaticity are not supported.
+
+	"""
+	bp_in = numpy.array(bp_in or (0, 0, 0), dtype=numpy.float64)
+	bp_out = numpy.array(bp_out or (0, 0, 0), dtype=numpy.float64)
+	wp_out = numpy.array(colormath.get_whitepoint(wp_out), dtype=numpy.float64)
+	XYZ = numpy.asarray(XYZ, dtype=numpy.float64)
+	return (((wp_out - bp_out) * XYZ - wp_out * (bp_in - bp_out)) /
+			(wp_out - bp_in))
+
+
+def blend_ab(XYZ, bp, wp, power=40.0, signscale=1):
+	""" Blend a* b* towards black (see colormath.blend_ab) """
+	XYZ = numpy.asarray(XYZ, dtype=numpy.float64)
+	Lab = XYZ2Lab(XYZ, whitepoint=wp)
+	bpL, bpa, bpb = colormath.XYZ2Lab(*bp, whitepoint=wp)
+	if bpL == 100:
+		raise ValueError("Black L* is 100!")
+	vv = 1.0 - (Lab[..., 0] - bpL) / (100.0 - bpL)  # 1 at bp, 0 at wp
+	vv = numpy.clip(vv, 0.0, 1.0) ** power * signscale
+	Lab[..., 1] += vv * bpa
+	Lab[..., 2] += vv * bpb
+	return numpy.where((XYZ[..., 1] < 0)[..., numpy.newaxis], 0.0,
+					   Lab2XYZ(Lab, whitepoint=wp))
+
+
+def blend_blackpoint(XYZ, bp_in=None, bp_out=None, wp=None, power=40.0):
+	"""
+	Blend to destination black as L approaches black, optionally compensating
+	for input black first (see colormath.blend_blackpoint)
+
+	"""
+	wp = colormath.get_whitepoint(wp)
+	for i, bp in enumerate((bp_in, bp_out)):
+		if not bp or tuple(bp) == (0, 0, 0):
+			continue
+		bp_wp = tuple(v / wp[1] * bp[1] for v in wp)
+		if i == 0:
+			XYZ = blend_ab(XYZ, bp, wp, power, -1)
+			XYZ = apply_bpc(XYZ, bp_wp, None, wp)
+		else:
+			XYZ = apply_bpc(XYZ, None, bp_wp, wp)
+			XYZ = blend_ab(XYZ, bp, wp, power, 1)
+	return XYZ
+
+
+def smooth_avg(values, passes=1, window=None, protect=None):
+	"""
+	Smooth values along the last axis (moving average, see
+	colormath.smooth_avg)
+
+	protect is an optional boolean array of the same shape as values. Values
+	where it is True are left unchanged.
+
+	"""
+	if not window or len(window) < 3 or len(window) % 2 != 1:
+		if window:
+			warnings.warn("Invalid window %r, size %i - using default (1, 1, 1)" %
+						  (window, len(window)), Warning)
+		window = (1.0, 1.0, 1.0)
+	values = numpy.array(values, dtype=numpy.float64)
+	count = values.shape[-1]
+	# The window shrinks towards both ends, the first and last value are
+	# left unchanged
+	tl = (len(window) - 1) // 2
+	j = numpy.arange(count)
+	half = numpy.minimum(numpy.minimum(j, count - 1 - j), tl)
+	for x in range(passes):
+		data = values.copy()
+		for h in range(1, tl + 1):
+			columns = numpy.nonzero(half == h)[0]
+			if not len(columns):
+				continue
+			tmpwindow = window[tl - h:tl + h + 1]
+			windowsize = 0
+			for k, weight in enumerate(tmpwindow):
+				windowsize = (windowsize + float(weight) *
+							  values[..., columns - h + k])
+			data[..., columns] = windowsize / sum(tmpwindow)
+		if protect is not None:
+			data = numpy.where(protect, values, data)
+		values = data
+	return values
+
+
+def DICOM(j, inverse=False):
+	"""
+	DICOM Grayscale Standard Display Function (see colormath.DICOM)
+
+	"""
+	j = numpy.asarray(j, dtype=numpy.float64)
+	if inverse:
+		log10Y = numpy.log10(j)
+		coeffs = (71.498068, 94.593053, 41.912053, 9.8247004, 0.28175407,
+				  -1.1878455, -0.18014349, 0.14710899, -0.017046845)
+		return sum(c * log10Y ** i for i, c in enumerate(coeffs))
+	logj = numpy.log(j)
+	a = -1.3011877
+	b = -2.5840191E-2
+	c = 8.0242636E-2
+	d = -1.0320229E-1
+	e = 1.3646699E-1
+	f = 2.8745620E-2
+	g = -2.5468404E-2
+	h = -3.1978977E-3
+	k = 1.2992634E-4
+	m = 1.3635334E-3
+	return ((a + c * logj + e * logj ** 2 + g * logj ** 3 + m * logj ** 4)
+			/
+			(1 + b * logj + d * logj ** 2 + f * logj ** 3 + h * logj ** 4 +
+			 k * logj ** 5))
+
+
+def get_gamma(values, scale=1.0, vmin=0.0, vmax=1.0, average=True,
+			  least_squares=False):
+	"""
+	Return average or least squares gamma or an array of gamma values
+	(see colormath.get_gamma)
+
+	values is an array of (x, y) pairs. If neither average nor least_squares
+	is set, one gamma value per pair is returned, NaN where it is undefined
+	(the scalar function omits those).
+
+	"""
+	values = numpy.asarray(values, dtype=numpy.float64)
+	vmin /= scale
+	vmax /= scale
+	x = values[..., 0] / scale
+	y = (values[..., 1] / scale - vmin) * (vmax + vmin)
+	valid = (x > 0) & (x < 1) & (y > 0)
+	logx = numpy.log(numpy.where(valid, x, 0.5))
+	logy = numpy.log(numpy.where(valid, y, 0.5))
+	if least_squares:
+		if not valid.any():
+			return 0
+		return (numpy.sum((logx * logy)[valid]) /
+				numpy.sum((logx ** 2)[valid]))
+	gammas = numpy.where(valid, logy / logx, numpy.nan)
+	if average:
+		if not valid.any():
+			return 0
+		return numpy.mean(gammas[valid])
+	return gammas
+
+
+def apply_bt1886(XYZ, bt1886):
+	"""
+	Apply BT.1886 black offset and gamma curve (see colormath.BT1886.apply)
+
+	bt1886 is a colormath.BT1886 instance.
+
+	"""
+	RGB = _dot(XYZ, bt1886.bwd_matrix)
+	if bt1886.apply_trc:
+		# Convert linear light to Rec709 transfer curve
+		RGB = numpy.where(RGB < 0.018, 4.5 * RGB,
+						  1.099 * numpy.maximum(RGB, 0.018) ** 0.45 - 0.099)
+	# Apply input offset
+	RGB = RGB + bt1886.ingo
+	# Apply power and scale
+	if bt1886.apply_trc:
+		scaled = bt1886.outsc * numpy.maximum(RGB, 0) ** bt1886.gamma
+	else:
+		scaled = RGB * bt1886.outsc
+	RGB = numpy.where(RGB > 0.0, scaled, RGB)
+	# Apply output portion of offset
+	RGB += bt1886.outo
+	Lab = XYZ2Lab(_dot(RGB, bt1886.fwd_matrix) * 100)
+	# Blend ab to required black point offset as L approaches black
+	vv = 1.0 - (Lab[..., 0] - bt1886.outL) / (100.0 - bt1886.outL)
+	vv = numpy.clip(vv, 0.0, 1.0) ** 40.0
+	Lab += vv[..., numpy.newaxis] * numpy.array(bt1886.tab)
+	return Lab2XYZ(Lab)
+
+
+def _apply_trc(RGB, trc, fn):
+	RGB = numpy.array(RGB, dtype=numpy.float64)
+	is_trc = isinstance(trc, (list, tuple))
+	for i in range(3):
+		if is_trc:
+			gamma = trc[i]
+		else:
+			gamma = trc
+		RGB[..., i] = fn(RGB[..., i], gamma)
+	return RGB
+
+
+def RGB2XYZ(RGB, rgb_space=None, scale=1.0, eotf=None):
+	""" Convert from RGB to XYZ (see colormath.RGB2XYZ) """
+	trc, whitepoint, rxyY, gxyY, bxyY, matrix = colormath.get_rgb_space(rgb_space)
+	def fn(v, gamma):
+		if eotf:
+			return eotf(v)
+		elif isinstance(gamma, (list, tuple)):
+			return numpy.interp(v, numpy.linspace(0, 1, len(gamma)), gamma)
+		return specialpow(v, gamma)
+	return _dot(_apply_trc(RGB, trc, fn), matrix) * scale
+
+
+def XYZ2RGB(XYZ, rgb_space=None, scale=1.0, round_=False, clamp=True,
+			oetf=None):
+	""" Convert from XYZ to RGB (see colormath.XYZ2RGB) """
+	trc, whitepoint, rxyY, gxyY, bxyY, matrix = colormath.get_rgb_space(rgb_space)
+	def fn(v, gamma):
+		if clamp:
+			v = numpy.clip(v, 0.0, 1.0)
+		if oetf:
+			return oetf(v)
+		elif isinstance(gamma, (list, tuple)):
+			return numpy.interp(v, gamma, numpy.linspace(0, 1, len(gamma)))
+		return specialpow(v, 1.0 / gamma)
+	RGB = _apply_trc(_dot(XYZ, matrix.inverted()), trc, fn) * scale
+	if round_ is not False:
+		RGB = numpy.round(RGB, round_)
+	return RGB
+
+
+def RGB2Lab(RGB, rgb_space=None, whitepoint=None, noadapt=False,
+			cat="Bradford"):
+	XYZ = RGB2XYZ(RGB, rgb_space, scale=100)
+	if not noadapt:
+		rgb_space = colormath.get_rgb_space(rgb_space)
+		XYZ = adapt(XYZ, rgb_space[1], whitepoint, cat)
+	return XYZ2Lab(XYZ, whitepoint=whitepoint)
+
+
+def Lab2RGB(Lab, rgb_space=None, scale=1.0, round_=False, clamp=True,
+			whitepoint=None, whitepoint_source=None, noadapt=False,
+			cat="Bradford"):
+	""" Convert from Lab to RGB """
+	XYZ = Lab2XYZ(Lab, whitepoint)
+	if not noadapt:
+		rgb_space = colormath.get_rgb_space(rgb_space)
+		XYZ = adapt(XYZ, whitepoint_source, rgb_space[1], cat)
+	return XYZ2RGB(XYZ, rgb_space, scale, round_, clamp)
+
+
+def delta(Lab1, Lab2, method="1976", p1=None, p2=None, p3=None,
+		  cie94_use_symmetric_chrominance=True):
+	"""
+	Compute the delta of two arrays of samples (see colormath.delta)
+
+	Returns a dict with the same keys as colormath.delta, with arrays as
+	values.
+
+	"""
+	L1, a1, b1 = _split(Lab1)
+	L2, a2, b2 = _split(Lab2)
+	if isinstance(method, str):
+		method = method.lower()
+	else:
+		method = str(int(method))
+	C1 = numpy.hypot(a1, b1)
+	C2 = numpy.hypot(a2, b2)
+	if method in ("00", "2k", "2000", "cie00", "cie2k", "cie2000"):
+		pow25_7 = math.pow(25, 7)
+		k_L = p1 if isinstance(p1, (float, int)) else 1.0
+		k_C = p2 if isinstance(p2, (float, int)) else 1.0
+		k_H = p3 if isinstance(p3, (float, int)) else 1.0
+		C_avg = (C1 + C2) / 2.0
+		G = .5 * (1 - numpy.sqrt(C_avg ** 7 / (C_avg ** 7 + pow25_7)))
+		a1_ = (1 + G) * a1
+		a2_ = (1 + G) * a2
+		C1_ = numpy.hypot(a1_, b1)
+		C2_ = numpy.hypot(a2_, b2)
+		h1_ = numpy.where((a1_ == 0) & (b1 == 0), 0,
+						  numpy.degrees(numpy.arctan2(b1, a1_)) +
+						  numpy.where(b1 >= 0, 0, 360.0))
+		h2_ = numpy.where((a2_ == 0) & (b2 == 0), 0,
+						  numpy.degrees(numpy.arctan2(b2, a2_)) +
+						  numpy.where(b2 >= 0, 0, 360.0))
+		dh = h2_ - h1_
+		dh_ = numpy.where(dh > 180, dh - 360.0,
+						  numpy.where(dh < -180, dh + 360.0, dh))
+		dL = L2 - L1
+		dC = C2_ - C1_
+		dH = 2 * numpy.sqrt(C1_ * C2_) * numpy.sin(numpy.radians(dh_ / 2.0))
+		L__avg = (L1 + L2) / 2.0
+		C__avg = (C1_ + C2_) / 2.0
+		h_avg = (h1_ + h2_) / 2.0
+		h__avg = numpy.where(C1_ * C2_ == 0, h1_ + h2_,
+							 numpy.where(numpy.abs(dh) <= 180, h_avg,
+										 numpy.where(h2_ + h1_ < 360,
+													 h_avg + 180.0,
+													 h_avg - 180.0)))
+		AB = (L__avg - 50.0) ** 2
+		S_L = 1 + .015 * AB / numpy.sqrt(20.0 + AB)
+		S_C = 1 + .045 * C__avg
+		T = (1 - .17 * numpy.cos(numpy.radians(h__avg - 30.0)) +
+			 .24 * numpy.cos(numpy.radians(2.0 * h__avg)) +
+			 .32 * numpy.cos(numpy.radians(3.0 * h__avg + 6.0)) -
+			 .2 * numpy.cos(numpy.radians(4 * h__avg - 63.0)))
+		S_H = 1 + .015 * C__avg * T
+		dTheta = 30.0 * numpy.exp(-1 * ((h__avg - 275.0) / 25.0) ** 2)
+		R_C = 2.0 * numpy.sqrt(C__avg ** 7 / (C__avg ** 7 + pow25_7))
+		R_T = -numpy.sin(numpy.radians(2.0 * dTheta)) * R_C
+		dLw = dL / S_L / k_L
+		dCw = dC / S_C / k_C
+		dHw = dH / S_H / k_H
+		dE = numpy.sqrt(dLw ** 2 + dCw ** 2 + dHw ** 2 + R_T * dCw * dHw)
+	else:
+		dL = L2 - L1
+		dC = C2 - C1
+		dH2 = (a1 - a2) ** 2 + (b1 - b2) ** 2 - dC ** 2
+		dH = numpy.sqrt(numpy.maximum(dH2, 0))
+		if method in ("94", "1994", "cie94", "cie1994"):
+			textiles = p1
+			K1 = 0.048 if textiles else 0.045
+			K2 = 0.014 if textiles else 0.015
+			if cie94_use_symmetric_chrominance:
+				C_ = numpy.sqrt(C1 * C2)
+			else:
+				C_ = C1
+			SC = 1.0 + K1 * C_
+			SH = 1.0 + K2 * C_
+			KL = 2.0 if textiles else 1.0
+			dLw, dCw, dHw = dL / KL, dC / SC, dH / SH
+			dE = numpy.sqrt(dLw ** 2 + dCw ** 2 + dHw ** 2)
+		elif method in ("cmc(2:1)", "cmc21", "cmc(1:1)", "cmc11", "cmc"):
+			if method in ("cmc(2:1)", "cmc21"):
+				p1 = 2.0
+			l = p1 if isinstance(p1, (float, int)) else 1.0
+			c = p2 if isinstance(p2, (float, int)) else 1.0
+			SL = numpy.where(L1 < 16, 0.511,
+							 (0.040975 * L1) / (1 + 0.01765 * L1))
+			SC = (0.0638 * C1) / (1 + 0.0131 * C1) + 0.638
+			F = numpy.sqrt(C1 ** 4 / (C1 ** 4 + 1900.0))
+			H1 = (numpy.degrees(numpy.arctan2(b1, a1)) +
+				  numpy.where(b1 >= 0, 0, 360.0))
+			T = numpy.where((164 <= H1) & (H1 <= 345),
+							0.56 + numpy.abs(0.2 * numpy.cos(numpy.radians(H1 + 168.0))),
+							0.36 + numpy.abs(0.4 * numpy.cos(numpy.radians(H1 + 35))))
+			SH = SC * (F * T + 1 - F)
+			dLw, dCw, dHw = dL / (l * SL), dC / (c * SC), dH / SH
+			dE = numpy.sqrt(dLw ** 2 + dCw ** 2 + dHw ** 2)
+		else:
+			# dE 1976
+			dLw, dCw, dHw = dL, dC, dH
+			dE = numpy.sqrt(dL ** 2 + (a1 - a2) ** 2 + (b1 - b2) ** 2)
+	return {"E": dE,
+			"L": dL,
+			"C": dC,
+			"H": dH,
+			"a": a1 - a2,
+			"b": b1 - b2,
+			# Weighted
+			"Lw": dLw,
+			"Cw": dCw,
+			"Hw": dHw}
+
+
+# DIN99 family
+
+def DIN99familyab2DIN99CH(a99, b99):
+	C99 = numpy.hypot(a99, b99)
+	h99ef = numpy.arctan2(b99, a99)
+	h99ef = numpy.where((a99 > 0) & (b99 < 0), 2 * math.pi + h99ef, h99ef)
+	h99ef = numpy.where(a99 == 0,
+						numpy.where(b99 > 0, math.pi / 2,
+									numpy.where(b99 < 0, (3 * math.pi) / 2,
+												0.0)),
+						h99ef)
+	return C99, h99ef * 180 / math.pi
+
+
+def DIN99familyCH2DIN99ab(C99, H99):
+	h99ef = H99 * math.pi / 180
+	return C99 * numpy.cos(h99ef), C99 * numpy.sin(h99ef)
+
+
+def DIN99familyLHCG2Lab(L99, H99, C99, G, kE, l1, l2, deg, f1):
+	L = (numpy.exp((L99 * kE) / l1) - 1) / l2
+	h99ef = H99 * math.pi / 180
+	e = G * numpy.cos(h99ef)
+	f = G * numpy.sin(h99ef)
+	rad = deg * math.pi / 180
+	a = e * math.cos(rad) - (f / f1) * math.sin(rad)
+	b = e * math.sin(rad) + (f / f1) * math.cos(rad)
+	return _stack(L, a, b)
+
+
+def DIN99familyLCH2Lab(LCH99, x, l1, l2, deg, f1, c1, c2, whitepoint=None,
+					   kE=1.0, hdeg=None):
+	L99, C99, H99 = _split(LCH99)
+	G = (numpy.exp(C99 / c1) - 1) / c2
+	if hdeg is None:
+		hdeg = deg
+	Lab = DIN99familyLHCG2Lab(L99, H99 - hdeg, C99, G, kE, l1, l2, deg, f1)
+	if x:
+		whitepoint99d = colormath.XYZ2DIN99cdXYZ(*colormath.get_whitepoint(whitepoint,
+																		   100),
+												 x=x)
+		XYZ = Lab2XYZ(Lab, whitepoint99d, scale=100)
+		XYZ = DIN99cdXYZ2XYZ(XYZ, x)
+		Lab = XYZ2Lab(XYZ, whitepoint)
+	return Lab
+
+
+def DIN99cdXYZ2XYZ(XYZ, x):
+	X, Y, Z = _split(XYZ)
+	return _stack((X + x * Z) / (1 + x), Y, Z)
+
+
+def XYZ2DIN99cdXYZ(XYZ, x):
+	X, Y, Z = _split(XYZ)
+	return _stack((1 + x) * X - x * Z, Y, Z)
+
+
+def Lab2DIN99familyLGhrad(Lab, kE, l1, l2, deg, f1):
+	L, a, b = _split(Lab)
+	L99 = (1.0 / kE) * l1 * numpy.log(1 + l2 * L)
+	rad = deg * math.pi / 180
+	if rad:
+		ar = math.cos(rad)  # a rotation term
+		br = math.sin(rad)  # b rotation term
+		e = a * ar + b * br
+		f = f1 * (b * ar - a * br)
+	else:
+		e = a
+		f = f1 * b
+	G = numpy.hypot(e, f)
+	h99ef = numpy.arctan2(f, e)
+	return L99, G, h99ef, rad
+
+
+def Lab2DIN99familyLCH(Lab, l1, l2, deg, f1, c1, c2, kE=1.0, hdeg=None):
+	L99, G, h99ef, rad = Lab2DIN99familyLGhrad(Lab, kE, l1, l2, deg, f1)
+	C99 = c1 * numpy.log(1 + c2 * G)
+	if hdeg is None:
+		hdeg = deg
+	H99 = h99ef * 180 / math.pi + hdeg
+	return _stack(L99, C99, H99)
+
+
+def _LCH2Lab99(LCH99):
+	L99, C99, H99 = _split(LCH99)
+	return _stack(L99, *DIN99familyCH2DIN99ab(C99, H99))
+
+
+def _Lab992LCH(Lab99):
+	L99, a99, b99 = _split(Lab99)
+	return _stack(L99, *DIN99familyab2DIN99CH(a99, b99))
+
+
+def Lab2DIN99LCH(Lab, kCH=1.0, kE=1.0):
+	return Lab2DIN99familyLCH(Lab, 105.51, .0158, 16, .7,
+							  1 / (0.045 * kCH * kE), 0.045, kE, 0)
+
+
+def Lab2DIN99bLCH(Lab, kE=1.0):
+	return Lab2DIN99familyLCH(Lab, 303.67, .0039, 26, .83, 23, .075)
+
+
+def Lab2DIN99oLCH(Lab, kCH=1.0, kE=1.0):
+	return Lab2DIN99familyLCH(Lab, 303.67, .0039, 26, .83,
+							  1 / (0.0435 * kCH * kE), .075, kE)
+
+
+def Lab2DIN99(Lab, kCH=1.0, kE=1.0):
+	return _LCH2Lab99(Lab2DIN99LCH(Lab, kCH, kE))
+
+
+def Lab2DIN99b(Lab, kE=1.0):
+	return _LCH2Lab99(Lab2DIN99bLCH(Lab, kE))
+
+
+def Lab2DIN99o(Lab, kCH=1.0, kE=1.0):
+	return _LCH2Lab99(Lab2DIN99oLCH(Lab, kCH, kE))
+
+
+def Lab2DIN99c(Lab, kE=1.0, whitepoint=None):
+	return XYZ2DIN99c(Lab2XYZ(Lab, whitepoint, scale=100), whitepoint)
+
+
+def Lab2DIN99d(Lab, kE=1.0, whitepoint=None):
+	return XYZ2DIN99d(Lab2XYZ(Lab, whitepoint, scale=100), whitepoint)
+
+
+def XYZ2DIN99cdLCH(XYZ, x, l1, l2, deg, f1, c1, c2, whitepoint=None):
+	XYZ = XYZ2DIN99cdXYZ(XYZ, x)
+	whitepoint99d = colormath.XYZ2DIN99cdXYZ(*colormath.get_whitepoint(whitepoint,
+																	   100),
+											 x=x)
+	Lab = XYZ2Lab(XYZ, whitepoint99d)
+	return Lab2DIN99familyLCH(Lab, l1, l2, deg, f1, c1, c2)
+
+
+def XYZ2DIN99cd(XYZ, x, l1, l2, deg, f1, c1, c2, whitepoint=None):
+	return _LCH2Lab99(XYZ2DIN99cdLCH(XYZ, x, l1, l2, deg, f1, c1, c2,
+									 whitepoint))
+
+
+def XYZ2DIN99(XYZ, whitepoint=None):
+	XYZ = numpy.maximum(numpy.asarray(XYZ, dtype=numpy.float64), 0)
+	return Lab2DIN99(XYZ2Lab(XYZ, whitepoint))
+
+
+def XYZ2DIN99b(XYZ, whitepoint=None):
+	return Lab2DIN99b(XYZ2Lab(XYZ, whitepoint))
+
+
+def XYZ2DIN99o(XYZ, whitepoint=None):
+	return Lab2DIN99o(XYZ2Lab(XYZ, whitepoint))
+
+
+def XYZ2DIN99bLCH(XYZ, whitepoint=None):
+	return Lab2DIN99bLCH(XYZ2Lab(XYZ, whitepoint))
+
+
+def XYZ2DIN99oLCH(XYZ, whitepoint=None):
+	return Lab2DIN99oLCH(XYZ2Lab(XYZ, whitepoint))
+
+
+def XYZ2DIN99c(XYZ, whitepoint=None):
+	return XYZ2DIN99cd(XYZ, .1, 317.651, .0037, 0, .94, 23, .066, whitepoint)
+
+
+def XYZ2DIN99d(XYZ, whitepoint=None):
+	return XYZ2DIN99cd(XYZ, .12, 325.221, .0036, 50, 1.14, 22.5, .06,
+					   whitepoint)
+
+
+def XYZ2DIN99dLCH(XYZ, whitepoint=None):
+	return XYZ2DIN99cdLCH(XYZ, .12, 325.221, .0036, 50, 1.14, 22.5, .06,
+						  whitepoint)
+
+
+def DIN992Lab(Lab99, kCH=1.0, kE=1.0):
+	return DIN99familyLCH2Lab(_Lab992LCH(Lab99), 0, 105.51, .0158, 16, .7,
+							  1 / (0.045 * kCH * kE), 0.045, kE=kE, hdeg=0)
+
+
+def DIN99b2Lab(Lab99):
+	return DIN99familyLCH2Lab(_Lab992LCH(Lab99), 0, 303.67, .0039, 26, .83, 23,
+							  .075)
+
+
+def DIN99o2Lab(Lab99, kCH=1.0, kE=1.0):
+	return DIN99familyLCH2Lab(_Lab992LCH(Lab99), 0, 303.67, .0039, 26, .83,
+							  1 / (0.0435 * kCH * kE), .075, kE=kE)
+
+
+def DIN99bLCH2Lab(LCH99):
+	return DIN99familyLCH2Lab(LCH99, 0, 303.67, .0039, 26, .83, 23, .075)
+
+
+def DIN99c2Lab(Lab99, whitepoint=None):
+	return DIN99familyLCH2Lab(_Lab992LCH(Lab99), .1, 317.651, .0037, 0, .94, 23,
+							  .066, whitepoint)
+
+
+def DIN99d2Lab(Lab99, whitepoint=None):
+	return DIN99familyLCH2Lab(_Lab992LCH(Lab99), .12, 325.221, .0036, 50, 1.14,
+							  22.5, .06, whitepoint)
+
+
+def DIN99dLCH2Lab(LCH99, whitepoint=None):
+	return DIN99familyLCH2Lab(LCH99, .12, 325.221, .0036, 50, 1.14, 22.5, .06,
+							  whitepoint)
+
+
+# ICtCp and IPT
+
+def pq_oetf(E):
+	return specialpow(E, 1.0 / -2084)
+
+
+def pq_eotf(v):
+	return specialpow(v, -2084)
+
+
+def _identity(v):
+	return v
+
+
+def LinearRGB2ICtCp(RGB, oetf=pq_oetf):
+	""" Rec. 2020 linear RGB to non-linear ICtCp """
+	LMS = _dot(RGB, colormath.LinearRGB2LMS_matrix)
+	return _dot(oetf(LMS), colormath.L_M_S_2ICtCp_matrix)
+
+
+def ICtCp2LinearRGB(ICtCp, eotf=pq_eotf):
+	""" Non-linear ICtCp to Rec. 2020 linear RGB """
+	L_M_S_ = _dot(ICtCp, colormath.ICtCp2L_M_S__matrix)
+	return _dot(eotf(L_M_S_), colormath.LMS2LinearRGB_matrix)
+
+
+def XYZ2ICtCp(XYZ, clamp=False, oetf=pq_oetf):
+	RGB = XYZ2RGB(XYZ, "Rec. 2020", clamp=clamp, oetf=_identity)
+	return LinearRGB2ICtCp(RGB, oetf)
+
+
+def ICtCp2XYZ(ICtCp, eotf=pq_eotf):
+	RGB = ICtCp2LinearRGB(ICtCp, eotf)
+	return RGB2XYZ(RGB, "Rec. 2020", eotf=_identity)
+
+
+def RGB2ICtCp(RGB, rgb_space="Rec. 2020", eotf=pq_eotf, clamp=False,
+			  oetf=pq_oetf):
+	""" R'G'B' to ICtCp """
+	return XYZ2ICtCp(RGB2XYZ(RGB, rgb_space, eotf=eotf), clamp, oetf)
+
+
+def ICtCp2RGB(ICtCp, rgb_space="Rec. 2020", eotf=pq_eotf, clamp=False,
+			  oetf=pq_oetf):
+	""" ICtCp to R'G'B' """
+	return XYZ2RGB(ICtCp2XYZ(ICtCp, eotf), rgb_space, clamp=clamp, oetf=oetf)
+
+
+def XYZ2IPT(XYZ):
+	LMS = _dot(XYZ, colormath.get_cat_matrix("IPT"))
+	LMS = numpy.where(LMS >= 0, numpy.abs(LMS) ** 0.43,
+					  -numpy.abs(LMS) ** 0.43)
+	return _dot(LMS, colormath.LMS2IPT_matrix)
+
+
+def IPT2XYZ(IPT):
+	LMS = _dot(IPT, colormath.IPT2LMS_matrix)
+	LMS = numpy.where(LMS >= 0, numpy.abs(LMS) ** (1 / 0.43),
+					  -numpy.abs(LMS) ** (1 / 0.43))
+	return _dot(LMS, colormath.get_cat_matrix("IPT").inverted())
+
+
+def benchmark(n=100000, out=sys.stdout):
+	"""
+	Compare speed and results of the scalar and batch implementations
+
+	"""
+	rnd = numpy.random.RandomState(0)
+	XYZ = rnd.uniform(0, 1, (n, 3))
+	XYZ100 = XYZ * 100
+	RGB = rnd.uniform(0, 1, (n, 3))
+	Lab = XYZ2Lab(XYZ100)
+	Lab2 = Lab + rnd.uniform(-5, 5, (n, 3))
+	ICtCp = XYZ2ICtCp(XYZ)
+	bt1886 = colormath.BT1886(colormath.get_rgb_space()[-1], (.005, .005, .005),
+							  0.0, 2.4)
+	tests = [("XYZ2Lab", XYZ100, colormath.XYZ2Lab, XYZ2Lab),
+			 ("Lab2XYZ", Lab, colormath.Lab2XYZ, Lab2XYZ),
+			 ("RGB2XYZ", RGB, colormath.RGB2XYZ, RGB2XYZ),
+			 ("XYZ2RGB", XYZ, colormath.XYZ2RGB, XYZ2RGB),
+			 ("RGB2Lab", RGB, colormath.RGB2Lab, RGB2Lab),
+			 ("Lab2RGB", Lab, colormath.Lab2RGB, Lab2RGB),
+			 ("adapt", XYZ, lambda X, Y, Z: colormath.adapt(X, Y, Z, "D50",
+															"D65"),
+			  lambda XYZ: adapt(XYZ, "D50", "D65")),
+			 ("Lab2DIN99", Lab, colormath.Lab2DIN99, Lab2DIN99),
+			 ("Lab2DIN99o", Lab, colormath.Lab2DIN99o, Lab2DIN99o),
+			 ("XYZ2DIN99d", XYZ100, colormath.XYZ2DIN99d, XYZ2DIN99d),
+			 ("DIN99d2Lab", XYZ2DIN99d(XYZ100), colormath.DIN99d2Lab,
+			  DIN99d2Lab),
+			 ("XYZ2ICtCp", XYZ, colormath.XYZ2ICtCp, XYZ2ICtCp),
+			 ("ICtCp2XYZ", ICtCp, colormath.ICtCp2XYZ, ICtCp2XYZ),
+			 ("blend_bp", XYZ,
+			  lambda X, Y, Z: colormath.blend_blackpoint(X, Y, Z, None,
+														 (.005, .004, .003)),
+			  lambda XYZ: blend_blackpoint(XYZ, None, (.005, .004, .003))),
+			 ("BT1886", XYZ, bt1886.apply,
+			  lambda XYZ: apply_bt1886(XYZ, bt1886)),
+			 ("XYZ2IPT", XYZ, colormath.XYZ2IPT, XYZ2IPT),
+			 ("IPT2XYZ", XYZ2IPT(XYZ), colormath.IPT2XYZ, IPT2XYZ)]
+	for method in ("76", "94", "cmc", "2000"):
+		tests.append(("delta %s" % method, (Lab, Lab2),
+					  lambda L1, a1, b1, L2, a2, b2, method=method:
+						[colormath.delta(L1, a1, b1, L2, a2, b2, method)["E"]],
+					  lambda Lab1, Lab2, method=method:
+						delta(Lab1, Lab2, method)["E"][..., numpy.newaxis]))
+	out.write("%-14s %12s %12s %9s %12s\n" % ("Function", "Scalar (s)",
+											  "Batch (s)", "Speedup",
+											  "Max. diff"))
+	for name, values, scalar_fn, batch_fn in tests:
+		if isinstance(values, tuple):
+			rows = numpy.hstack(values).tolist()
+		else:
+			rows = values.tolist()
+			values = (values, )
+		ts = time.time()
+		scalar = numpy.array([list(scalar_fn(*row)) for row in rows])
+		ts = time.time() - ts
+		tb = time.time()
+		batch = batch_fn(*values)
+		tb = time.time() - tb
+		out.write("%-14s %12.4f %12.4f %8.1fx %12.3g\n" %
+				  (name, ts, tb, ts / max(tb, 1e-9),
+				   numpy.abs(scalar - batch).max()))
+
+
+if __name__ == "__main__":
+	benchmark(*[int(arg) for arg in sys.argv[1:2]])
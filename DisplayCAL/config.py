@@ -1447,38 +1447,45 @@ def get_standard_profiles(paths_only=False):
 		# Other profiles installed on the system
 		other_icc = []
 		rex = re.compile("\.ic[cm]$", re.IGNORECASE)
-		for icc_dir in set(iccprofiles + iccprofiles_home):
-			for dirpath, dirnames, basenames in os.walk(icc_dir):
-				for basename in filter(rex.search, basenames):
-					filename, ext = os.path.splitext(basename.lower())
-					if (filename.endswith("_bas") or
-						filename.endswith("_eci") or
-						filename.endswith("adobergb1998") or
-						filename.startswith("eci-rgb") or
-						filename.startswith("ecirgb") or
-						filename.startswith("ekta space") or
-						filename.startswith("ektaspace") or
-						filename.startswith("fogra") or
-						filename.startswith("gracol") or
-						filename.startswith("iso") or
-						filename.startswith("lstar-") or
-						filename.startswith("pso") or
-						filename.startswith("prophoto") or
-						filename.startswith("psr_") or
-						filename.startswith("psrgravure") or
-						filename.startswith("snap") or
-						filename.startswith("srgb") or
-						filename.startswith("swop") or
-						filename in ("applergb",
-									 "bestrgb",
-									 "betargb",
-									 "brucergb",
-									 "ciergb",
-									 "cie-rgb",
-									 "colormatchrgb",
-									 "donrgb",
-									 "widegamutrgb")):
-						other_icc.append(os.path.join(dirpath, basename))
+		index = ICCP.get_profile_index()
+		index.update()
+		for path, entry in index.items():
+			# Skip profiles that can't qualify based on their indexed header
+			if (entry.version >= 4 or entry.profileClass == "nmcl" or
+				entry.colorSpace == "GRAY" or
+				entry.connectionColorSpace not in ("Lab", "XYZ")):
+				continue
+			basename = os.path.basename(path)
+			if rex.search(basename):
+				filename, ext = os.path.splitext(basename.lower())
+				if (filename.endswith("_bas") or
+					filename.endswith("_eci") or
+					filename.endswith("adobergb1998") or
+					filename.startswith("eci-rgb") or
+					filename.startswith("ecirgb") or
+					filename.startswith("ekta space") or
+					filename.startswith("ektaspace") or
+					filename.startswith("fogra") or
+					filename.startswith("gracol") or
+					filename.startswith("iso") or
+					filename.startswith("lstar-") or
+					filename.startswith("pso") or
+					filename.startswith("prophoto") or
+					filename.startswith("psr_") or
+					filename.startswith("psrgravure") or
+					filename.startswith("snap") or
+					filename.startswith("srgb") or
+					filename.startswith("swop") or
+					filename in ("applergb",
+								 "bestrgb",
+								 "betargb",
+								 "brucergb",
+								 "ciergb",
+								 "cie-rgb",
+								 "colormatchrgb",
+								 "donrgb",
+								 "widegamutrgb")):
+					other_icc.append(path)
 		for path in ref_icc + other_icc:
 			try:
 				profile = ICCP.ICCProfile(path, load=False, use_cache=True)
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-process gamut volume and coverage calculation
+
+The device gamut surface of a RGB profile is sampled on the faces of the
+device RGB cube, looked up in L*a*b* and triangulated. Volumes and
+intersections of gamut surfaces are computed by casting rays along the L*
+axis through a regular a*b* grid. Reference gamuts are read from Argyll
+gamut (.gam) files.
+
+"""
+
+import os
+import threading
+
+from config import get_data_path
+from util_io import GzipFileProper
+import ICCProfile as ICCP
+import colormath
+
+
+# Reference gamuts used for profile gamut coverage metadata
+STANDARD_GAMUTS = [("srgb", "sRGB"),
+				   ("adobe-rgb", "ClayRGB1998"),
+				   ("dci-p3", "SMPTE431_P3")]
+
+# Profile and reference gamuts (with their ray crossings) and coverage
+# results. Cleared by colormath.clear_caches()
+_cache = colormath.LRUCache("gamut", 8)
+_cache_lock = threading.Lock()
+
+
+class Gamut(object):
+
+	"""
+	Closed triangulated gamut surface in L*a*b*
+	
+	vertices   NumPy array of shape (n, 3) with L*a*b* values
+	triangles  NumPy array of shape (m, 3) with vertex indexes
+	
+	"""
+	
+	def __init__(self, vertices, triangles):
+		import numpy
+		self.vertices = numpy.asarray(vertices, numpy.float64)
+		self.triangles = numpy.asarray(triangles, numpy.intp)
+		self._columns = {}
+	
+	@classmethod
+	def from_gam(cls, path):
+		""" Read an Argyll gamut surface (.gam) file """
+		if path.lower().endswith(".gz"):
+			opener = GzipFileProper
+		else:
+			opener = open
+		with opener(path, "rb") as gam:
+			lines = gam.read().decode("UTF-8", "replace").splitlines()
+		tables = []
+		fields = []
+		data = None
+		for line in lines:
+			line = line.strip()
+			if line.startswith("BEGIN_DATA_FORMAT"):
+				fields = None
+			elif line.startswith("END_DATA_FORMAT"):
+				pass
+			elif fields is None:
+				fields = line.split()
+			elif line.startswith("BEGIN_DATA"):
+				data = []
+			elif line.startswith("END_DATA"):
+				tables.append((fields, data))
+				data = None
+			elif data is not None and line:
+				data.append(line.split())
+		vertices = None
+		triangles = None
+		for fields, data in tables:
+			if "LAB_L" in fields:
+				index = fields.index("VERTEX_NO")
+				columns = [fields.index(name) for name in
+						   ("LAB_L", "LAB_A", "LAB_B")]
+				vertices = {}
+				for row in data:
+					vertices[int(row[index])] = [float(row[i]) for i in columns]
+			elif "VERTEX_0" in fields:
+				columns = [fields.index(name) for name in
+						   ("VERTEX_0", "VERTEX_1", "VERTEX_2")]
+				triangles = [[int(row[i]) for i in columns] for row in data]
+		if not vertices or not triangles:
+			raise ValueError("Not a gamut surface file: %s" % path)
+		# Vertex numbers are not necessarily contiguous
+		ids = sorted(vertices)
+		remap = dict((vid, i) for i, vid in enumerate(ids))
+		return cls([vertices[vid] for vid in ids],
+				   [[remap[vid] for vid in triangle] for triangle in triangles])
+	
+	@classmethod
+	def from_profile(cls, profile, intent="r", steps=33):
+		"""
+		Sample the device gamut surface of a RGB profile
+		
+		steps  Number of samples along each edge of the device RGB cube
+		
+		"""
+		import numpy
+		t = numpy.linspace(0, 1, steps)
+		u, v = [a.ravel() for a in numpy.meshgrid(t, t, indexing="ij")]
+		# Grid cells as two triangles (indexes into the face's grid)
+		i, j = [a.ravel() for a in numpy.meshgrid(numpy.arange(steps - 1),
+												  numpy.arange(steps - 1),
+												  indexing="ij")]
+		p00 = i * steps + j
+		p10 = p00 + steps
+		face_triangles = numpy.concatenate([numpy.stack([p00, p10, p10 + 1], 1),
+											numpy.stack([p00, p10 + 1, p00 + 1],
+														1)])
+		RGB = []
+		triangles = []
+		for axis in range(3):
+			for value in (0.0, 1.0):
+				face = numpy.empty((len(u), 3))
+				face[:, axis] = value
+				face[:, [k for k in range(3) if k != axis]] = numpy.stack([u, v],
+																		  1)
+				tri = face_triangles + len(RGB) * len(u)
+				# Orient triangles so their normals point out of the RGB cube
+				normal = numpy.cross(face[face_triangles[:, 1]] -
+									 face[face_triangles[:, 0]],
+									 face[face_triangles[:, 2]] -
+									 face[face_triangles[:, 0]])[:, axis]
+				if (normal[0] > 0) != (value > 0):
+					tri = tri[:, ::-1]
+				RGB.append(face)
+				triangles.append(tri)
+		Lab = lookup(profile, numpy.concatenate(RGB), intent)
+		return cls(Lab, numpy.concatenate(triangles))
+	
+	@property
+	def volume(self):
+		""" Enclosed volume in cubic L*a*b* units """
+		import numpy
+		v0, v1, v2 = [self.vertices[self.triangles[:, i]] for i in range(3)]
+		return abs(numpy.einsum("ij,ij->", v0, numpy.cross(v1, v2))) / 6.0
+	
+	def _orientation(self):
+		import numpy
+		v0, v1, v2 = [self.vertices[self.triangles[:, i]] for i in range(3)]
+		return numpy.sign(numpy.einsum("ij,ij->", v0, numpy.cross(v1, v2)))
+	
+	def columns(self, resolution=1.0):
+		"""
+		Return surface crossings of rays along L* through an a*b* grid
+		
+		Return column indexes, L* values and weights (+1 entering the gamut,
+		-1 leaving it) as NumPy arrays.
+		
+		"""
+		if resolution in self._columns:
+			return self._columns[resolution]
+		import numpy
+		# Vertex coordinates in grid units. The slight offset avoids rays
+		# hitting vertices and edges exactly.
+		ab = self.vertices[:, 1:] / resolution + 512.5 + 1e-7
+		L = self.vertices[:, 0]
+		t = self.triangles
+		ab0, ab1, ab2 = ab[t[:, 0]], ab[t[:, 1]], ab[t[:, 2]]
+		e1 = ab1 - ab0
+		e2 = ab2 - ab0
+		d = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+		# Triangles parallel to the L* axis are not crossed
+		use = numpy.abs(d) > 1e-12
+		t, ab0, e1, e2, d = t[use], ab0[use], e1[use], e2[use], d[use]
+		abs_ = ab[t]
+		lo = numpy.ceil(abs_.min(axis=1) - .5).astype(numpy.intp)
+		hi = numpy.floor(abs_.max(axis=1) - .5).astype(numpy.intp)
+		count = numpy.maximum(hi - lo + 1, 0)
+		n = count[:, 0] * count[:, 1]
+		# Candidate columns for each triangle
+		tri = numpy.repeat(numpy.arange(len(t)), n)
+		k = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n, n)
+		ia = lo[tri, 0] + k // numpy.maximum(count[tri, 1], 1)
+		ib = lo[tri, 1] + k % numpy.maximum(count[tri, 1], 1)
+		p = numpy.stack([ia + .5, ib + .5], 1) - ab0[tri]
+		s = (p[:, 0] * e2[tri, 1] - p[:, 1] * e2[tri, 0]) / d[tri]
+		r = (e1[tri, 0] * p[:, 1] - e1[tri, 1] * p[:, 0]) / d[tri]
+		inside = (s >= 0) & (r >= 0) & (s + r <= 1)
+		tri, ia, ib, s, r = tri[inside], ia[inside], ib[inside], s[inside], r[inside]
+		L0, L1, L2 = [L[t[tri, i]] for i in range(3)]
+		crossing_L = L0 + s * (L1 - L0) + r * (L2 - L0)
+		# Outward normal pointing up (+L*) means leaving the gamut
+		weight = -numpy.sign(d[tri]) * self._orientation()
+		result = ia * 1024 + ib, crossing_L, weight
+		self._columns[resolution] = result
+		return result
+	
+	def intersect_volume(self, *others, **kwargs):
+		"""
+		Return the volume of the intersection with other gamuts
+		
+		Without other gamuts, return the enclosed volume computed the same way
+		(useful as denominator for coverage ratios).
+		
+		"""
+		import numpy
+		resolution = kwargs.get("resolution", 1.0)
+		gamuts = (self, ) + others
+		columns = []
+		L = []
+		weights = []
+		for i, gamut in enumerate(gamuts):
+			c, l, w = gamut.columns(resolution)
+			columns.append(c)
+			L.append(l)
+			w_i = numpy.zeros((len(w), len(gamuts)))
+			w_i[:, i] = w
+			weights.append(w_i)
+		columns = numpy.concatenate(columns)
+		L = numpy.concatenate(L)
+		weights = numpy.concatenate(weights)
+		order = numpy.lexsort((L, columns))
+		columns, L, weights = columns[order], L[order], weights[order]
+		# Winding number of each gamut after each crossing, per column
+		winding = numpy.cumsum(weights, axis=0)
+		start = numpy.r_[True, columns[1:] != columns[:-1]]
+		column_start = numpy.maximum.accumulate(numpy.where(start,
+															numpy.arange(len(L)),
+															0))
+		winding -= (winding - weights)[column_start]
+		inside = (winding > 0).all(axis=1)
+		same_column = columns[1:] == columns[:-1]
+		length = numpy.where(inside[:-1] & same_column, L[1:] - L[:-1], 0)
+		return length.sum() * resolution ** 2
+
+
+def _curve(tag, values):
+	""" Apply a TRC tag to values in range 0..1 """
+	import numpy
+	if isinstance(tag, ICCP.CurveType):
+		if not len(tag):
+			return values
+		if len(tag) == 1:
+			return values ** tag[0]
+		table = numpy.asarray(tag, numpy.float64) / 65535.0
+		return numpy.interp(values, numpy.linspace(0, 1, len(table)), table)
+	elif isinstance(tag, ICCP.ParametricCurveType):
+		return numpy.array([tag.apply(v) for v in values.ravel()]).reshape(
+			values.shape)
+	raise NotImplementedError("Unsupported TRC tag type %r" %
+							  tag.__class__.__name__)
+
+
+def _lut16(lut, RGB):
+	""" Apply a lut16 A2B tag to RGB values in range 0..1 """
+	import numpy
+	values = RGB.copy()
+	for i in range(3):
+		table = numpy.asarray(lut.input[i], numpy.float64) / 65535.0
+		values[:, i] = numpy.interp(values[:, i],
+									numpy.linspace(0, 1, len(table)), table)
+	clut = lut.clut_asarray().astype(numpy.float64) / 65535.0
+	gridsteps = clut.shape[1]
+	clut = clut.reshape((gridsteps, gridsteps, gridsteps, -1))
+	# Trilinear interpolation
+	pos = numpy.clip(values, 0, 1) * (gridsteps - 1)
+	index = numpy.minimum(pos.astype(numpy.intp), gridsteps - 2)
+	frac = pos - index
+	out = 0
+	for corner in range(8):
+		offset = [(corner >> (2 - i)) & 1 for i in range(3)]
+		w = numpy.ones(len(values))
+		for i in range(3):
+			w *= frac[:, i] if offset[i] else 1 - frac[:, i]
+		out = out + w[:, numpy.newaxis] * clut[index[:, 0] + offset[0],
+											   index[:, 1] + offset[1],
+											   index[:, 2] + offset[2]]
+	for i in range(out.shape[1]):
+		table = numpy.asarray(lut.output[i], numpy.float64) / 65535.0
+		out[:, i] = numpy.interp(out[:, i], numpy.linspace(0, 1, len(table)),
+								 table)
+	return out
+
+
+def lookup(profile, RGB, intent="r"):
+	"""
+	Forward lookup of RGB values (NumPy array of shape (n, 3), range 0..1)
+	
+	Return L*a*b* (relative to D50 unless intent is absolute colorimetric).
+	Supports RGB matrix/TRC and lut16 (A2B) profiles.
+	
+	"""
+	import numpy
+	if profile.colorSpace != "RGB":
+		raise NotImplementedError("Unsupported color space %s" %
+								  profile.colorSpace)
+	tags = profile.tags
+	tagname = {"p": "A2B0", "r": "A2B1", "a": "A2B1",
+			   "s": "A2B2"}.get(intent, "A2B0")
+	if not tagname in tags:
+		tagname = "A2B0"
+	if tagname in tags:
+		lut = tags[tagname]
+		if not isinstance(lut, ICCP.LUT16Type):
+			raise NotImplementedError("Unsupported %s tag type %r" %
+									  (tagname, lut.__class__.__name__))
+		out = _lut16(lut, RGB)
+		if profile.connectionColorSpace == "Lab":
+			# Legacy 16-bit L*a*b* encoding
+			Lab = out * (65535 / 65280.0) * numpy.array([100.0, 255.0, 255.0])
+			Lab[:, 1:] -= 128
+			XYZ = colormath.batch.Lab2XYZ(Lab)
+		else:
+			XYZ = out * (65535 / 32768.0)
+	else:
+		for component in "rgb":
+			if not "%sXYZ" % component in tags or not "%sTRC" % component in tags:
+				raise NotImplementedError("No A2B or matrix/TRC tags")
+		linear = numpy.stack([_curve(tags["%sTRC" % component], RGB[:, i])
+							  for i, component in enumerate("rgb")], 1)
+		matrix = numpy.array([list(tags["%sXYZ" % component].values())
+							  for component in "rgb"])
+		XYZ = linear.dot(matrix)
+	if intent == "a" and "wtpt" in tags:
+		# Absolute colorimetric
+		XYZ = colormath.batch.adapt(XYZ, "D50", list(tags.wtpt.ir.values()))
+	return colormath.batch.XYZ2Lab(XYZ * 100)
+
+
+def get_reference_gamut(name):
+	""" Return reference gamut by name (file in ref/) or path """
+	key = ("ref", name)
+	with _cache_lock:
+		if key in _cache:
+			return _cache[key]
+	if os.path.isabs(name):
+		path = name
+	else:
+		path = get_data_path("ref/%s.gam" % name)
+	if not path:
+		raise IOError("Reference gamut not found: %s" % name)
+	gamut = Gamut.from_gam(path)
+	with _cache_lock:
+		_cache[key] = gamut
+	return gamut
+
+
+def get_gamut_volume_coverage(profile, intent="r", comparison_gamuts=None,
+							  steps=33, resolution=1.0):
+	"""
+	Calculate gamut volume and coverage of a RGB profile in-process.
+	
+	profile            ICCProfile instance or path
+	comparison_gamuts  List of (key, name) tuples. Name is a reference gamut
+	                   in ref/ or a .gam/.icc/.icm path (default
+	                   STANDARD_GAMUTS)
+	
+	Return gamut volume (float, scaled to sRGB = 1.0) and coverage (dict) as
+	tuple, like Worker.calculate_gamut. Results are cached by profile ID and
+	parameters.
+	
+	"""
+	if not isinstance(profile, ICCP.ICCProfile):
+		profile = ICCP.ICCProfile(profile)
+	if comparison_gamuts is None:
+		comparison_gamuts = STANDARD_GAMUTS
+	profile_id = profile.ID
+	if not profile_id or profile_id == "\0" * 16:
+		profile_id = profile.calculateID(False)
+	key = (profile_id, intent, tuple(comparison_gamuts), steps, resolution)
+	with _cache_lock:
+		if key in _cache:
+			volume, coverage = _cache[key]
+			return volume, dict(coverage)
+	profile_gamut = get_profile_gamut(profile, intent, steps, profile_id)
+	volume = float(profile_gamut.volume / ICCP.GAMUT_VOLUME_SRGB)
+	coverage = {}
+	for comparison_key, name in comparison_gamuts:
+		if os.path.splitext(name)[1].lower() in (".icc", ".icm"):
+			gamut = get_profile_gamut(ICCP.ICCProfile(name), intent, steps)
+		else:
+			gamut = get_reference_gamut(name)
+		reference_volume = gamut.intersect_volume(resolution=resolution)
+		if reference_volume:
+			coverage[comparison_key] = float(gamut.intersect_volume(
+												profile_gamut,
+												resolution=resolution) /
+											 reference_volume)
+	with _cache_lock:
+		_cache[key] = volume, coverage
+	return volume, dict(coverage)
+
+
+def get_profile_gamut(profile, intent="r", steps=33, profile_id=None):
+	""" Return the (cached) device gamut surface of a RGB profile """
+	if not profile_id:
+		profile_id = profile.ID
+		if not profile_id or profile_id == "\0" * 16:
+			profile_id = profile.calculateID(False)
+	key = ("profile", profile_id, intent, steps)
+	with _cache_lock:
+		if key in _cache:
+			return _cache[key]
+	gamut = Gamut.from_profile(profile, intent, steps)
+	with _cache_lock:
+		_cache[key] = gamut
+	return gamut
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-process ICC profile transforms operating on NumPy arrays
+
+Matrix/TRC, grayscale TRC and LUT16Type ('mft2') based profiles are
+evaluated without spawning ArgyllCMS xicclu/icclu. Lookups that can't be
+done in-process (e.g. inverting a cLUT, or tag types other than the ones
+mentioned above) raise UnsupportedTransformError so the caller can fall back
+to Argyll.
+
+All transforms take and return float64 arrays of shape (N, channels).
+Device values are in the range 0..1, XYZ is in the range 0..1 (Y of PCS
+white = 1) and L*a*b* is in the nominal range L* 0..100.
+
+"""
+
+import numpy
+
+import colormath
+import colormath_batch
+import ICCProfile as ICCP
+
+
+D50 = numpy.array(colormath.get_whitepoint("D50"))
+
+# Legacy (ICC v2) 16-bit PCS encoding factors
+PCSLAB_L_SCALE = 65280 / 100.0
+PCSLAB_AB_SCALE = 256.0
+PCSXYZ_SCALE = 32768.0
+
+
+class UnsupportedTransformError(NotImplementedError):
+	pass
+
+
+def XYZ2Lab(XYZ, whitepoint="D50"):
+	""" Convert an array of XYZ (0..1) to L*a*b* """
+	return colormath_batch.XYZ2Lab(XYZ, whitepoint, scale=1.0)
+
+
+def Lab2XYZ(Lab, whitepoint="D50"):
+	""" Convert an array of L*a*b* to XYZ (0..1) """
+	return colormath_batch.Lab2XYZ(Lab, whitepoint, scale=1.0)
+
+
+def pcs_encode(values, colorspace):
+	""" Encode an array of PCS or device values to the range 0..1 """
+	values = numpy.array(values, dtype=numpy.float64)
+	if colorspace == "Lab":
+		values[..., 0] *= PCSLAB_L_SCALE / 65535.0
+		values[..., 1:] = (values[..., 1:] + 128) * (PCSLAB_AB_SCALE / 65535.0)
+	elif colorspace == "XYZ":
+		values *= PCSXYZ_SCALE / 65535.0
+	return values
+
+
+def pcs_decode(values, colorspace):
+	""" Decode an array of 0..1 encoded PCS or device values """
+	values = numpy.array(values, dtype=numpy.float64)
+	if colorspace == "Lab":
+		values[..., 0] *= 65535.0 / PCSLAB_L_SCALE
+		values[..., 1:] = values[..., 1:] * (65535.0 / PCSLAB_AB_SCALE) - 128
+	elif colorspace == "XYZ":
+		values *= 65535.0 / PCSXYZ_SCALE
+	return values
+
+
+def simplex_interp(table, x):
+	"""
+	Interpolate an n-dimensional grid table using simplex interpolation
+
+	This is the same interpolation method ArgyllCMS uses for cLUT lookups.
+	table is an array of shape (gridsteps, ) * n + (channels, ), x an array
+	of shape (N, n) with values in the range 0..1.
+
+	"""
+	gridsteps = table.shape[0]
+	n = x.shape[1]
+	flat = table.reshape(-1, table.shape[-1])
+	if gridsteps < 2:
+		return numpy.repeat(flat[:1], len(x), axis=0)
+	x = numpy.clip(x, 0, 1) * (gridsteps - 1)
+	base = numpy.minimum(x.astype(numpy.intp), gridsteps - 2)
+	frac = x - base
+	strides = gridsteps ** numpy.arange(n - 1, -1, -1)
+	index = base.dot(strides)
+	# Walk from the base vertex along the axes with decreasing fraction
+	order = numpy.argsort(-frac, axis=1, kind="stable")
+	sfrac = numpy.take_along_axis(frac, order, axis=1)
+	out = flat[index] * (1 - sfrac[:, :1])
+	for k in range(n):
+		index = index + strides[order[:, k]]
+		if k + 1 < n:
+			weight = sfrac[:, k] - sfrac[:, k + 1]
+		else:
+			weight = sfrac[:, k]
+		out += flat[index] * weight[:, numpy.newaxis]
+	return out
+
+
+class Curve(object):
+
+	"""
+	Vectorized 1D curve (identity, gamma or table) with inverse lookup
+
+	"""
+
+	def __init__(self, tag):
+		if isinstance(tag, ICCP.ParametricCurveType):
+			tag = tag.get_trc(4096)
+		if len(tag) > 1:
+			self.gamma = None
+			self.fp = numpy.asarray(tag, dtype=numpy.float64) / 65535.0
+			self.xp = numpy.linspace(0, 1, len(self.fp))
+			# Inverse lookup needs a monotonically increasing curve
+			if self.fp[0] > self.fp[-1]:
+				self.ixp, self.ifp = self.fp[::-1], self.xp[::-1]
+			else:
+				self.ixp, self.ifp = self.fp, self.xp
+			self.ixp = numpy.maximum.accumulate(self.ixp)
+		elif len(tag):
+			self.gamma = float(tag[0])
+		else:
+			self.gamma = 1.0
+
+	def __call__(self, x):
+		if self.gamma is not None:
+			return numpy.clip(x, 0, 1) ** self.gamma
+		return numpy.interp(x, self.xp, self.fp)
+
+	def inverse(self, y):
+		if self.gamma is not None:
+			return numpy.clip(y, 0, 1) ** (1.0 / self.gamma)
+		return numpy.interp(y, self.ixp, self.ifp)
+
+
+class Transform(object):
+
+	"""
+	Base class for in-process transforms
+
+	Subclasses implement 'apply', which gets an array of input values
+	in the profile's native encoding (see module docstring) and returns
+	a tuple of the output array and a boolean array of clipping flags.
+
+	"""
+
+	input_channels = 3
+	input_colorspace = None
+	output_colorspace = None
+
+	def __call__(self, idata):
+		return self.apply(numpy.asarray(idata, dtype=numpy.float64))
+
+
+class LUT16Transform(Transform):
+
+	""" Transform through a LUT16Type ('mft2') tag """
+
+	def __init__(self, tag, input_colorspace, output_colorspace):
+		self.input_colorspace = input_colorspace
+		self.output_colorspace = output_colorspace
+		self.input_channels = tag.input_channels_count
+		gridsteps = tag.clut_grid_steps
+		self.clut = (tag.clut_asarray().reshape((gridsteps, ) *
+												self.input_channels +
+												(-1, )) / 65535.0)
+		self.input = [Curve(entries) for entries in tag.input]
+		self.output = [Curve(entries) for entries in tag.output]
+		if input_colorspace == "XYZ":
+			# The matrix is only used for XYZ input
+			self.matrix = numpy.array(tag.matrix, dtype=numpy.float64)
+			if (self.matrix == numpy.identity(3)).all():
+				self.matrix = None
+		else:
+			self.matrix = None
+
+	def apply(self, idata):
+		x = pcs_encode(idata, self.input_colorspace)
+		clip = ((x < 0) | (x > 1)).any(axis=1)
+		if self.matrix is not None:
+			x = x.dot(self.matrix.T)
+		x = numpy.clip(x, 0, 1)
+		for i, curve in enumerate(self.input):
+			x[:, i] = curve(x[:, i])
+		y = simplex_interp(self.clut, x)
+		for i, curve in enumerate(self.output):
+			y[:, i] = curve(y[:, i])
+		return pcs_decode(y, self.output_colorspace), clip
+
+
+class MatrixTRCTransform(Transform):
+
+	""" Transform through matrix/TRC (RGB) or TRC (gray) tags """
+
+	def __init__(self, profile, inverse=False):
+		tags = profile.tags
+		self.inverse = inverse
+		if profile.colorSpace == "GRAY":
+			self.input_channels = 1
+			self.curves = [Curve(tags.kTRC)]
+			self.matrix = D50.reshape((3, 1))
+		else:
+			self.curves = [Curve(tags[channel + "TRC"]) for channel in "rgb"]
+			self.matrix = numpy.array([list(tags[channel + "XYZ"].values())
+									   for channel in "rgb"],
+									  dtype=numpy.float64).T
+		if inverse:
+			self.input_colorspace = "XYZ"
+			self.output_colorspace = profile.colorSpace
+			self.input_channels = 3
+			if self.matrix.shape[1] == 1:
+				# Gray: Use luminance only
+				self.imatrix = numpy.array([[0, 1 / D50[1], 0]])
+			else:
+				self.imatrix = numpy.linalg.inv(self.matrix)
+		else:
+			self.input_colorspace = profile.colorSpace
+			self.output_colorspace = "XYZ"
+
+	def apply(self, idata):
+		if self.inverse:
+			linear = idata.dot(self.imatrix.T)
+			clip = ((linear < 0) | (linear > 1)).any(axis=1)
+			linear = numpy.clip(linear, 0, 1)
+			for i, curve in enumerate(self.curves):
+				linear[:, i] = curve.inverse(linear[:, i])
+			return linear, clip
+		clip = ((idata < 0) | (idata > 1)).any(axis=1)
+		linear = numpy.empty_like(idata)
+		for i, curve in enumerate(self.curves):
+			linear[:, i] = curve(idata[:, i])
+		return linear.dot(self.matrix.T), clip
+
+
+class ProfileTransform(Transform):
+
+	"""
+	Complete lookup through a profile, like ArgyllCMS xicclu does it
+
+	intent, direction, order and pcs have the same meaning as the
+	corresponding xicclu arguments ('pcs' None meaning the profile's PCS,
+	'X' meaning XYZ scaled to 0..100).
+
+	"""
+
+	def __init__(self, profile, intent="r", direction="f", order="n",
+				 pcs=None):
+		if profile.version >= 4 and not profile.convert_iccv4_tags_to_iccv2():
+			raise UnsupportedTransformError("ICC v4 profile")
+		self.profile = profile
+		self.direction = direction
+		self.pcs = pcs and {"x": "XYZ", "X": "XYZ", "l": "Lab"}.get(pcs)
+		if pcs and not self.pcs:
+			raise UnsupportedTransformError("PCS %r" % pcs)
+		if pcs == "X":
+			self.pcs_scale = 100.0
+		else:
+			self.pcs_scale = 1.0
+		if profile.profileClass in ("link", "abst"):
+			if direction != "f":
+				raise UnsupportedTransformError("Direction %r for %s profile" %
+												(direction,
+												 profile.profileClass))
+			intent = "p"
+			self.pcs = None
+			self.pcs_scale = 1.0
+		elif not self.pcs:
+			# Matrix/TRC transforms work in XYZ, but like xicclu, return
+			# (or expect) values in the profile's PCS
+			self.pcs = profile.connectionColorSpace
+		self.absolute = intent == "a"
+		self.transform = self._get_transform(intent, direction, order)
+		self.input_channels = self.transform.input_channels
+		if direction in ("f", "ib"):
+			self.input_colorspace = self.transform.input_colorspace
+			self.output_colorspace = self.pcs or self.transform.output_colorspace
+		else:
+			self.input_colorspace = self.pcs or self.transform.input_colorspace
+			self.output_colorspace = self.transform.output_colorspace
+		if self.absolute:
+			cat = profile.guess_cat() or "Bradford"
+			wtpt = list(profile.tags.wtpt.values())
+			self.abs_matrix = numpy.array(colormath.wp_adaption_matrix("D50",
+																	   wtpt,
+																	   cat))
+			self.abs_imatrix = numpy.linalg.inv(self.abs_matrix)
+
+	def _get_transform(self, intent, direction, order):
+		profile = self.profile
+		tags = profile.tags
+		if direction in ("f", "ib"):
+			prefix = "A2B"
+		else:
+			prefix = "B2A"
+		tagname = prefix + {"p": "0", "r": "1", "a": "1", "s": "2"}.get(intent,
+																		  "0")
+		if not tagname in tags:
+			tagname = prefix + "0"
+		lut = tags.get(tagname)
+		if profile.colorSpace == "GRAY":
+			trc = "kTRC" in tags
+		else:
+			trc = ("rXYZ" in tags and "gXYZ" in tags and "bXYZ" in tags and
+				   "rTRC" in tags and "gTRC" in tags and "bTRC" in tags and
+				   profile.colorSpace == "RGB")
+		if lut and (order != "r" or not trc):
+			if direction in ("if", "ib"):
+				raise UnsupportedTransformError("Inverse cLUT lookup")
+			if not isinstance(lut, ICCP.LUT16Type):
+				raise UnsupportedTransformError("Tag type %r" %
+												lut.tagData[:4])
+			if prefix == "A2B":
+				return LUT16Transform(lut, profile.colorSpace,
+									  profile.connectionColorSpace)
+			return LUT16Transform(lut, profile.connectionColorSpace,
+								  profile.colorSpace)
+		elif trc and profile.profileClass not in ("link", "abst"):
+			return MatrixTRCTransform(profile, direction in ("b", "if"))
+		raise UnsupportedTransformError("No supported %s tag" % prefix)
+
+	def _convert_pcs(self, data, source, destination, matrix=None):
+		if source == destination and matrix is None:
+			return data
+		if source == "Lab":
+			data = Lab2XYZ(data)
+		if matrix is not None:
+			data = data.dot(matrix.T)
+		if destination == "Lab":
+			data = XYZ2Lab(data)
+		return data
+
+	def apply(self, idata):
+		if self.direction in ("b", "if"):
+			if self.absolute:
+				matrix = self.abs_imatrix
+			else:
+				matrix = None
+			if self.pcs_scale != 1:
+				idata = idata / self.pcs_scale
+			idata = self._convert_pcs(idata, self.input_colorspace,
+									  self.transform.input_colorspace, matrix)
+			return self.transform(idata)
+		if self.absolute:
+			matrix = self.abs_matrix
+		else:
+			matrix = None
+		odata, clip = self.transform(idata)
+		odata = self._convert_pcs(odata, self.transform.output_colorspace,
+								  self.output_colorspace, matrix)
+		if self.pcs_scale != 1:
+			odata = odata * self.pcs_scale
+		return odata, clip
+
+
+def get_transform(profile, intent="r", direction="f", order="n", pcs=None):
+	"""
+	Return a ProfileTransform for profile
+
+	Raise UnsupportedTransformError if the lookup can't be done in-process.
+
+	"""
+	if not isinstance(profile, ICCP.ICCProfile):
+		raise UnsupportedTransformError("Not an ICC profile: %r" % profile)
+	return ProfileTransform(profile, intent, direction, order, pcs)
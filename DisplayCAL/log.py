@@ -7,8 +7,10 @@ import atexit
 import logging
 import logging.handlers
 import os
+import queue
 import re
 import sys
+import threading
 import warnings
 from time import localtime, strftime, time
 
@@ -134,6 +136,194 @@ class Log():
 log = Log()
 
 
+class DeferredFlushMixin(object):
+
+	"""
+	Mixin for stream handlers written to by LogWriter.
+	
+	Flushing after each record is left out, LogWriter commits once per batch.
+	
+	"""
+
+	def commit(self):
+		super(DeferredFlushMixin, self).flush()
+
+	def flush(self):
+		pass
+
+
+class FileHandler(DeferredFlushMixin, logging.FileHandler):
+	pass
+
+
+class TimedRotatingFileHandler(DeferredFlushMixin,
+							   logging.handlers.TimedRotatingFileHandler):
+	pass
+
+
+class MultilineFormatter(logging.Formatter):
+
+	""" Prefix each line of a multi-line message with the record's time """
+
+	def format(self, record):
+		message = record.getMessage()
+		if "\n" not in message:
+			return logging.Formatter.format(self, record)
+		asctime = self.formatTime(record, self.datefmt)
+		lines = ["%s %s" % (asctime, line) for line in message.split("\n")]
+		if record.exc_info:
+			lines.append(self.formatException(record.exc_info))
+		return "\n".join(lines)
+
+
+class LogWriter(object):
+
+	"""
+	Write log records in batches from a background thread.
+	
+	Records are put into a bounded queue so that logging does not block the
+	calling thread on disk I/O. Handlers that were written to are flushed
+	after at most 'interval' seconds, when flush() is called, and at exit.
+	If the queue is full, records are dropped and counted.
+	
+	In multiprocessing child processes, records are written directly, as
+	these may end via os._exit without running exit handlers.
+	
+	"""
+
+	# Upper bound for flush() so that shutdown can't hang on a stuck handler
+	flush_timeout = 5
+
+	def __init__(self, maxsize=65536, interval=.5):
+		self.queue = queue.Queue(maxsize)
+		self.interval = interval
+		self.dropped = 0
+		self.written = 0
+		self._lock = threading.Lock()
+		self._pid = None
+		self._thread = None
+
+	@property
+	def depth(self):
+		""" Number of queued records not yet written """
+		return self.queue.qsize()
+
+	def _start(self):
+		if (self._pid == os.getpid() and self._thread and
+			self._thread.is_alive()):
+			return
+		with self._lock:
+			if (self._thread and self._thread.is_alive() and
+				self._pid == os.getpid()):
+				return
+			if self._pid != os.getpid():
+				# Forked child process, the writer thread of the parent process
+				# does not exist here
+				self.queue = queue.Queue(self.queue.maxsize)
+				self._pid = os.getpid()
+			self._thread = threading.Thread(target=self._run,
+											name="LogWriter")
+			self._thread.daemon = True
+			self._thread.start()
+
+	def flush(self, timeout=None):
+		""" Wait until all records queued so far have been written """
+		if timeout is None:
+			timeout = self.flush_timeout
+		if (not self._thread or not self._thread.is_alive() or
+			self._pid != os.getpid()):
+			return
+		event = threading.Event()
+		self.queue.put((None, event))
+		event.wait(timeout)
+
+	def put(self, handler, record):
+		if mp.current_process().name != "MainProcess":
+			self._write(handler, record)
+			return
+		self._start()
+		try:
+			self.queue.put_nowait((handler, record))
+		except queue.Full:
+			with self._lock:
+				self.dropped += 1
+
+	def _write(self, handler, record):
+		try:
+			handler.handle(record)
+		except Exception:
+			handler.handleError(record)
+		else:
+			with self._lock:
+				self.written += 1
+		try:
+			handler.commit()
+		except Exception:
+			pass
+
+	def _run(self):
+		dirty = set()
+		last_commit = time()
+		while True:
+			timeout = None
+			if dirty:
+				timeout = max(self.interval - (time() - last_commit), 0)
+			try:
+				handler, record = self.queue.get(True, timeout)
+			except queue.Empty:
+				handler = record = None
+			if handler is not None:
+				try:
+					handler.handle(record)
+				except Exception:
+					handler.handleError(record)
+				else:
+					self.written += 1
+				dirty.add(handler)
+				if time() - last_commit < self.interval:
+					continue
+			# Timer expired or flush requested
+			for target in dirty:
+				try:
+					target.commit()
+				except Exception:
+					pass
+			dirty.clear()
+			last_commit = time()
+			if handler is None and record is not None:
+				# Flush requested
+				record.set()
+
+logwriter = LogWriter()
+atexit.register(logwriter.flush)
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+
+	""" Pass records on to a DeferredFlushMixin handler via LogWriter """
+
+	def __init__(self, target, writer=logwriter):
+		logging.handlers.QueueHandler.__init__(self, writer)
+		self.target = target
+
+	def close(self):
+		self.queue.flush()
+		self.target.close()
+		logging.handlers.QueueHandler.close(self)
+
+	def enqueue(self, record):
+		self.queue.put(self.target, record)
+
+	def prepare(self, record):
+		# Formatting is left to the target handler in the writer thread
+		record.msg = record.getMessage()
+		record.args = None
+		return record
+
+	def flush(self):
+		self.queue.flush()
+
+
 class LogFile():
 	
 	""" Logfile class. Default is to not rotate. """
@@ -155,8 +345,8 @@ class LogFile():
 			handler.flush()
 
 	def write(self, msg):
-		for line in msg.rstrip().replace("\r\n", "\n").replace("\r", "").split("\n"):
-			self._logger.info(line)
+		# One record for all lines, MultilineFormatter prefixes each line
+		self._logger.info(msg.rstrip().replace("\r\n", "\n").replace("\r", ""))
 
 
 class SafeLogger(SafePrinter):
@@ -272,6 +462,7 @@ def get_file_logger(name, level=loglevel, when="midnight", backupCount=5,
 			mode = "w"
 	logfile = os.path.join(logdir, filename + ".log")
 	for handler in logger.handlers:
+		handler = getattr(handler, "target", handler)
 		if (isinstance(handler, logging.FileHandler) and
 			handler.baseFilename == os.path.abspath(logfile)):
 			return logger
@@ -366,14 +557,14 @@ def get_file_logger(name, level=loglevel, when="midnight", backupCount=5,
 	if os.path.exists(logdir):
 		try:
 			if when != "never":
-				filehandler = logging.handlers.TimedRotatingFileHandler(logfile,
-																		when=when,
-																		backupCount=backupCount)
+				filehandler = TimedRotatingFileHandler(logfile, when=when,
+													   backupCount=backupCount)
 			else:
-				filehandler = logging.FileHandler(logfile, mode)
-			fileformatter = logging.Formatter("%(asctime)s %(message)s")
+				filehandler = FileHandler(logfile, mode)
+			fileformatter = MultilineFormatter("%(asctime)s %(message)s")
 			filehandler.setFormatter(fileformatter)
-			logger.addHandler(filehandler)
+			# Disk writes happen in the log writer thread
+			logger.addHandler(QueuedHandler(filehandler))
 		except Exception as exception:
 			safe_print("Warning - logging to file '%s' not possible: %s" % 
 					   tuple(safe_unicode(s) for s in (logfile, exception)))
@@ -4,13 +4,14 @@
 
 
 from configparser import RawConfigParser
-from io import StringIO
+from io import BytesIO, StringIO
 from binascii import unhexlify
 from time import sleep, time
 from zlib import crc32
 import ctypes
 import errno
 import getpass
+import mmap
 import os
 import platform
 import socket
@@ -170,12 +171,8 @@ def icc_device_link_to_madvr(icc_device_link_filename, unity=False,
 	if unity:
 		logfile.write("Writing unity madVR 3D LUT...\n")
 		prevperc = -1
-		for a in range(clutres):
-			for b in range(clutres):
-				for c in range(clutres):
-					# Optimize for speed
-					B, G, R = chr(c), chr(b), chr(a)
-					raw.write(B + B + G + G + R + R)
+		for a, slab in unity_3dlut_slabs(clutres):
+			raw.write(slab)
 			perc = round(a / clutmax * 100)
 			if perc > prevperc:
 				logfile.write("\r%i%%" % perc)
@@ -211,14 +208,10 @@ def icc_device_link_to_madvr(icc_device_link_filename, unity=False,
 		#	4 byte bytes per entry = 2
 		#	[3][256] 2 byte entry values. Tables are in RGB order
 
-		raw.write("cal1")
-		raw.write(struct.pack('<I', 1))
-		raw.write(struct.pack('<I', 256))
-		raw.write(struct.pack('<I', 2))
+		raw.write(b"cal1")
+		raw.write(struct.pack('<3I', 1, 256, 2))
 		# Linear (unity) calibration
-		for i in range(3):
-			for j in range(256):
-				raw.write(struct.pack('<H', j * 257))
+		raw.write(struct.pack('<768H', *[j * 257 for j in range(256)] * 3))
 
 	raw.close()
 
@@ -235,6 +228,28 @@ def icc_device_link_to_madvr(icc_device_link_filename, unity=False,
 	return True
 
 
+def unity_3dlut_slabs(clutres=256):
+	"""
+	Generate the cLUT of a unity madVR 3D LUT in slabs
+	
+	Yields (red input index, buffer) tuples. Each buffer holds the clutres^2
+	BGR 16-bit little endian entries for one red input value. The buffer is
+	re-used for the next slab, so it has to be written out before requesting
+	the next one.
+	
+	"""
+	import numpy
+
+	values = numpy.linspace(0, 65535, clutres).round().astype("<u2")
+	slab = numpy.empty((clutres, clutres, 3), dtype="<u2")
+	slab[..., 0] = values  # B
+	slab[..., 1] = values[:, numpy.newaxis]  # G
+	view = memoryview(slab.reshape(-1).view(numpy.uint8))
+	for a in range(clutres):
+		slab[..., 2] = values[a]  # R
+		yield a, view
+
+
 def inet_pton(ip_string):
 	"""
 	inet_pton(string) -> packed IP representation
@@ -267,13 +282,36 @@ class H3DLUT(object):
 
 	# https://sourceforge.net/projects/thr3dlut
 
-	def __init__(self, stream_or_filename=None, check_lut_size=True):
+	def __init__(self, stream_or_filename=None, check_lut_size=True,
+				 mmap_mode=None):
+		"""
+		Read 3D LUT from stream or filename.
+		
+		If mmap_mode is "r" (read-only) or "r+" (read/write), a file is
+		memory-mapped instead of read into memory, and LUTDATA is a
+		memoryview of the mapped file. With "r+", changes to LUTDATA (e.g.
+		through the array returned by clut_asarray()) are written back to the
+		file. Call close() to release the mapping.
+		
+		"""
+		self._mmap = None
 		if not stream_or_filename:
 			return
 		if isinstance(stream_or_filename, str):
 			self.fileName = stream_or_filename
-			with open(stream_or_filename, "rb") as lut:
-				data = lut.read()
+			if mmap_mode:
+				if mmap_mode == "r":
+					mode, access = "rb", mmap.ACCESS_READ
+				elif mmap_mode == "r+":
+					mode, access = "r+b", mmap.ACCESS_WRITE
+				else:
+					raise ValueError("Invalid mmap mode: %r" % mmap_mode)
+				with open(stream_or_filename, mode) as lut:
+					self._mmap = data = mmap.mmap(lut.fileno(), 0,
+												  access=access)
+			else:
+				with open(stream_or_filename, "rb") as lut:
+					data = lut.read()
 		else:
 			self.fileName = None
 			data = stream_or_filename.read()
@@ -312,19 +350,59 @@ class H3DLUT(object):
 							values[i] = float(value)
 					value = tuple(values)
 				self.parametersData[key] = value
-		self.LUTDATA = data[self.lutFileOffset:
-							self.lutFileOffset + self.lutCompressedSize]
-		if check_lut_size and len(self.LUTDATA) != self.lutCompressedSize:
+		end = self.lutFileOffset + self.lutCompressedSize
+		if len(data) == end + 1552:
+			# Calibration appendended
+			end += 1552
+		# Slice a memoryview so that LUTDATA doesn't copy the (potentially
+		# memory-mapped) file contents
+		self.LUTDATA = memoryview(data)[self.lutFileOffset:end]
+		if (check_lut_size and
+			len(self.LUTDATA) < self.lutCompressedSize):
 			raise ValueError("3DLUT size %i does not match expected size %i" %
 							 (len(self.LUTDATA), self.lutCompressedSize))
-		if len(data) == self.lutFileOffset + self.lutCompressedSize + 1552:
-			# Calibration appendended
-			self.LUTDATA += data[self.lutFileOffset + self.lutCompressedSize:
-								 self.lutFileOffset + self.lutCompressedSize +
-								 1552]
+
+	def clut_asarray(self):
+		"""
+		Return the cLUT as NumPy array view of LUTDATA
+		
+		The array has shape (R, G, B, 3) with the output channels in BGR
+		order. Unless LUTDATA is read-only, changes to the array change
+		LUTDATA (and the file if opened with mmap_mode "r+").
+		
+		"""
+		import numpy
+
+		steps = [2 ** bits for bits in self.inputBitDepth]
+		dtype = "<u%i" % (self.outputBitDepth // 8)
+		return numpy.frombuffer(self.LUTDATA, dtype, numpy.prod(steps) * 3
+								).reshape(steps + [3])
+
+	def close(self):
+		""" Release the memory mapping (if any) """
+		if self._mmap:
+			self.LUTDATA.release()
+			self.LUTDATA = b""
+			self._mmap.close()
+			self._mmap = None
+
+	def flush(self):
+		""" Write changes to a memory-mapped file back to disk """
+		if self._mmap:
+			self._mmap.flush()
 
 	@property
 	def data(self):
+		return b"".join(self.iterdata())
+
+	def iterdata(self):
+		"""
+		Return the 3D LUT file contents as sequence of chunks
+		
+		The cLUT is not copied, so writing the chunks to a stream (e.g. with
+		writelines) avoids assembling the whole file in memory.
+		
+		"""
 		parametersData = []
 		for key, values in self.parametersData.items():
 			if isinstance(values, str):
@@ -340,24 +418,24 @@ class H3DLUT(object):
 			parametersData.append(safe_str("%s %s" % (key, value)))
 		parametersData = b"\r\n".join(parametersData) + b"\0"
 		parametersSize = len(parametersData)
-		return "".join((self.signature,
-						struct.pack("<l", self.fileVersion),
-						self.programName.ljust(32, "\0"),
-						struct.pack("<q", self.programVersion),
-						struct.pack(*("<3l",) + self.inputBitDepth),
-						struct.pack("<l", self.inputColorEncoding),
-						struct.pack("<l", self.outputBitDepth),
-						struct.pack("<l", self.outputColorEncoding),
-						struct.pack("<l", self.parametersFileOffset),
-						struct.pack("<l", parametersSize),
-						struct.pack("<l", self.lutFileOffset),
-						struct.pack("<l", self.lutCompressionMethod),
-						struct.pack("<l", self.lutCompressedSize),
-						struct.pack("<l", self.lutUncompressedSize),
-						"\0" * (self.parametersFileOffset - 96),
-						parametersData,
-						"\0" * (self.lutFileOffset - self.parametersFileOffset - parametersSize),
-						self.LUTDATA))
+		return (self.signature,
+				struct.pack("<l", self.fileVersion),
+				self.programName.ljust(32, "\0"),
+				struct.pack("<q", self.programVersion),
+				struct.pack(*("<3l",) + self.inputBitDepth),
+				struct.pack("<l", self.inputColorEncoding),
+				struct.pack("<l", self.outputBitDepth),
+				struct.pack("<l", self.outputColorEncoding),
+				struct.pack("<l", self.parametersFileOffset),
+				struct.pack("<l", parametersSize),
+				struct.pack("<l", self.lutFileOffset),
+				struct.pack("<l", self.lutCompressionMethod),
+				struct.pack("<l", self.lutCompressedSize),
+				struct.pack("<l", self.lutUncompressedSize),
+				"\0" * (self.parametersFileOffset - 96),
+				parametersData,
+				"\0" * (self.lutFileOffset - self.parametersFileOffset - parametersSize),
+				self.LUTDATA)
 
 	@property
 	def source_colorspace(self):
@@ -392,7 +470,7 @@ class H3DLUT(object):
 		
 		"""
 		stream = self._get_stream(stream_or_filename)
-		stream.write(self.data)
+		stream.writelines(self.iterdata())
 		if isinstance(stream_or_filename, str):
 			if not self.fileName:
 				self.fileName = stream_or_filename
@@ -446,29 +524,12 @@ class H3DLUT(object):
 
 		# Write actual cLUT
 		# XXX Currently only 16 bit RGB data is supported
-		samples_per_pixel = 3  # RGB
-		bytes_per_sample = self.outputBitDepth / 8
-		bytes_per_pixel = samples_per_pixel * bytes_per_sample
-		io = StringIO(tagData)
+		io = BytesIO(tagData)
 		io.seek(0, 2)  # Position cursor at end
-		i = 0
-		for R in range(input_grid_steps):
-			if not R:
-				i += input_grid_steps * input_grid_steps
-				continue
-			for G in range(input_grid_steps):
-				if not G:
-					i += input_grid_steps
-					continue
-				for B in range(input_grid_steps):
-					if not B:
-						i += 1
-						continue
-					index = i * samples_per_pixel * bytes_per_sample
-					BGR = self.LUTDATA[index:index + bytes_per_pixel]
-					RGB = BGR[::-1]  # BGR little-endian to RGB big-endian byte order
-					io.write(RGB)
-					i += 1
+		clut = self.clut_asarray()
+		for R in range(1, input_grid_steps):
+			# BGR little-endian to RGB big-endian byte order
+			io.write(clut[R, 1:, 1:, ::-1].astype(">u2").tobytes())
 		io.write(A2B0.tagData[-output_bytes:])  # Append output curves
 		io.seek(0)
 		link.tags.A2B0 = ICCP.ICCProfileTag(io.read(), "A2B0")
@@ -488,18 +549,15 @@ class H3DLUT(object):
 		# Write image data
 		# XXX Currently only 8 or 16 bit RGB data is supported
 		samples_per_pixel = 3  # RGB
-		bytes_per_sample = self.outputBitDepth / 8
-		bytes_per_pixel = samples_per_pixel * bytes_per_sample
 		w = 2 ** self.inputBitDepth[0]  # Assume equal bitdepth for R, G, B
 		h = w * w
 		stream.write(tiff_get_header(w, h, samples_per_pixel,
 									 self.outputBitDepth))
-		entries = self.lutUncompressedSize / samples_per_pixel / bytes_per_sample
-		for i in range(entries):
-			index = i * samples_per_pixel * bytes_per_sample
-			BGR = self.LUTDATA[index:index + bytes_per_pixel]
-			RGB = BGR[::-1]  # BGR little-endian to RGB big-endian byte order
-			stream.write(RGB)
+		clut = self.clut_asarray()
+		dtype = ">u%i" % (self.outputBitDepth // 8)
+		for R in range(len(clut)):
+			# BGR little-endian to RGB big-endian byte order
+			stream.write(clut[R, ..., ::-1].astype(dtype).tobytes())
 
 		if isinstance(stream_or_filename, str):
 			stream.close()
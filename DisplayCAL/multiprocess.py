@@ -8,6 +8,7 @@ import math
 import multiprocessing as mp
 import multiprocessing.managers
 import multiprocessing.pool
+import os
 import sys
 import threading
 
@@ -45,8 +46,55 @@ def cpu_count(limit_by_total_vmem=True):
 		return 1
 
 
+_persistent = {"pool": None, "manager": None, "size": 0, "pid": None}
+_persistent_lock = threading.Lock()
+
+
+def get_persistent_pool(num_workers):
+	"""
+	Return a shared pool with at least num_workers workers and its manager
+	
+	The worker processes are kept running between calls so that state
+	cached at module level in the workers (e.g. initialized configuration,
+	parsed profiles and warm lookup processes) is re-used.
+	
+	"""
+	with _persistent_lock:
+		if _persistent["pid"] != os.getpid():
+			# Forked. The pool belongs to the parent process
+			_persistent.update(pool=None, manager=None, size=0,
+							   pid=os.getpid())
+		if _persistent["size"] < num_workers:
+			_shutdown_persistent_pool()
+			_persistent["manager"] = mp.Manager()
+			_persistent["pool"] = NonDaemonicPool(num_workers)
+			_persistent["size"] = num_workers
+		return _persistent["pool"], _persistent["manager"]
+
+
+def _shutdown_persistent_pool():
+	if _persistent["pid"] != os.getpid():
+		return
+	if _persistent["pool"]:
+		_persistent["pool"].terminate()
+		_persistent["pool"].join()
+	if _persistent["manager"]:
+		_persistent["manager"].shutdown()
+	_persistent.update(pool=None, manager=None, size=0)
+
+
+def shutdown_persistent_pool():
+	""" End the workers of the shared pool (see get_persistent_pool) """
+	with _persistent_lock:
+		_shutdown_persistent_pool()
+
+
+atexit.register(shutdown_persistent_pool)
+
+
 def pool_slice(func, data_in, args=(), kwds={}, num_workers=None,
-			   thread_abort=None, logfile=None, num_batches=1, progress=0):
+			   thread_abort=None, logfile=None, num_batches=1, progress=0,
+			   persistent=False):
 	"""
 	Process data in slices using a pool of workers and return the results.
 	
@@ -60,6 +108,9 @@ def pool_slice(func, data_in, args=(), kwds={}, num_workers=None,
 	which is passed as the first argument to 'func', and put its progress
 	percentage into the queue which is passed as the second argument to 'func'.
 	
+	If persistent is True, use the shared pool (see get_persistent_pool)
+	instead of starting new worker processes.
+	
 	"""
 	from config import getcfg
 
@@ -81,8 +132,12 @@ def pool_slice(func, data_in, args=(), kwds={}, num_workers=None,
 		chunksize = float(len(data_in)) / num_workers
 
 	if num_workers > 1:
-		Pool = NonDaemonicPool
-		manager = mp.Manager()
+		if persistent:
+			pool, manager = get_persistent_pool(num_workers)
+			Pool = lambda num_workers: pool
+		else:
+			Pool = NonDaemonicPool
+			manager = mp.Manager()
 		if thread_abort is not None and not isinstance(thread_abort.event,
 													   mp.managers.EventProxy):
 			# Replace the event with a managed instance that is compatible
@@ -99,6 +154,7 @@ def pool_slice(func, data_in, args=(), kwds={}, num_workers=None,
 		Pool = FakePool
 		manager = None
 		Queue = FakeQueue
+		persistent = False
 
 	if thread_abort is not None:
 		thread_abort_event = thread_abort.event
@@ -142,7 +198,8 @@ def pool_slice(func, data_in, args=(), kwds={}, num_workers=None,
 		for i in range(batch * num_workers, (batch + 1) * num_workers):
 			end = int(math.ceil(chunksize * (i + 1)))
 			results.append(pool.apply_async(WorkerFunc(func,
-													   batch == num_batches - 1),
+													   batch == num_batches - 1 and
+													   not persistent),
 											(data_in[start:end],
 											 thread_abort_event,
 											 progress_queue) + args, kwds))
@@ -158,17 +215,19 @@ def pool_slice(func, data_in, args=(), kwds={}, num_workers=None,
 			continue
 		data_out.append(result)
 
-	pool.close()
-	pool.join()
+	if not persistent:
+		pool.close()
+		pool.join()
 
 	if manager:
-		# Need to shutdown manager so it doesn't hold files in use
 		if event:
 			# Restore original event
 			if thread_abort.event.is_set():
 				event.set()
 			thread_abort.event = event
-		manager.shutdown()
+		if not persistent:
+			# Need to shutdown manager so it doesn't hold files in use
+			manager.shutdown()
 
 	if exception:
 		raise exception
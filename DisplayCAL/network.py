@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
+from collections import deque
+from time import time
 import errno
 import os
+import queue
+import selectors
 import socket
+import threading
 import urllib.request, urllib.error, urllib.parse
 
 import localization as lang
@@ -153,3 +158,341 @@ class ScriptingClientSocket(socket.socket):
 	def send_command(self, command):
 		# Automatically append newline (command end marker)
 		self.sendall(safe_str(command, "UTF-8") + "\n")
+
+
+class ScriptingHostConnection(object):
+
+	""" Client connection of a ScriptingHost """
+
+	def __init__(self, host, sock, addrport):
+		self.host = host
+		self.sock = sock
+		self.addrport = addrport
+		self.buffer = b""
+		self.busy = False  # Connection is queued for or held by a worker
+		self.closed = False
+		self.commands = {}  # Commands awaiting their response
+		self.deferred = False  # A response will be sent from another thread
+		self.parked = False  # Deferred, and no worker holds the connection
+		self.lock = threading.Lock()
+		self.outgoing = deque()
+		self.pending = deque()  # Received command lines
+
+	def __repr__(self):
+		return "<%s %s:%s>" % ((self.__class__.__name__, ) +
+							   tuple(self.addrport[:2]))
+
+	def begin_command(self, data, received):
+		""" Start latency measurement for a command """
+		self.commands[id(data)] = (data, received)
+
+	def end_command(self, data):
+		""" Record the latency of a command that has been responded to """
+		command = self.commands.pop(id(data), None)
+		if command:
+			self.host.record_latency(data[0], time() - command[1])
+
+	def defer(self):
+		"""
+		Hold back the following commands until resume() is called.
+		
+		To be called by the message handler if the response to the current
+		command is sent later from another thread (e.g. the GUI thread), so
+		that responses are sent in the order the commands were received.
+		
+		"""
+		with self.lock:
+			self.deferred = True
+
+	def resume(self):
+		""" Continue with the commands received after a deferred one """
+		with self.lock:
+			if not self.deferred:
+				return
+			self.deferred = False
+			if not self.parked:
+				# The worker is still running the message handler and will
+				# pick up the following commands itself
+				return
+			self.parked = False
+			if self.closed or not self.pending:
+				self.busy = False
+				return
+		self.host._queue.put(self)
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def sendall(self, data):
+		"""
+		Queue data for sending.
+		
+		Can be called from any thread. If nothing is queued yet, as much
+		data as the socket takes is sent right away.
+		
+		"""
+		if not isinstance(data, bytes):
+			data = safe_str(data, "UTF-8")
+		with self.lock:
+			if self.closed:
+				raise socket.error(errno.ENOTCONN, lang.getstr("connection.broken"))
+			if not self.outgoing:
+				try:
+					data = data[self.sock.send(data):]
+				except (BlockingIOError, InterruptedError):
+					pass
+				except socket.error:
+					# Let the event loop deal with it
+					pass
+				if not data:
+					return
+			self.outgoing.append(data)
+		self.host.wakeup()
+
+
+class ScriptingHost(object):
+
+	"""
+	Selectors based scripting host
+	
+	A single thread waits on the listening socket and all client connections
+	(no polling), complete command lines are run on a fixed pool of worker
+	threads. Lines of one connection are handled one after the other in the
+	order received, so clients can pipeline commands.
+	
+	connection_handler(conn, addrport) is called for new connections and
+	may return False to reject them, message_handler(conn, line, received)
+	is called for each non-empty command line (received is the time.time()
+	timestamp when the line was read), disconnect_handler(conn) when a
+	connection has been closed. A message handler that responds from
+	another thread should call conn.defer() and conn.resume() once the
+	response has been sent.
+	
+	Latency is recorded per command name if the name is in commands (if
+	given), otherwise as '<other>'.
+	
+	"""
+
+	def __init__(self, sock, connection_handler, message_handler,
+				 disconnect_handler=None, workers=4, name="ScriptingHost",
+				 commands=None):
+		self.sock = sock
+		self.commands = None if commands is None else frozenset(commands)
+		self.connection_handler = connection_handler
+		self.message_handler = message_handler
+		self.disconnect_handler = disconnect_handler
+		self.name = name
+		self.connections = {}
+		self.latency = {}
+		self.running = False
+		self.selector = selectors.DefaultSelector()
+		self.thread = None
+		self.workers = []
+		self._latency_lock = threading.Lock()
+		self._queue = queue.Queue()
+		self._wakeup_recv, self._wakeup_send = socket.socketpair()
+		self._wakeup_recv.setblocking(False)
+		self._wakeup_send.setblocking(False)
+		for i in range(workers):
+			self.workers.append(threading.Thread(target=self._worker,
+												 name="%s.Worker-%d" %
+													  (name, i + 1)))
+			self.workers[-1].daemon = True
+
+	def get_latency(self):
+		"""
+		Return per-command latency statistics.
+		
+		Latency is the time from receiving a command line to sending its
+		response. Return a dict mapping command names to (count,
+		mean milliseconds, max milliseconds) tuples.
+		
+		"""
+		with self._latency_lock:
+			return dict((name, (count, total / count * 1000, maximum * 1000))
+						for name, (count, total, maximum) in
+						self.latency.items())
+
+	def record_latency(self, name, seconds):
+		if self.commands is not None and name not in self.commands:
+			# Don't let clients grow the statistics without bounds
+			name = "<other>"
+		with self._latency_lock:
+			count, total, maximum = self.latency.get(name, (0, 0, 0))
+			self.latency[name] = (count + 1, total + seconds,
+								  max(maximum, seconds))
+
+	def start(self):
+		self.sock.setblocking(False)
+		self.selector.register(self.sock, selectors.EVENT_READ,
+							   self._accept)
+		self.selector.register(self._wakeup_recv, selectors.EVENT_READ,
+							   self._wakeup)
+		self.running = True
+		for worker in self.workers:
+			worker.start()
+		self.thread = threading.Thread(target=self._run,
+									   name="%s.ConnectionHandler" %
+											self.name)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		""" Stop the event loop (the listening socket will be closed) """
+		if self.running:
+			self.running = False
+			self.wakeup()
+
+	def wakeup(self):
+		""" Interrupt the event loop, e.g. to pick up queued data """
+		try:
+			self._wakeup_send.send(b"\0")
+		except socket.error:
+			# Buffer full, event loop will wake up anyway
+			pass
+
+	def _accept(self, sock, mask):
+		while True:
+			try:
+				client, addrport = sock.accept()
+			except (BlockingIOError, InterruptedError):
+				return
+			except socket.error as exception:
+				safe_print(lang.getstr("app.client.ignored", exception))
+				return
+			conn = ScriptingHostConnection(self, client, addrport)
+			if self.connection_handler(conn, addrport) is False:
+				client.close()
+				continue
+			try:
+				client.setblocking(False)
+			except socket.error as exception:
+				client.close()
+				safe_print(lang.getstr("app.client.ignored", exception))
+				continue
+			self.connections[client] = conn
+			self.selector.register(client, selectors.EVENT_READ, self._read)
+
+	def _close(self, conn):
+		with conn.lock:
+			if conn.closed:
+				return
+			conn.closed = True
+			conn.outgoing.clear()
+			conn.pending.clear()
+		self.selector.unregister(conn.sock)
+		self.connections.pop(conn.sock, None)
+		try:
+			conn.sock.shutdown(socket.SHUT_RDWR)
+		except socket.error as exception:
+			if exception.errno != errno.ENOTCONN:
+				safe_print("Warning - could not shutdown connection:", exception)
+		conn.sock.close()
+		if self.disconnect_handler:
+			self.disconnect_handler(conn)
+
+	def _flush(self, conn):
+		""" Send queued data, watch for writability if some remains """
+		with conn.lock:
+			while conn.outgoing:
+				data = conn.outgoing[0]
+				try:
+					sent = conn.sock.send(data)
+				except (BlockingIOError, InterruptedError):
+					break
+				if sent < len(data):
+					conn.outgoing[0] = data[sent:]
+					break
+				conn.outgoing.popleft()
+			events = selectors.EVENT_READ
+			if conn.outgoing:
+				events |= selectors.EVENT_WRITE
+		if self.selector.get_key(conn.sock).events != events:
+			self.selector.modify(conn.sock, events, self._read)
+
+	def _read(self, sock, mask):
+		conn = self.connections.get(sock)
+		if not conn:
+			return
+		try:
+			if mask & selectors.EVENT_WRITE:
+				self._flush(conn)
+			if not mask & selectors.EVENT_READ:
+				return
+			try:
+				incoming = sock.recv(65536)
+			except (BlockingIOError, InterruptedError):
+				return
+		except socket.error:
+			self._close(conn)
+			return
+		if not incoming:
+			self._close(conn)
+			return
+		conn.buffer += incoming
+		if not b"\n" in incoming:
+			return
+		lines = conn.buffer.split(b"\n")
+		conn.buffer = lines.pop()
+		received = time()
+		with conn.lock:
+			for line in lines:
+				line = line.strip()
+				if line:
+					conn.pending.append((line, received))
+			if not conn.pending or conn.busy:
+				return
+			conn.busy = True
+		self._queue.put(conn)
+
+	def _run(self):
+		try:
+			while self.running:
+				for key, mask in self.selector.select():
+					key.data(key.fileobj, mask)
+					if not self.running:
+						break
+		finally:
+			for conn in list(self.connections.values()):
+				self._close(conn)
+			for worker in self.workers:
+				self._queue.put(None)
+			self.selector.close()
+			self._wakeup_recv.close()
+			self._wakeup_send.close()
+			self.sock.close()
+
+	def _wakeup(self, sock, mask):
+		try:
+			while sock.recv(4096):
+				pass
+		except socket.error:
+			pass
+		for conn in list(self.connections.values()):
+			if conn.outgoing:
+				try:
+					self._flush(conn)
+				except socket.error:
+					self._close(conn)
+
+	def _worker(self):
+		while True:
+			conn = self._queue.get()
+			if conn is None:
+				break
+			while True:
+				with conn.lock:
+					if conn.closed or not conn.pending or not self.running:
+						conn.busy = False
+						break
+					line, received = conn.pending.popleft()
+				try:
+					self.message_handler(conn, line, received)
+				except Exception:
+					import traceback
+					safe_print(traceback.format_exc())
+				with conn.lock:
+					if conn.deferred:
+						# resume() hands the connection to a worker again
+						conn.parked = True
+						break
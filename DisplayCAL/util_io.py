@@ -169,16 +169,23 @@ class LineBufferedStream():
 	
 	def write(self, data):
 		data = data.replace(self.linesep_in, "\n")
-		for char in data:
-			if char == "\r":
-				while self.buf and not self.buf.endswith(self.linesep_out):
-					self.buf = self.buf[:-1]
-			else:
-				if char == "\n":
-					self.buf += self.linesep_out
-					self.commit()
+		lines = data.split("\n")
+		for i, line in enumerate(lines):
+			if "\r" in line:
+				# Carriage return discards the uncommitted part of the line
+				head, line = line.rsplit("\r", 1)
+				if self.linesep_out:
+					j = self.buf.rfind(self.linesep_out)
+					if j < 0:
+						self.buf = ""
+					else:
+						self.buf = self.buf[:j + len(self.linesep_out)]
 				else:
-					self.buf += char
+					self.buf += head.replace("\r", "")
+			self.buf += line
+			if i < len(lines) - 1:
+				self.buf += self.linesep_out
+				self.commit()
 
 
 class LineCache():
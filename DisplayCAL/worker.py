@@ -15,6 +15,7 @@ import os
 import pipes
 import platform
 import re
+import selectors
 import socket
 import shutil
 import string
@@ -61,9 +62,11 @@ import audio
 import colormath
 import config
 import defaultpaths
+import gamut
 import imfile
 import localization as lang
 import wexpect
+import argyll_output
 from argyll_cgats import (add_dispcal_options_to_cal, add_options_to_ti3,
 						  cal_to_fake_profile, cal_to_vcgt,
 						  extract_cal_from_profile, extract_cal_from_ti3,
@@ -135,8 +138,8 @@ if sys.platform == "win32" and sys.getwindowsversion() >= (6, ):
 	from util_os import win64_disable_file_system_redirection
 from util_str import (make_filename_safe, safe_basestring, safe_asciize,
 					  safe_str, safe_unicode, strtr, universal_newlines)
-from worker_base import (MP_Xicclu, WorkerBase, Xicclu, _mp_generate_B2A_clut,
-						 _mp_xicclu,
+from worker_base import (MP_Xicclu, PersistentXicclu, WorkerBase, Xicclu,
+						 _mp_generate_B2A_clut, _mp_xicclu,
 						 check_argyll_bin, get_argyll_util, get_argyll_utilname,
 						 get_argyll_version_string as
 						 base_get_argyll_version_string,
@@ -169,6 +172,9 @@ INST_CAL_MSGS = ["Do a reflective white calibration",
 				 "Change filter on instrument to"]
 USE_WPOPEN = 0
 
+# Patch 2 and above (audio/visual feedback for each measured patch)
+PATCH_2_RE = re.compile(r"Patch [2-9]\d* of ", re.I)
+
 keycodes = {wx.WXK_NUMPAD0: ord("0"),
 			wx.WXK_NUMPAD1: ord("1"),
 			wx.WXK_NUMPAD2: ord("2"),
@@ -276,16 +282,20 @@ def check_set_argyll_bin(paths=None):
 		return set_argyll_bin()
 
 
+# sRGB to L*a*b* for check_ti3_criteria1, by 'noadapt'
+sRGB2Lab = {False: colormath.ColorSpaceTransform(pcs="Lab"),
+			True: colormath.ColorSpaceTransform(pcs="Lab", noadapt=True)}
+
+
 def check_ti3_criteria1(RGB, XYZ, black_XYZ, white_XYZ,
 						delta_to_sRGB_threshold_E=10,
 						delta_to_sRGB_threshold_L=10,
 						delta_to_sRGB_threshold_C=75,
 						delta_to_sRGB_threshold_H=75,
 						print_debuginfo=True):
-	sRGBLab = colormath.RGB2Lab(RGB[0] / 100.0,
-								RGB[1] / 100.0,
-								RGB[2] / 100.0,
-								noadapt=not white_XYZ)
+	sRGBLab = sRGB2Lab[not white_XYZ](RGB[0] / 100.0,
+									  RGB[1] / 100.0,
+									  RGB[2] / 100.0)
 	if white_XYZ:
 		if black_XYZ:
 			black_Lab = colormath.XYZ2Lab(*colormath.adapt(black_XYZ[0],
@@ -1240,37 +1250,12 @@ def insert_ti_patches_omitting_RGB_duplicates(cgats1, cgats2_path,
 	cgats2 = CGATS.CGATS(cgats2_path)
 	cgats1_data = cgats1.queryv1("DATA")
 	data = cgats2.queryv1("DATA")
-	data_format = cgats2.queryv1("DATA_FORMAT")
-	# Get only RGB data
-	data.parent.DATA_FORMAT = CGATS.CGATS()
-	data.parent.DATA_FORMAT.key = "DATA_FORMAT"
-	data.parent.DATA_FORMAT.parent = data
-	data.parent.DATA_FORMAT.root = data.root
-	data.parent.DATA_FORMAT.type = "DATA_FORMAT"
-	for i, label in enumerate(("RGB_R", "RGB_G", "RGB_B")):
-		data.parent.DATA_FORMAT[i] = label
-	cgats1_data.parent.DATA_FORMAT = data.parent.DATA_FORMAT
-	rgbdata = str(data)
-	# Restore DATA_FORMAT
-	data.parent.DATA_FORMAT = data_format
-	# Collect all preconditioning point datasets not in data
-	cgats1_data.vmaxlen = data.vmaxlen
-	cgats1_datasets = []
-	for i, dataset in cgats1_data.items():
-		if not str(dataset) in rgbdata:
-			# Not a duplicate
-			cgats1_datasets.append(dataset)
-	if cgats1_datasets:
-		# Insert preconditioned point datasets after first patch
-		if logfn:
-			logfn("%s: Adding %i fixed points to %s" %
-				  (appname, len(cgats1_datasets), cgats2_path))
-		data.moveby1(1, len(cgats1_datasets))
-		for i, dataset in enumerate(cgats1_datasets):
-			dataset.key = i + 1
-			dataset.parent = data
-			dataset.root = data.root
-			data[dataset.key] = dataset
+	# Insert preconditioned point datasets not in data after first patch
+	cgats1_datasets = data.insert_samples(list(cgats1_data.values()), 1,
+										  ("RGB_R", "RGB_G", "RGB_B"))
+	if cgats1_datasets and logfn:
+		logfn("%s: Adding %i fixed points to %s" %
+			  (appname, len(cgats1_datasets), cgats2_path))
 	return cgats2
 
 
@@ -1618,24 +1603,17 @@ class Sudo(object):
 		wexpect.spawn.expect with better timeout handling.
 		
 		The default expect can block up to timeout seconds if the child is
-		already dead. To prevent this, we run expect in a loop until a pattern
-		is matched, timeout is reached or an exception occurs. The max time an
-		expect call will block if the child is already dead can be set with the
-		child_timeout parameter.
+		already dead. To prevent this, we wait for output of the child with
+		SubprocessDriver, which returns as soon as a pattern is matched, the
+		child exits or timeout is reached. The child is polled at least every
+		child_timeout seconds.
 		
 		"""
-		if timeout == -1:
-			timeout = self.subprocess.timeout
-		patterns = list(patterns)
-		if not wexpect.TIMEOUT in patterns:
-			patterns.append(wexpect.TIMEOUT)
-		start = time()
-		while True:
-			result = self.subprocess.expect(patterns, timeout=child_timeout)
-			if (self.subprocess.after is not wexpect.TIMEOUT or
-				time() - start >= timeout):
-				break
-		return result
+		driver = SubprocessDriver(self.subprocess)
+		try:
+			return driver.expect(patterns, timeout, max_wait=child_timeout)
+		finally:
+			driver.close()
 
 	def _terminate(self):
 		""" Terminate running sudo subprocess """
@@ -1819,7 +1797,7 @@ class WPopen(sp.Popen):
 			timeout = self.timeout
 		if timeout is not None:
 			end = time() + timeout
-		while timeout is None or time() < end:
+		while True:
 			self._stdout.seek(self._seekpos)
 			buf = self._stdout.read()
 			self._seekpos += len(buf)
@@ -1837,6 +1815,8 @@ class WPopen(sp.Popen):
 					self.before = buf[:offset]
 					self.match = buf[offset:offset + len(pattern)]
 					return self.match
+			if timeout is not None and time() >= end:
+				break
 			sleep(.01)
 		if timeout is not None:
 			self.match = wexpect.TIMEOUT("Timeout exceeded in expect()")
@@ -1856,6 +1836,103 @@ class WPopen(sp.Popen):
 		sp.Popen.terminate(self)
 
 
+class SubprocessDriver(object):
+
+	"""
+	Event-driven interaction with a wexpect.spawn or WPopen subprocess
+	
+	expect() waits for output of the subprocess and for wakeup() calls (e.g.
+	from Worker.safe_send) at the same time, so prompts, patch lines and keys
+	to send are dealt with as soon as they arrive instead of when the next
+	expect timeout or polling interval has passed. Output is read as soon as
+	it is available, so the subprocess' logfile_read sees it right away.
+	Subprocesses without a selectable file descriptor (Windows, WPopen) are
+	polled every poll_interval seconds.
+	
+	"""
+
+	poll_interval = .01
+
+	def __init__(self, subprocess):
+		self.subprocess = subprocess
+		self.selector = selectors.DefaultSelector()
+		self._wakeup_recv, self._wakeup_send = socket.socketpair()
+		self._wakeup_recv.setblocking(False)
+		self._wakeup_send.setblocking(False)
+		self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
+		child_fd = getattr(subprocess, "child_fd", None)
+		self.selectable = (sys.platform != "win32" and
+						   isinstance(child_fd, int) and child_fd > -1)
+		if self.selectable:
+			self.selector.register(child_fd, selectors.EVENT_READ)
+
+	def close(self):
+		self.selector.close()
+		self._wakeup_recv.close()
+		self._wakeup_send.close()
+
+	def expect(self, patterns, timeout=-1, interrupt=None, max_wait=1):
+		"""
+		Like wexpect.spawn.expect, but wait for events instead of blocking
+		in the subprocess' expect
+		
+		EOF and TIMEOUT are added to patterns if not present. If interrupt
+		(a callable) returns true after a wakeup, return early with the
+		subprocess' after attribute set to TIMEOUT. The subprocess is polled
+		at least every max_wait seconds.
+		
+		"""
+		if timeout == -1:
+			timeout = self.subprocess.timeout
+		patterns = list(patterns)
+		for pattern in (wexpect.EOF, wexpect.TIMEOUT):
+			if not pattern in patterns:
+				patterns.append(pattern)
+		if timeout is not None:
+			end = time() + timeout
+		while True:
+			# Only consume output that is already available
+			result = self.subprocess.expect(patterns, timeout=0)
+			if (self.subprocess.after is not wexpect.TIMEOUT or
+				(interrupt and interrupt())):
+				return result
+			wait = max_wait
+			if timeout is not None:
+				remaining = end - time()
+				if remaining <= 0:
+					return result
+				wait = min(wait, remaining)
+			self.wait(wait)
+
+	def wait(self, timeout=None):
+		"""
+		Wait until the subprocess has output, wakeup() is called or timeout
+		seconds have passed. Return True if woken up by wakeup().
+		
+		"""
+		if not self.selectable and (timeout is None or
+									timeout > self.poll_interval):
+			timeout = self.poll_interval
+		woken = False
+		for key, mask in self.selector.select(timeout):
+			if key.fileobj is self._wakeup_recv:
+				try:
+					while self._wakeup_recv.recv(4096):
+						pass
+				except socket.error:
+					pass
+				woken = True
+		return woken
+
+	def wakeup(self):
+		""" Interrupt wait(), e.g. because there is something to send """
+		try:
+			self._wakeup_send.send(b"\0")
+		except socket.error:
+			# Buffer full or closed, nothing to wake up
+			pass
+
+
 class Worker(WorkerBase):
 
 	def __init__(self, owner=None):
@@ -1914,6 +1991,18 @@ class Worker(WorkerBase):
 		self.recent_discard = re.compile("|".join(discard), re.I)
 		self.resume = False
 		self.sudo = None
+		self.subprocess_driver = None
+		self.output_tokenizer = argyll_output.Tokenizer()
+		self.output_tokenizer.subscribe(self._output_instrument,
+										argyll_output.INSTRUMENT,
+										argyll_output.SERIAL)
+		self.output_tokenizer.subscribe(self._output_patch,
+										argyll_output.PROMPT,
+										argyll_output.PATCH,
+										argyll_output.PATCH_COUNT,
+										argyll_output.READING,
+										argyll_output.INSTRUMENT_REMOVABLE)
+		self.output_tokenizer.subscribe(self._output_rgb, argyll_output.RGB)
 		self.auth_timestamp = 0
 		self.sessionlogfiles = {}
 		self.triggers = ["Password:"]
@@ -3196,6 +3285,8 @@ END_DATA
 		self.lastmsg.clear()
 		self.repeat = False
 		self.send_buffer = None
+		if hasattr(self, "output_tokenizer"):
+			self.output_tokenizer.reset()
 		# Log interaction with Argyll tools
 		if (not hasattr(self, "logger") or
 			(isinstance(self.logger, DummyLogger) and self.owner and
@@ -3948,9 +4039,12 @@ END_DATA
 										 (profile_out.fileName, intent[0],
 										  "b" if use_b2a else "if"),
 										 {"pcs": "x", "use_cam_clipping": True,
-										  "abortmessage": lang.getstr("aborted")},
+										  "abortmessage": lang.getstr("aborted"),
+										  "pipe_roundtrip":
+										  PersistentXicclu.pipe_roundtrip},
 										 num_workers, self.thread_abort,
-										 logfiles, num_batches=num_batches):
+										 logfiles, num_batches=num_batches,
+										 persistent=True):
 					RGB_dst_out.extend(slices)
 				del XYZ_src_out
 				logfiles.write("\n")
@@ -4321,10 +4415,7 @@ END_DATA
 		logfiles.write("Generating %s 3D LUT...\n" % format)
 
 		# Create input RGB values
-		RGB_oin = []
-		RGB_in = []
-		RGB_indexes = []
-		seen = {}
+		import numpy
 		if format == "eeColor":
 			# Fixed size
 			size = 65
@@ -4339,14 +4430,12 @@ END_DATA
 				input_bits = output_bits
 			# Note: We only round up for the input values, output values
 			# are rounded to nearest integer
-			quantizer = lambda v: int(math.ceil(v * (2 ** input_bits - 1)))
-			scale = quantizer(1.0)
+			quantizer = lambda v: numpy.ceil(v * (2 ** input_bits - 1))
+			scale = int(quantizer(1.0))
 		else:
 			quantizer = lambda v: v
 			scale = 1.0
 		step = 1.0 / (size - 1)
-		RGB_triplet = [0.0, 0.0, 0.0]
-		RGB_index = [0, 0, 0]
 		# Set the fastest and slowest changing columns, from right to left
 		if (format in ("3dl", "mga", "spi3d") or
 			(format == "png" and getcfg("3dlut.image.order") == "bgr")):
@@ -4355,44 +4444,34 @@ END_DATA
 			columns = (2, 0, 1)
 		else:
 			columns = (2, 1, 0)
-		for i in range(0, size):
-			# Red
-			if format == "eeColor" and not eecolor65 and i == size - 1:
-				# Last cLUT entry is fixed to 1.0 for eeColor and unchangeable
-				continue
-			RGB_triplet[columns[0]] = quantizer(step * i)
-			RGB_index[columns[0]] = i
-			for j in range(0, size):
-				# Green
-				if format == "eeColor" and not eecolor65 and j == size - 1:
-					# Last cLUT entry is fixed to 1.0 for eeColor and unchangeable
-					continue
-				RGB_triplet[columns[1]] = quantizer(step * j)
-				RGB_index[columns[1]] = j
-				for k in range(0, size):
-					# Blue
-					if self.thread_abort:
-						raise Info(lang.getstr("aborted"))
-					if format == "eeColor" and not eecolor65 and k == size - 1:
-						# Last cLUT entry is fixed to 1.0 for eeColor and unchangeable
-						continue
-					RGB_triplet[columns[2]] = quantizer(step * k)
-					RGB_oin.append(list(RGB_triplet))
-					RGB_copy = list(RGB_triplet)
-					if format == "eeColor":
-						for l in range(3):
-							RGB_copy[l] = eeColor_to_VidRGB(RGB_copy[l])
-							if input_encoding in ("t", "T"):
-								RGB_copy[l] = VidRGB_to_cLUT65(RGB_copy[l])
-					RGB_index[columns[2]] = k
-					RGB_in.append(RGB_copy)
-					RGB_indexes.append(list(RGB_index))
+		if format == "eeColor" and not eecolor65:
+			# Last cLUT entry is fixed to 1.0 for eeColor and unchangeable
+			steps = size - 1
+		else:
+			steps = size
+		# Grid indexes in file order (slowest changing column first)
+		grid = numpy.indices((steps, ) * 3).reshape((3, -1)).T
+		RGB_indexes = numpy.empty_like(grid)
+		RGB_indexes[:, columns] = grid
+		del grid
+		RGB_oin = quantizer(RGB_indexes * step)
+		if format == "eeColor":
+			RGB_in = eeColor_to_VidRGB(RGB_oin)
+			if input_encoding in ("t", "T"):
+				RGB_in = numpy.vectorize(VidRGB_to_cLUT65,
+										 otypes=[numpy.float64])(RGB_in)
+		else:
+			RGB_in = RGB_oin
+
+		if self.thread_abort:
+			raise Info(lang.getstr("aborted"))
 
 		# Lookup RGB -> RGB values through devicelink profile using icclu
 		# (Using icclu instead of xicclu because xicclu in versions
 		# prior to Argyll CMS 1.6.0 could not deal with devicelink profiles)
 		RGB_out = self.xicclu(link_filename, RGB_in, scale=scale, use_icclu=True,
-							  logfile=logfiles)
+							  logfile=logfiles, as_array=True)
+		del RGB_in
 		
 		if format == "eeColor" and output_encoding == "n":
 			RGBw = self.xicclu(link_filename, [[1, 1, 1]], use_icclu=True)[0]
@@ -4403,126 +4482,114 @@ END_DATA
 		if isinstance(result, Exception):
 			raise result
 
+		# Header lines and data columns. The data is formatted and written
+		# in chunks, so the whole LUT never exists as one big string
 		valsep = " "
+		linesep = "\n"
 		if format not in ("dcl", "png"):
-			lut = [["# Created with %s %s" % (appname, version)]]
-			linesep = "\n"
+			header = ["# Created with %s %s" % (appname, version)]
+		fmt = "%.6f"
 		if format in ("3dl", "dcl"):
 			maxval = math.pow(2, output_bits) - 1
 			if format == "3dl":
-				lut.append(["# INPUT RANGE: %i" % input_bits])
-				lut.append(["# OUTPUT RANGE: %i" % output_bits])
-				lut.append([])
-				for i in range(0, size):
-					lut[-1].append("%i" % quantizer(i * step))
+				header.append("# INPUT RANGE: %i" % input_bits)
+				header.append("# OUTPUT RANGE: %i" % output_bits)
+				header.append(valsep.join("%i" % quantizer(i * step)
+										  for i in range(0, size)))
 			else:
 				# dcl
-				lut = [["# DeviceControl-LG 3D"]]
+				header = ["# DeviceControl-LG 3D"]
 				linesep = "\r\n"
-			for RGB_triplet in RGB_out:
-				lut.append([])
-				for component in (0, 1, 2):
-					lut[-1].append("%i" % int(round(RGB_triplet[component] / scale * maxval)))
+			data = [numpy.rint(RGB_out / scale * maxval)]
+			fmt = "%i"
 		elif format == "cube":
 			if maxval is None:
 				maxval = 1.0
-			lut.append(["LUT_3D_SIZE %i" % size])
-			lut.append(["DOMAIN_MIN 0.0 0.0 0.0"])
+			header.append("LUT_3D_SIZE %i" % size)
+			header.append("DOMAIN_MIN 0.0 0.0 0.0")
 			fp_offset = str(maxval).find(".")
 			domain_max = "DOMAIN_MAX %s %s %s" % (("%%.%if" % len(str(maxval)[fp_offset + 1:]), ) * 3)
-			lut.append([domain_max % ((maxval ,) * 3)])
-			lut.append([])
-			for RGB_triplet in RGB_out:
-				lut.append([])
-				for component in (0, 1, 2):
-					lut[-1].append("%.6f" % (RGB_triplet[component] * maxval))
+			header.append(domain_max % ((maxval ,) * 3))
+			header.append("")
+			data = [RGB_out * maxval]
 		elif format == "spi3d":
 			if maxval is None:
 				maxval = 1.0
-			lut = [["SPILUT 1.0"]]
-			lut.append(["3 3"])
-			lut.append(["%i %i %i" % ((size, ) * 3)])
-			for i, RGB_triplet in enumerate(RGB_out):
-				lut.append([str(index) for index in RGB_indexes[i]])
-				for component in (0, 1, 2):
-					lut[-1].append("%.6f" % (RGB_triplet[component] * maxval))
+			header = ["SPILUT 1.0"]
+			header.append("3 3")
+			header.append("%i %i %i" % ((size, ) * 3))
+			data = [RGB_indexes, RGB_out * maxval]
+			fmt = ["%i"] * 3 + ["%.6f"] * 3
 		elif format == "eeColor":
 			if maxval is None:
 				maxval = 1.0
-			lut = []
-			for i, RGB_triplet in enumerate(RGB_out):
-				lut.append(["%.6f" % (component * maxval) for component in RGB_oin[i]])
-				for component in (0, 1, 2):
-					v = RGB_triplet[component] * maxval
-					if output_encoding == "n":
-						# For eeColor and full range RGB, make sure that the cLUT
-						# output maps to 1.0
-						# The output curve will correct this
-						v /= RGBw[component]
-						v = min(v, 1)
-					v = VidRGB_to_eeColor(v)
-					lut[-1].append("%.6f" % v)
+			header = []
+			RGB_out *= maxval
+			if output_encoding == "n":
+				# For eeColor and full range RGB, make sure that the cLUT
+				# output maps to 1.0
+				# The output curve will correct this
+				RGB_out /= RGBw
+				numpy.minimum(RGB_out, 1, out=RGB_out)
+			data = [RGB_oin * maxval, VidRGB_to_eeColor(RGB_out)]
 			linesep = "\r\n"
 		elif format == "mga":
-			lut = [["#HEADER"],
-				   ["#filename: %s" % os.path.basename(path)],
-				   ["#type: 3D cube file"],
-				   ["#format: 1.00"],
-				   ["#created: %s" % strftime("%d %B %Y")],
-				   ["#owner: %s" % getpass.getuser()],
-				   ["#title: %s" % os.path.splitext(os.path.basename(path))[0]],
-				   ["#END"]]
-			lut.append([])
-			lut.append(["channel 3d"])
-			lut.append(["in %i" % (size ** 3)])
+			header = ["#HEADER",
+					  "#filename: %s" % os.path.basename(path),
+					  "#type: 3D cube file",
+					  "#format: 1.00",
+					  "#created: %s" % strftime("%d %B %Y"),
+					  "#owner: %s" % getpass.getuser(),
+					  "#title: %s" % os.path.splitext(os.path.basename(path))[0],
+					  "#END"]
+			header.append("")
+			header.append("channel 3d")
+			header.append("in %i" % (size ** 3))
 			maxval = 2 ** output_bits - 1
-			lut.append(["out %i" % (maxval + 1)])
-			lut.append([""])
-			lut.append(["format lut"])
-			lut.append([""])
-			lut.append(["values\tred\tgreen\tblue"])
-			for i, RGB_triplet in enumerate(RGB_out):
-				lut.append(["%i" % i])
-				for component in (0, 1, 2):
-					lut[-1].append(("%i" % int(round(RGB_triplet[component] * maxval))))
+			header.append("out %i" % (maxval + 1))
+			header.append("")
+			header.append("format lut")
+			header.append("")
+			header.append("values\tred\tgreen\tblue")
+			data = [numpy.arange(len(RGB_out))[:, numpy.newaxis],
+					numpy.rint(RGB_out * maxval)]
+			fmt = "%i"
 			valsep = "\t"
 		elif format == "png":
-			lut = [[]]
 			if output_bits > 8:
 				# PNG only supports 8 and 16 bit
 				output_bits = 16
 			maxval = 2 ** output_bits - 1
-			for RGB_triplet in RGB_out:
-				if len(lut[-1]) == size:
-					# Append new scanline
-					lut.append([])
-				lut[-1].append([int(round(v * maxval)) for v in RGB_triplet])
-			# Current layout is vertical
+			# Vertical layout: size ** 2 scanlines of size pixels
+			lut = numpy.rint(RGB_out * maxval).astype(int).reshape((size, size,
+																	size, 3))
 			if getcfg("3dlut.image.layout") == "h":
-				# Change layout to horizontal
-				lutv = lut
-				lut = [[]]
-				for i in range(size):
-					if len(lut[-1]) == size ** 2:
-						# Append new scanline
-						lut.append([])
-					for j in range(size):
-						lut[-1].extend(lutv[i + size * j])
-
-		if format != "png":
-			lut.append([])
-			for i, line in enumerate(lut):
-				lut[i] = valsep.join(line)
-			result = linesep.join(lut)
+				# Change layout to horizontal: size scanlines of size ** 2
+				# pixels
+				lut = lut.transpose((1, 0, 2, 3)).reshape((size, size ** 2, 3))
+			else:
+				lut = lut.reshape((size ** 2, size, 3))
+			lut = lut.tolist()
 
 		# Write 3DLUT
-		lut_file = open(path, "wb")
-		if format != "png":
-			lut_file.write(result)
-		else:
-			im = imfile.Image(lut, output_bits)
-			im.write(lut_file)
-		lut_file.close()
+		with open(path, "wb") as lut_file:
+			if format != "png":
+				if header:
+					lut_file.write(safe_str(linesep.join(header) + linesep,
+											"UTF-8"))
+				if isinstance(fmt, str):
+					fmt = [fmt] * sum(column.shape[1] for column in data)
+				chunklen = 65536
+				for i in range(0, len(RGB_out), chunklen):
+					if self.thread_abort:
+						raise Info(lang.getstr("aborted"))
+					numpy.savetxt(lut_file,
+								  numpy.hstack([column[i:i + chunklen]
+												for column in data]),
+								  fmt, valsep, linesep)
+			else:
+				im = imfile.Image(lut, output_bits)
+				im.write(lut_file)
 
 		if format == "eeColor":
 			# Write eeColor 1D LUTs
@@ -5995,65 +6062,73 @@ while 1:
 						if debug >= 9 or (test and not "-?" in args):
 							self.subprocess.interact()
 					self.subprocess.logfile_read = logfiles
-					if self.measure_cmd:
-						keyhit_strs = [" or Q to ", "8\) Exit"]
-						patterns = keyhit_strs + ["Current", r" \d+ of \d+"]
-						self.log("%s: Starting interaction with subprocess" %
-								 appname)
-					else:
-						patterns = []
-						self.log("%s: Waiting for EOF" % appname)
-					loop = 0
-					pwdsent = False
-					authfailed = False
-					eof = False
-					while 1:
-						if loop < 1 and sudo:
-							curpatterns = ["Password:"] + patterns
+					driver = SubprocessDriver(self.subprocess)
+					self.subprocess_driver = driver
+					try:
+						if self.measure_cmd:
+							keyhit_strs = [" or Q to ", "8\) Exit"]
+							patterns = keyhit_strs + ["Current", r" \d+ of \d+"]
+							self.log("%s: Starting interaction with subprocess" %
+									 appname)
 						else:
-							curpatterns = patterns
-						# NOTE: Using a timeout of None can block indefinitely
-						# and prevent expect() from ever returning!
-						self.subprocess.expect(curpatterns + [wexpect.EOF,
-															  wexpect.TIMEOUT],
-											   timeout=1)
-						if self.subprocess.after is wexpect.EOF:
-							self.log("%s: Reached EOF (OK)" % appname)
-							break
-						elif self.subprocess.after is wexpect.TIMEOUT:
-							if not self.subprocess.isalive():
-								self.log("%s: Subprocess no longer alive (timeout)" %
-										 appname)
-								if eof:
-									break
-								eof = True
-							continue
-						elif (self.subprocess.after == "Password:" and
-							  loop < 1 and sudo):
-							if pwdsent:
-								self.subprocess.sendcontrol("C")
-								authfailed = True
-								self.auth_timestamp = 0
+							patterns = []
+							self.log("%s: Waiting for EOF" % appname)
+						loop = 0
+						pwdsent = False
+						authfailed = False
+						eof = False
+						while 1:
+							if loop < 1 and sudo:
+								curpatterns = ["Password:"] + patterns
 							else:
-								self._safe_send(self.pwd.encode(enc, "replace") +
-												os.linesep, obfuscate=True)
-								pwdsent = True
-							if not self.subprocess.isalive():
+								curpatterns = patterns
+							# Returns as soon as a pattern is matched or a key
+							# to send is queued. The timeout is only used to
+							# check if the subprocess is still alive.
+							driver.expect(curpatterns, 1,
+										  lambda: self.measure_cmd and
+												  self.send_buffer)
+							if self.subprocess.after is wexpect.EOF:
+								self.log("%s: Reached EOF (OK)" % appname)
 								break
-							continue
-						elif self.measure_cmd:
-							if [keyhit_str for keyhit_str in keyhit_strs if re.search(keyhit_str,
-													self.subprocess.after)]:
-								# Wait for the keypress
-								self.log("%s: Waiting for send buffer" %
-										 appname)
-								while not self.send_buffer:
-									if not self.subprocess.isalive():
-										self.log("%s: Subprocess no longer alive (unknown reason)" %
-												 appname)
+							elif self.subprocess.after is wexpect.TIMEOUT:
+								if not self.subprocess.isalive():
+									self.log("%s: Subprocess no longer alive (timeout)" %
+											 appname)
+									if eof:
 										break
-									sleep(.05)
-							if (self.send_buffer and
+									eof = True
+									continue
+								if not (self.measure_cmd and self.send_buffer):
+									continue
+							elif (self.subprocess.after == "Password:" and
+								  loop < 1 and sudo):
+								if pwdsent:
+									self.subprocess.sendcontrol("C")
+									authfailed = True
+									self.auth_timestamp = 0
+								else:
+									self._safe_send(self.pwd.encode(enc, "replace") +
+													os.linesep, obfuscate=True)
+									pwdsent = True
+								if not self.subprocess.isalive():
+									break
+								continue
+							elif self.measure_cmd:
+								if [keyhit_str for keyhit_str in keyhit_strs if re.search(keyhit_str,
+														self.subprocess.after)]:
+									# Wait for the keypress
+									self.log("%s: Waiting for send buffer" %
+											 appname)
+									while not self.send_buffer:
+										if not self.subprocess.isalive():
+											self.log("%s: Subprocess no longer alive (unknown reason)" %
+													 appname)
+											break
+										# Keep reading output while waiting
+										driver.expect([], 1,
+													  lambda: self.send_buffer)
+							if (self.measure_cmd and self.send_buffer and
 								self.subprocess.isalive()):
 								if (self.send_buffer == "7" and use_madvr and
 									cmdname == get_argyll_utilname("dispcal")):
@@ -6063,9 +6138,12 @@ while 1:
 										 (appname, self.send_buffer))
 								self._safe_send(self.send_buffer)
 								self.send_buffer = None
-						if not self.subprocess.isalive():
-							break
-						loop += 1
+							if not self.subprocess.isalive():
+								break
+							loop += 1
+					finally:
+						self.subprocess_driver = None
+						driver.close()
 					# We need to call isalive() to set the exitstatus.
 					# We can't use wait() because it might block in the
 					# case of a timeout
@@ -7091,13 +7169,58 @@ while 1:
 		if do_lookup:
 			# Generate inverse table lookup input values
 
+			# Split the cLUT grid into tiles of cLUT rows (a row being all
+			# grid points with the same first and second index). The tiles
+			# don't depend on the number of workers so that checkpoints of
+			# finished tiles can be re-used by later runs.
+			gridrows = clutres ** 2
+			tilesize = max(clutres // 4, 1)
+			tiles = [(start, min(start + tilesize, gridrows))
+					 for start in range(0, gridrows, tilesize)]
+
 			# Use slightly less than equal the amount of CPUs for workers
 			# for best utilization (each worker has 2 xicclu sub-processes)
 			num_cpus = cpu_count()
-			num_workers = min(max(num_cpus, 1), clutres)
+			num_workers = min(max(num_cpus, 1), len(tiles))
 			if num_cpus > 2:
 				num_workers = int(num_workers * 0.75)
 
+			# Finished tiles are checkpointed so that generating the table
+			# can resume after an interruption. Checkpoints are specific to
+			# the lookup tables of the profile and the parameters.
+			checksum = md5()
+			for tagSignature in sorted(profile.tags.keys()):
+				if re.match(r"(?:A2B|B2A)\d|wtpt|bkpt|chad|[rgbk](?:XYZ|TRC)$",
+							tagSignature):
+					checksum.update(tagSignature +
+									profile.tags[tagSignature].tagData)
+			checksum.update(repr((intent, direction, pcs, use_cam_clipping,
+								  clutres, bpc, XYZbp, XYZwp,
+								  m2 and list(m2),
+								  [(ointerp.xp, ointerp.fp) for ointerp in
+								   interp or (Linterp, )])))
+			checkpoint_root = os.path.join(cache, "B2A")
+			checkpoint_dir = os.path.join(checkpoint_root,
+										  checksum.hexdigest())
+			# Remove checkpoints of other runs (aborted, or with different
+			# input) which haven't been resumed within a week
+			if os.path.isdir(checkpoint_root):
+				for name in os.listdir(checkpoint_root):
+					path = os.path.join(checkpoint_root, name)
+					if path == checkpoint_dir:
+						continue
+					try:
+						mtime = os.stat(path).st_mtime
+					except EnvironmentError:
+						continue
+					if time() - mtime > 60 * 60 * 24 * 7:
+						shutil.rmtree(path, True)
+			if not os.path.isdir(checkpoint_dir):
+				os.makedirs(checkpoint_dir)
+			elif logfile:
+				logfile.write("Resuming from checkpoint %s\n" %
+							  checkpoint_dir)
+
 			if logfile:
 				logfile.write("Generating %s%i table lookup input values...\n" %
 							  (source, tableno))
@@ -7113,19 +7236,30 @@ while 1:
 			
 			threshold = int((clutres - 1) * 0.75)
 			threshold2 = int((clutres - 1) / 3)
+
+			# Check once whether xicclu output can be read back per tile
+			# and pass the result on to the workers
+			pipe_roundtrip = PersistentXicclu.probe()
 			
-			for slices in pool_slice(_mp_generate_B2A_clut,
-									 list(range(clutres)),
+			# Hand out about two tiles at a time so that workers which
+			# finish early pick up the remaining ones
+			for slices in pool_slice(_mp_generate_B2A_clut, tiles,
 									 (profile.fileName, intent,
 									  direction, pcs, use_cam_clipping,
 									  clutres, step, threshold,
 									  threshold2, interp, Linterp, m2,
 									  XYZbp, XYZwp, bpc,
-									  lang.getstr("aborted")), {}, num_workers,
+									  lang.getstr("aborted"),
+									  checkpoint_dir),
+									 {"pipe_roundtrip": pipe_roundtrip},
+									 num_workers,
 									 self.thread_abort,
-									 logfile, num_batches=clutres // 9):
+									 logfile,
+									 num_batches=max(len(tiles) //
+													 (num_workers * 2), 1)):
 				for i, data in enumerate((idata, odata1, odata2)):
 					data.extend(slices[i])
+			shutil.rmtree(checkpoint_dir, True)
 
 			if logfile:
 				logfile.write("\n")
@@ -8993,7 +9127,8 @@ usage: spotread [-options] [logfile]
 			sleep(.75)  # Allow time for progress window to update
 			return self.calculate_gamut(profile_path)
 		else:
-			return None, None
+			# Only gamut volume and coverage metadata
+			return self.calculate_gamut(profile_path, create_views=False)
 
 	def create_profile(self, dst_path=None, 
 				skip_scripts=False, display_name=None, 
@@ -10996,9 +11131,10 @@ usage: spotread [-options] [logfile]
 				self.repeat = True
 			elif ", ok" in txt.lower():
 				self.repeat = False
-			if (re.search(r"Patch [2-9]\d* of ", txt, re.I) or
-				(re.search(r"Patch \d+ of |The instrument can be removed from "
-						   "the screen", txt, re.I) and self.patch_count > 1) or
+			if (PATCH_2_RE.search(txt) or
+				((argyll_output.PATCH_RE.search(txt) or
+				  argyll_output.INSTRUMENT_REMOVABLE_RE.search(txt)) and
+				 self.patch_count > 1) or
 				("Result is XYZ:" in txt and
 				 not isinstance(self.progress_wnd, UntetheredFrame))):
 				if self.cmdname == get_argyll_utilname("dispcal") and self.repeat:
@@ -12297,6 +12433,8 @@ usage: spotread [-options] [logfile]
 	
 	def safe_send(self, bytes):
 		self.send_buffer = bytes
+		if self.subprocess_driver:
+			self.subprocess_driver.wakeup()
 		return True
 	
 	def _safe_send(self, bytes, retry=3, obfuscate=False):
@@ -12724,13 +12862,18 @@ usage: spotread [-options] [logfile]
 				pass
 	
 	def calculate_gamut(self, profile_path, intent="r", direction="f",
-						order="n", compare_standard_gamuts=True):
+						order="n", compare_standard_gamuts=True,
+						create_views=True):
 		"""
 		Calculate gamut, volume, and coverage % against sRGB and Adobe RGB.
 		
 		Return gamut volume (int, scaled to sRGB = 1.0) and
 		coverage (dict) as tuple.
 		
+		Without gamut views (VRML), volume and coverage are calculated
+		in-process. Otherwise (or if that fails) Argyll's iccgamut and viewgam
+		calculate them while creating the views.
+		
 		"""
 		if isinstance(profile_path, list):
 			profile_paths = profile_path
@@ -12747,6 +12890,20 @@ usage: spotread [-options] [logfile]
 		if mods:
 			outname += " " + "".join(["[%s]" % mod.upper()
 									  for mod in mods])
+		if not create_views and not mods and profile_paths[0]:
+			comparison_gamuts = []
+			if compare_standard_gamuts:
+				comparison_gamuts.extend(gamut.STANDARD_GAMUTS)
+			for profile_path in profile_paths[1:]:
+				filename, ext = os.path.splitext(profile_path)
+				comparison_gamuts.append((filename.lower().replace(" ", "-"),
+										  profile_path))
+			try:
+				return gamut.get_gamut_volume_coverage(profile_paths[0], intent,
+													   comparison_gamuts)
+			except Exception as exception:
+				self.log("Warning - could not calculate gamut in-process:",
+						 exception)
 		gamut_volume = None
 		gamut_coverage = {}
 		# Create profile gamut and vrml
@@ -12779,9 +12936,7 @@ usage: spotread [-options] [logfile]
 		wrlfilename = name + ".wrl"
 		tmpfilenames = [gamfilename, wrlfilename]
 		if compare_standard_gamuts:
-			comparison_gamuts = [("srgb", "sRGB"),
-								 ("adobe-rgb", "ClayRGB1998"),
-								 ("dci-p3", "SMPTE431_P3")]
+			comparison_gamuts = list(gamut.STANDARD_GAMUTS)
 		else:
 			comparison_gamuts = []
 		for profile_path in profile_paths[1:]:
@@ -14578,124 +14733,134 @@ BEGIN_DATA
 
 	def _write(self, txt):
 		wx.CallAfter(self.audio_visual_feedback, txt)
-		if getattr(self, "measure_cmd", None):
-			# i1 Pro, Spyders: Instrument Type
-			# i1D3: Product Name
-			# K10: Model
-			# specbos: Identification
-			instrument = re.search(r"(?:Instrument Type|Product Name|Model|"
-								   r"Identificaton):\s+([^\r\n]+)",
-								   txt, re.I)
-			if instrument:
-				self._detected_instrument = instrument.group(1)
-			serial = re.search(r"(?:Serial Number):\s+([^\r\n]+)",
-								   txt, re.I)
-			if serial:
-				self._detected_instrument_serial = serial.group(1)
-		if re.search("press 1|space when done|patch 1 of ", txt, re.I):
+		# Classify output lines and dispatch to the _output_* handlers
+		self.output_tokenizer.feed(txt)
+		# Parse
+		wx.CallAfter(self.parse, txt)
+
+	def _output_instrument(self, event):
+		""" Remember detected instrument name and serial number """
+		if not getattr(self, "measure_cmd", None):
+			return
+		# i1 Pro, Spyders: Instrument Type
+		# i1D3: Product Name
+		# K10: Model
+		# specbos: Identification
+		if event.type == argyll_output.INSTRUMENT:
+			self._detected_instrument = event.groups[0]
+		else:
+			self._detected_instrument_serial = event.groups[0]
+
+	def _output_patch(self, event):
+		""" Keep track of measured patches """
+		if event.type == argyll_output.PROMPT:
+			if event.groups[0].lower() not in ("press 1", "space when done"):
+				return
+			reset = True
+		else:
+			reset = (event.type == argyll_output.PATCH and
+					 event.groups[0] == 1 and not self.patch_sequence)
+			if reset:
+				self.patch_sequence = True
+		if reset:
 			# There are some intial measurements which we can't check for
 			# unless -D (debug) is used for Argyll tools
-			if not "patch 1 of " in txt.lower() or not self.patch_sequence:
-				if "patch 1 of " in txt.lower():
-					self.patch_sequence = True
-				self.patch_count = 0
-				self.patterngenerator_sent_count = 0
-		update = re.search(r"[/\\] current|patch \d+ of |the instrument "
-						   "can be removed from the screen", txt, re.I)
-		# Send colors to pattern generator
+			self.patch_count = 0
+			self.patterngenerator_sent_count = 0
+		if self.use_madnet_tpg and event.type in (argyll_output.PATCH,
+												  argyll_output.PATCH_COUNT):
+			# Set madTPG progress bar
+			if event.type == argyll_output.PATCH_COUNT:
+				start, end = 0, event.groups[0]
+			else:
+				start, end = event.groups
+			self.madtpg.set_progress_bar_pos(start, end)
+		if event.type in (argyll_output.PROMPT, argyll_output.PATCH_COUNT):
+			return
+		# Patch update
 		use_patterngenerator = (self.use_patterngenerator and
 								self.patterngenerator and
 								hasattr(self.patterngenerator, "conn"))
 		if (use_patterngenerator or self.use_madnet_tpg or
 			self._use_patternwindow):
-			rgb = re.search(r"Current RGB(?:\s+\d+){3}((?:\s+\d+(?:\.\d+)){3})",
-							txt)
-			if rgb:
-				update_ffp_insertion_ts = False
-				if getcfg("patterngenerator.ffp_insertion") and self.patterngenerator_sent_count > 1:
-					# Frame insertion
-					frq = getcfg("patterngenerator.ffp_insertion.interval")
-					if time() - getattr(self, "_ffp_insertion_ts", 0) > frq:
-						dur = getcfg("patterngenerator.ffp_insertion.duration")
-						lvl = getcfg("patterngenerator.ffp_insertion.level")
-						self.log("%s: Frame insertion duration %is, level = %i%%" %
-								 (appname, dur, lvl * 100))
-						ts = time()
-						if self.use_madnet_tpg:
-							patternconfig = self.madtpg.get_pattern_config()
-							self.madtpg.set_pattern_config(patternconfig[0],
-														   int(lvl * 100), 0, 0)
-							self.madtpg.show_rgb(lvl, lvl, lvl)
-							self.madtpg.set_pattern_config(100, 0, 0, 0)
-						else:
-							self.patterngenerator_send((lvl, lvl, lvl),
-													   (lvl, lvl, lvl))
-						while time() - ts < dur and not (self.subprocess_abort or
-														 self.thread_abort):
-							sleep(.05)
-						if self.use_madnet_tpg:
-							self.madtpg.set_pattern_config(*patternconfig)
-						update_ffp_insertion_ts = True
-					if (not hasattr(self, "_ffp_insertion_ts") or
-						update_ffp_insertion_ts):
-						self._ffp_insertion_ts = time()
-				rgb = [float(v) for v in rgb.groups()[0].strip().split()]
-				if self.use_madnet_tpg:
-					if self.madtpg.show_rgb(*rgb):
-						self.patterngenerator_sent_count += 1
-						self.log("%s: MadTPG_Net sent count: %i" %
-								 (appname, self.patterngenerator_sent_count))
-					else:
-						self.exec_cmd_returnvalue = Error(lang.getstr("patterngenerator.sync_lost"))
-						self.abort_subprocess()
-				else:
-					self.patterngenerator_send(rgb)
-				if getcfg("patterngenerator.ffp_insertion") and update_ffp_insertion_ts:
-					# Delay to allow patch update and settle time after
-					# frame insertion. If display update delay is bigger,
-					# do not use extra delay. Otherwise, subtract display
-					# update delay from fixed delay.
-					if getcfg("measure.override_min_display_update_delay_ms"):
-						dur = getcfg("measure.min_display_update_delay_ms") / 1000.
-					else:
-						dur = 0
-					ts = time()
-					while time() - ts < max(0.8 - dur, 0) and not (self.subprocess_abort or
-																   self.thread_abort):
-						sleep(.05)
-				# Create .ok file which will be picked up by .wait script
-				okfilename = os.path.join(self.tempdir, ".ok")
-				open(okfilename, "w").close()
-			if update:
-				# Check if patch count is higher than patterngenerator sent count
-				if (self.patch_count > self.patterngenerator_sent_count and
-					self.exec_cmd_returnvalue is None):
-					# XXX: This can happen when pausing/unpausing?
-					# Need to investigate
-					self.log("Warning - did we loose sync with the pattern generator?")
-					##self.exec_cmd_returnvalue = Error(lang.getstr("patterngenerator.sync_lost"))
-					##self.abort_subprocess()
-		if update and not (self.subprocess_abort or self.thread_abort or
-						   "the instrument can be removed from the screen"
-						   in txt.lower()):
+			# Check if patch count is higher than patterngenerator sent count
+			if (self.patch_count > self.patterngenerator_sent_count and
+				self.exec_cmd_returnvalue is None):
+				# XXX: This can happen when pausing/unpausing?
+				# Need to investigate
+				self.log("Warning - did we loose sync with the pattern generator?")
+				##self.exec_cmd_returnvalue = Error(lang.getstr("patterngenerator.sync_lost"))
+				##self.abort_subprocess()
+		if not (self.subprocess_abort or self.thread_abort or
+				event.type == argyll_output.INSTRUMENT_REMOVABLE):
 			self.patch_count += 1
 			if use_patterngenerator or self.use_madnet_tpg:
 				self.log("%s: Patch update count: %i" %
 						 (appname, self.patch_count))
-		if self.use_madnet_tpg:
-			progress = re.search("(?:Patch (\\d+) of|Number of patches =) (\\d+)",
-								 txt, re.I)
-			if progress:
-				# Set madTPG progress bar
-				try:
-					start = int(progress.group(1) or 0)
-					end = int(progress.group(2))
-				except ValueError:
-					pass
+
+	def _output_rgb(self, event):
+		""" Send colors to pattern generator """
+		use_patterngenerator = (self.use_patterngenerator and
+								self.patterngenerator and
+								hasattr(self.patterngenerator, "conn"))
+		if not (use_patterngenerator or self.use_madnet_tpg or
+				self._use_patternwindow):
+			return
+		update_ffp_insertion_ts = False
+		if getcfg("patterngenerator.ffp_insertion") and self.patterngenerator_sent_count > 1:
+			# Frame insertion
+			frq = getcfg("patterngenerator.ffp_insertion.interval")
+			if time() - getattr(self, "_ffp_insertion_ts", 0) > frq:
+				dur = getcfg("patterngenerator.ffp_insertion.duration")
+				lvl = getcfg("patterngenerator.ffp_insertion.level")
+				self.log("%s: Frame insertion duration %is, level = %i%%" %
+						 (appname, dur, lvl * 100))
+				ts = time()
+				if self.use_madnet_tpg:
+					patternconfig = self.madtpg.get_pattern_config()
+					self.madtpg.set_pattern_config(patternconfig[0],
+												   int(lvl * 100), 0, 0)
+					self.madtpg.show_rgb(lvl, lvl, lvl)
+					self.madtpg.set_pattern_config(100, 0, 0, 0)
 				else:
-					self.madtpg.set_progress_bar_pos(start, end)
-		# Parse
-		wx.CallAfter(self.parse, txt)
+					self.patterngenerator_send((lvl, lvl, lvl),
+											   (lvl, lvl, lvl))
+				while time() - ts < dur and not (self.subprocess_abort or
+												 self.thread_abort):
+					sleep(.05)
+				if self.use_madnet_tpg:
+					self.madtpg.set_pattern_config(*patternconfig)
+				update_ffp_insertion_ts = True
+			if (not hasattr(self, "_ffp_insertion_ts") or
+				update_ffp_insertion_ts):
+				self._ffp_insertion_ts = time()
+		rgb = list(event.groups)
+		if self.use_madnet_tpg:
+			if self.madtpg.show_rgb(*rgb):
+				self.patterngenerator_sent_count += 1
+				self.log("%s: MadTPG_Net sent count: %i" %
+						 (appname, self.patterngenerator_sent_count))
+			else:
+				self.exec_cmd_returnvalue = Error(lang.getstr("patterngenerator.sync_lost"))
+				self.abort_subprocess()
+		else:
+			self.patterngenerator_send(rgb)
+		if getcfg("patterngenerator.ffp_insertion") and update_ffp_insertion_ts:
+			# Delay to allow patch update and settle time after
+			# frame insertion. If display update delay is bigger,
+			# do not use extra delay. Otherwise, subtract display
+			# update delay from fixed delay.
+			if getcfg("measure.override_min_display_update_delay_ms"):
+				dur = getcfg("measure.min_display_update_delay_ms") / 1000.
+			else:
+				dur = 0
+			ts = time()
+			while time() - ts < max(0.8 - dur, 0) and not (self.subprocess_abort or
+														   self.thread_abort):
+				sleep(.05)
+		# Create .ok file which will be picked up by .wait script
+		okfilename = os.path.join(self.tempdir, ".ok")
+		open(okfilename, "w").close()
 
 	@property
 	def _use_patternwindow(self):
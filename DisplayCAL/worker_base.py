@@ -4,8 +4,10 @@
 from binascii import hexlify
 import atexit
 import math
+import io
 import os
 import pipes
+import queue
 import re
 import shutil
 import struct
@@ -13,6 +15,7 @@ import subprocess as sp
 import sys
 import tempfile
 import textwrap
+import threading
 import traceback
 
 if sys.platform == "win32":
@@ -29,6 +32,7 @@ from log import LogFile, safe_print
 from meta import name as appname
 from multiprocess import mp, pool_slice
 from options import debug, verbose
+from ordereddict import OrderedDict
 from util_os import getenvu, quote_args, which
 from util_str import make_filename_safe, safe_basestring, safe_str, safe_unicode
 import CGATS
@@ -42,20 +46,51 @@ def Property(func):
 	return property(**func())
 
 
+_xicclu_annotation_re = re.compile(r"\[[^\]]*\]|\(clip\)")
+
+
+def pack_values(values, dtype="<f8"):
+	"""
+	Pack rows of values as bytes for exchange with Xicclu
+	
+	The format is the raw (by default little-endian float64) values, row
+	after row. Use unpack_values() with the number of channels to get them
+	back as array.
+	
+	"""
+	import numpy
+	return numpy.ascontiguousarray(values, dtype=dtype).tobytes()
+
+
+def unpack_values(data, channels=3, dtype="<f8"):
+	""" Unpack bytes created by pack_values() into an array of rows """
+	import numpy
+	return numpy.frombuffer(data, dtype=dtype).reshape((-1, channels))
+
+
 def _mp_xicclu(chunk, thread_abort_event, progress_queue, profile_filename,
 			   intent="r", direction="f", order="n",
 			   pcs=None, scale=1, cwd=None, startupinfo=None, use_icclu=False,
 			   use_cam_clipping=False, logfile=None,
 			   show_actual_if_clipped=False, input_encoding=None,
 			   output_encoding=None, abortmessage="Aborted", output_format=None,
-			   reverse=False, convert_video_rgb_to_clut65=False, verbose=1):
+			   reverse=False, convert_video_rgb_to_clut65=False, verbose=1,
+			   pipe_roundtrip=None):
 	if not config.cfg.items(config.ConfigParser.DEFAULTSECT):
 		config.initcfg()
-	profile = ICCP.ICCProfile(profile_filename)
-	xicclu = Xicclu(profile, intent, direction, order, pcs, scale, cwd,
-					startupinfo, use_icclu, use_cam_clipping, logfile,
-					None, show_actual_if_clipped, input_encoding,
-					output_encoding, convert_video_rgb_to_clut65, verbose)
+	if pipe_roundtrip is not None:
+		PersistentXicclu.pipe_roundtrip = pipe_roundtrip
+	args = (profile_filename, intent, direction, order, pcs, scale, cwd,
+			startupinfo, use_icclu, use_cam_clipping, logfile, None,
+			show_actual_if_clipped, input_encoding, output_encoding,
+			convert_video_rgb_to_clut65, verbose)
+	# Re-use a warm xicclu from previous batches processed by this process
+	key = xicclu_pool.get_key(*args)
+	if key:
+		xicclu = xicclu_pool.acquire(key, lambda: get_xicclu(*args,
+															 persistent=True))
+	else:
+		xicclu = Xicclu(ICCP.ICCProfile(profile_filename), *args[1:])
 	prevperc = 0
 	start = 0
 	num_subchunks = 50
@@ -69,27 +104,54 @@ def _mp_xicclu(chunk, thread_abort_event, progress_queue, profile_filename,
 			xicclu.exit(raise_exception=False)
 			return Info(abortmessage)
 		end = int(math.ceil(subchunksize * (i + 1)))
-		xicclu(chunk[start:end])
+		try:
+			xicclu(chunk[start:end])
+		except:
+			xicclu.exit(raise_exception=False)
+			raise
 		start = end
 		perc = round((i + 1.0) / num_subchunks * 100)
 		if progress_queue and perc > prevperc:
 			progress_queue.put(perc - prevperc)
 			prevperc = perc
-	xicclu.exit()
-	return xicclu.get(output_format=output_format, reverse=reverse)
+	if output_format:
+		# Return packed binary output, one bytes object for the whole chunk
+		get = lambda: xicclu.get_packed(output_format[0], output_format[1],
+										reverse)
+	else:
+		get = lambda: xicclu.get(reverse=reverse)
+	if not key:
+		xicclu.exit()
+		return get()
+	try:
+		xicclu.close()
+		result = get()
+	except:
+		xicclu.exit(raise_exception=False)
+		raise
+	xicclu_pool.release(xicclu)
+	return result
 
 
 def _mp_generate_B2A_clut(chunk, thread_abort_event, progress_queue,
 						  profile_filename, intent, direction, pcs,
 						  use_cam_clipping, clutres, step, threshold,
 						  threshold2, interp, Linterp, m2, XYZbp, XYZwp, bpc,
-						  abortmessage="Aborted"):
+						  abortmessage="Aborted", checkpoint_dir=None,
+						  pipe_roundtrip=None):
 	"""
 	B2A cLUT generation worker
 	
+	'chunk' is a list of tiles (start, end) of cLUT rows, a row being all
+	grid points with the same first and second index. The grid points of
+	each tile are looked up as one batch. If checkpoint_dir is given, the
+	lookup results of finished tiles are saved there, and tiles whose
+	results have already been saved are not looked up again.
+	
 	This should be spawned as a multiprocessing process
 	
 	"""
+	import numpy
 	if debug:
 		safe_print("comtypes?", "comtypes" in str(list(sys.modules.keys())))
 		safe_print("numpy?", "numpy" in str(list(sys.modules.keys())))
@@ -97,86 +159,181 @@ def _mp_generate_B2A_clut(chunk, thread_abort_event, progress_queue,
 		safe_print("x3dom?", "x3dom" in str(list(sys.modules.keys())))
 	if not config.cfg.items(config.ConfigParser.DEFAULTSECT):
 		config.initcfg()
+	if pipe_roundtrip is not None:
+		PersistentXicclu.pipe_roundtrip = pipe_roundtrip
 	idata = []
+	data1 = []
+	data2 = []
 	abmaxval = 255 + (255 / 256.0)
 	profile = ICCP.ICCProfile(profile_filename)
-	xicclu1 = Xicclu(profile, intent, direction, "n", pcs, 100)
-	if use_cam_clipping:
-		# Use CAM Jab for clipping for cLUT grid points after a given
-		# threshold
-		xicclu2 = Xicclu(profile, intent, direction, "n", pcs, 100,
-						 use_cam_clipping=True)
-	prevperc = 0
-	count = 0
-	chunksize = len(chunk)
-	for interp_tuple in (interp, Linterp):
-		if interp_tuple:
-			# Use numpy for speed
-			if interp_tuple is interp:
-				interp_list = list(interp_tuple)
+	if profile.connectionColorSpace == "XYZ":
+		m2i = numpy.array(m2.inverted())
+		if intent == "a":
+			wtpt = list(profile.tags.wtpt.ir.values())
+	# Use CAM Jab for clipping for cLUT grid points after a given threshold
+	# (second lookup)
+	lookup_args = [(profile_filename, intent, direction, "n", pcs, 100, None,
+					None, False, cam_clipping) for cam_clipping in (False, True)]
+	xicclus = [None, None]
+	# Whether lookup output can be read back tile by tile. If not, all tiles
+	# of the chunk are looked up by one xicclu process (per lookup type),
+	# and the output is split up by tile when the chunk is done.
+	per_tile = PersistentXicclu.probe()
+
+	def get_lookup_worker(i):
+		xicclu = xicclus[i]
+		if not xicclu:
+			args = lookup_args[i]
+			key = xicclu_pool.get_key(*args)
+			if key:
+				xicclu = xicclu_pool.acquire(key,
+											 lambda: get_xicclu(*args,
+																persistent=True))
 			else:
-				interp_list = [interp_tuple]
-			for i, ointerp in enumerate(interp_list):
-				interp_list[i] = colormath.Interp(ointerp.xp, ointerp.fp,
-												  use_numpy=True)
-			if interp_tuple is interp:
-				interp = interp_list
+				xicclu = get_xicclu(*args)
+			xicclus[i] = xicclu
+		elif xicclu.closed:
+			xicclu.spawn()
+		return xicclu
+
+	def lookup(i, idata):
+		if not len(idata):
+			return numpy.empty((0, 3))
+		xicclu = get_lookup_worker(i)
+		xicclu(idata)
+		xicclu.close()
+		return xicclu.get_array()[0]
+
+	def save_checkpoint(checkpoint, odata):
+		# Write to a temporary file first so an interrupted write doesn't
+		# leave a partial checkpoint behind
+		with open(checkpoint + ".tmp", "wb") as npy:
+			numpy.save(npy, odata)
+		os.replace(checkpoint + ".tmp", checkpoint)
+
+	def finish(release=True):
+		for xicclu in xicclus:
+			if not xicclu:
+				continue
+			if release and getattr(xicclu, "pool_key", None):
+				xicclu_pool.release(xicclu)
 			else:
-				Linterp = interp_list[0]
-	if profile.connectionColorSpace == "XYZ":
-		m2i = m2.inverted()
-	for a in chunk:
-		if thread_abort_event.is_set():
+				xicclu.exit(raise_exception=False)
+
+	prevperc = 0
+	grid = numpy.arange(clutres)
+	# Lookup output of each tile, None for tiles whose lookup is pending
+	# (see per_tile)
+	tiles = []
+	pending = []  # (Tile index, checkpoint, count of first, second lookup)
+	try:
+		for n, (start, end) in enumerate(chunk):
+			if thread_abort_event.is_set():
+				finish(False)
+				return Info(abortmessage)
+			rows = numpy.arange(start, end)
+			a = numpy.repeat(rows // clutres, clutres)
+			b = numpy.repeat(rows % clutres, clutres)
+			c = numpy.tile(grid, end - start)
+			d, e, f = a * step, b * step, c * step
+			if profile.connectionColorSpace == "XYZ":
+				# Apply TRC to XYZ values to distribute them optimally
+				# across cLUT grid points.
+				XYZ = numpy.stack([numpy.interp(v, ointerp.xp, ointerp.fp,
+												ointerp.left, ointerp.right)
+								   for v, ointerp in zip((d, e, f), interp)],
+								  axis=-1)
+				# Scale into PCS
+				v = XYZ.dot(m2i.T)
+				if bpc and XYZbp != [0, 0, 0]:
+					v = colormath.batch.blend_blackpoint(v, None, XYZbp)
+				if intent == "a":
+					v = colormath.batch.adapt(v, XYZwp, wtpt)
+			else:
+				# Legacy CIELAB
+				L = numpy.interp(d * 100, Linterp.xp, Linterp.fp,
+								 Linterp.left, Linterp.right)
+				v = numpy.stack([L, -128 + e * abmaxval, -128 + f * abmaxval],
+								axis=-1)
+			idata.extend("%.6f %.6f %.6f" % tuple(row) for row in v.tolist())
+			# Which grid points to look up with/without CAM clipping
 			if use_cam_clipping:
-				xicclu2.exit()
-			xicclu1.exit()
-			return Info(abortmessage)
-		for b in range(clutres):
-			for c in range(clutres):
-				d, e, f = [v * step for v in (a, b, c)]
-				if profile.connectionColorSpace == "XYZ":
-					# Apply TRC to XYZ values to distribute them optimally
-					# across cLUT grid points.
-					XYZ = [interp[i](v) for i, v in enumerate((d, e, f))]
-					##print "%3.6f %3.6f %3.6f" % tuple(XYZ), '->',
-					# Scale into PCS
-					v = m2i * XYZ
-					if bpc and XYZbp != [0, 0, 0]:
-						v = colormath.blend_blackpoint(v[0], v[1], v[2],
-												None, XYZbp)
-					##print "%3.6f %3.6f %3.6f" % tuple(v)
-					##raw_input()
-					if intent == "a":
-						v = colormath.adapt(*v + [XYZwp,
-												  list(profile.tags.wtpt.ir.values())])
+				if pcs == "x":
+					mask1 = ((a <= threshold) & (b <= threshold) &
+							 (c <= threshold))
+				else:
+					mask1 = numpy.zeros(len(v), dtype=bool)
+				if pcs == "l":
+					mask2 = numpy.ones(len(v), dtype=bool)
 				else:
-					# Legacy CIELAB
-					L = Linterp(d * 100)
-					v = L, -128 + e * abmaxval, -128 + f * abmaxval
-				idata.append("%.6f %.6f %.6f" % tuple(v))
-				# Lookup CIE -> device values through profile using xicclu
-				if not use_cam_clipping or (pcs == "x" and
-											a <= threshold and
-											b <= threshold and
-											c <= threshold):
-					xicclu1(v)
-				if use_cam_clipping and (pcs == "l" or
-										 a > threshold2 or
-										 b > threshold2 or
-										 c > threshold2):
-					xicclu2(v)
-				count += 1.0
-			perc = round(count / (chunksize * clutres ** 2) * 100)
+					mask2 = ((a > threshold2) | (b > threshold2) |
+							 (c > threshold2))
+			else:
+				mask1 = numpy.ones(len(v), dtype=bool)
+				mask2 = numpy.zeros(len(v), dtype=bool)
+			count1 = int(mask1.sum())
+			count = count1 + int(mask2.sum())
+			odata = None
+			checkpoint = None
+			if checkpoint_dir:
+				checkpoint = os.path.join(checkpoint_dir,
+										  "%i-%i.npy" % (start, end))
+				if os.path.isfile(checkpoint):
+					try:
+						odata = numpy.load(checkpoint)
+					except Exception as exception:
+						safe_print("Warning - could not load %s: %s" %
+								   (checkpoint, exception))
+					else:
+						if odata.shape != (count, 3):
+							odata = None
+			if odata is None and not per_tile:
+				# Lookup CIE -> device values through profile when the
+				# chunk is done
+				for i, mask in enumerate((mask1, mask2)):
+					if mask.any():
+						get_lookup_worker(i)(v[mask])
+				pending.append((n, checkpoint, count1, count - count1))
+			elif odata is None:
+				# Lookup CIE -> device values through profile
+				odata = numpy.concatenate([lookup(0, v[mask1]),
+										   lookup(1, v[mask2])])
+				if checkpoint:
+					save_checkpoint(checkpoint, odata)
+			tiles.append((odata, count1))
+			if odata is None:
+				continue
+			perc = round((n + 1.0) / len(chunk) * 100)
 			if progress_queue and perc > prevperc:
 				progress_queue.put(perc - prevperc)
 				prevperc = perc
-	if use_cam_clipping:
-		xicclu2.exit()
-		data2 = xicclu2.get()
-	else:
-		data2 = []
-	xicclu1.exit()
-	data1 = xicclu1.get()
+		if pending:
+			outputs = []
+			for xicclu in xicclus:
+				if xicclu:
+					xicclu.close()
+					outputs.append(xicclu.get_array()[0])
+				else:
+					outputs.append(numpy.empty((0, 3)))
+			offsets = [0, 0]
+			for n, checkpoint, count1, count2 in pending:
+				parts = []
+				for i, count in enumerate((count1, count2)):
+					parts.append(outputs[i][offsets[i]:offsets[i] + count])
+					offsets[i] += count
+				odata = numpy.concatenate(parts)
+				if checkpoint:
+					save_checkpoint(checkpoint, odata)
+				tiles[n] = (odata, count1)
+			if progress_queue and prevperc < 100:
+				progress_queue.put(100 - prevperc)
+	except:
+		finish(False)
+		raise
+	finish()
+	for odata, count1 in tiles:
+		data1.extend(odata[:count1].tolist())
+		data2.extend(odata[count1:].tolist())
 	return idata, data1, data2
 
 
@@ -429,22 +586,43 @@ class WorkerBase(object):
 			   pcs=None, scale=1, cwd=None, startupinfo=None, raw=False,
 			   logfile=None, use_icclu=False, use_cam_clipping=False,
 			   get_clip=False, show_actual_if_clipped=False,
-			   input_encoding=None, output_encoding=None):
+			   input_encoding=None, output_encoding=None, as_array=False):
 		"""
 		Call xicclu, feed input floats into stdin, return output floats.
 		
 		input data needs to be a list of 3-tuples (or lists) with floats,
-		alternatively a list of strings.
+		alternatively a list of strings or a NumPy array.
 		output data will be returned in same format, or as list of strings
-		if 'raw' is true.
+		if 'raw' is true, or as NumPy array if 'as_array' is true.
 		
 		"""
-		with Xicclu(profile, intent, direction, order, pcs, scale, cwd,
-					startupinfo, use_icclu, use_cam_clipping, logfile,
-					self, show_actual_if_clipped, input_encoding,
-					output_encoding) as xicclu:
+		args = (profile, intent, direction, order, pcs, scale, cwd,
+				startupinfo, use_icclu, use_cam_clipping, logfile, self,
+				show_actual_if_clipped, input_encoding, output_encoding)
+		key = xicclu_pool.get_key(*args)
+		if not key:
+			with get_xicclu(*args) as xicclu:
+				xicclu(idata)
+			if as_array:
+				return xicclu.get_array()[0]
+			return xicclu.get(raw, get_clip)
+		# Use a warm xicclu from the pool
+		xicclu = xicclu_pool.acquire(key, lambda: get_xicclu(*args,
+															 persistent=True))
+		xicclu.logfile = logfile
+		xicclu.worker = self
+		try:
 			xicclu(idata)
-		return xicclu.get(raw, get_clip)
+			xicclu.close()
+			if as_array:
+				result = xicclu.get_array()[0]
+			else:
+				result = xicclu.get(raw, get_clip)
+		except:
+			xicclu.exit(raise_exception=False)
+			raise
+		xicclu_pool.release(xicclu)
+		return result
 
 
 class Xicclu(WorkerBase):
@@ -579,6 +757,7 @@ class Xicclu(WorkerBase):
 		self.closed = False
 		self.output = []
 		self.errors = []
+		self.rows = 0
 		self.stdout = tempfile.SpooledTemporaryFile()
 		self.stderr = tempfile.SpooledTemporaryFile()
 		self.subprocess = sp.Popen(self.args, stdin=sp.PIPE, stdout=self.stdout,
@@ -591,6 +770,14 @@ class Xicclu(WorkerBase):
 		return VidRGB_to_cLUT65(eeColor_to_VidRGB(n))
 	
 	def __call__(self, idata):
+		if hasattr(idata, "ndim") and not self.convert_video_rgb_to_clut65:
+			# NumPy array. Format all rows in one go
+			import numpy
+			if idata.ndim == 1:
+				idata = idata.reshape((1, -1))
+			stream = io.StringIO()
+			numpy.savetxt(stream, idata, "%.17g")
+			idata = stream.getvalue()
 		if not isinstance(idata, str):
 			verbose = self.verbose
 			if self.convert_video_rgb_to_clut65:
@@ -613,7 +800,10 @@ class Xicclu(WorkerBase):
 					idata[i] = " ".join(str(devi_devip(n / scale) * scale) for n in v)
 		else:
 			idata = idata.splitlines()
+		# An empty line ends xicclu
+		idata = [line for line in idata if line.strip()]
 		numrows = len(idata)
+		self.rows += numrows
 		chunklen = 1000
 		i = 0
 		p = self.subprocess
@@ -683,6 +873,9 @@ class Xicclu(WorkerBase):
 
 	def exit(self, raise_exception=True):
 		self.close(raise_exception)
+		self._remove_temp()
+
+	def _remove_temp(self):
 		if self.temp and os.path.isfile(self.profile_path):
 			os.remove(self.profile_path)
 			if self.tempdir and not os.listdir(self.tempdir):
@@ -753,6 +946,58 @@ class Xicclu(WorkerBase):
 		if self.sessionlogfile:
 			self.sessionlogfile.close()
 		return parsed
+
+	def get_array(self):
+		"""
+		Return output values and clipping flags as NumPy arrays
+		
+		Parses the whole xicclu output in one go instead of line by line.
+		
+		"""
+		import numpy
+		if self.sessionlogfile:
+			self.sessionlogfile.write("".join(self.output))
+			self.sessionlogfile.close()
+		if self.verbose:
+			# Output lines look like
+			# <input> [<colorspace>] -> <output> [<colorspace>] [(clip)]
+			rows = [line.split("->")[-1] for line in self.output
+					if "->" in line and not line.lstrip().startswith("[")]
+			clip = numpy.array(["(clip)" in row for row in rows], dtype=bool)
+			text = _xicclu_annotation_re.sub(" ", " ".join(rows))
+		else:
+			rows = [line for line in self.output if line.strip()]
+			clip = numpy.zeros(len(rows), dtype=bool)
+			text = " ".join(rows)
+		if not rows:
+			return numpy.empty((0, 0)), clip
+		odata = numpy.array(text.split(), dtype=numpy.float64)
+		odata = odata.reshape((len(rows), -1)) / float(self.output_scale)
+		if self.convert_video_rgb_to_clut65:
+			odata = VidRGB_to_eeColor(odata)
+		return odata, clip
+
+	def call_packed(self, data, channels=3, dtype="<f8"):
+		"""
+		Look up input values packed with pack_values()
+		
+		"""
+		self(unpack_values(data, channels, dtype))
+
+	def get_packed(self, dtype="<f8", maxv=None, reverse=False):
+		"""
+		Return output values packed as bytes (see pack_values)
+		
+		If maxv is given, device output values are scaled to 0..maxv and
+		rounded (e.g. dtype "<H" and maxv 65535 for 16 bit integer encoding).
+		
+		"""
+		odata = self.get_array()[0]
+		if reverse:
+			odata = odata[:, ::-1]
+		if maxv:
+			odata = (odata / float(self.scale) * maxv).round()
+		return pack_values(odata, dtype)
 	
 	@Property
 	def subprocess_abort():
@@ -779,6 +1024,487 @@ class Xicclu(WorkerBase):
 		return locals()
 
 
+class PersistentXicclu(Xicclu):
+
+	"""
+	Xicclu that keeps its ArgyllCMS child process running between lookups
+	
+	Output is read back through a pipe when close() is called, so each
+	lookup costs one pipe round-trip instead of a process start. exit() ends
+	the child process. Used by XiccluPool.
+	
+	"""
+
+	# Whether xicclu/icclu output can be read back without ending the child
+	# process (i.e. the child flushes its output after each line). None until
+	# probed (see probe). False disables pooling of Argyll lookups.
+	# Multiprocessing workers get the result passed as argument (see
+	# _mp_xicclu).
+	pipe_roundtrip = None
+
+	# Seconds to wait for the probe's output
+	probe_timeout = 2
+
+	_probe_lock = threading.Lock()
+
+	@classmethod
+	def probe(cls, use_icclu=False, cwd=None, startupinfo=None):
+		"""
+		Return whether output can be read back without ending the child
+		
+		Checked once by looking up a single color through the sRGB
+		reference profile.
+		
+		"""
+		if cls.pipe_roundtrip is not None:
+			return cls.pipe_roundtrip
+		with cls._probe_lock:
+			if cls.pipe_roundtrip is not None:
+				return cls.pipe_roundtrip
+			utilname = "icclu" if use_icclu else "xicclu"
+			xicclu = get_argyll_util(utilname)
+			profile = get_data_path(os.path.join("ref", "sRGB.icm"))
+			if not xicclu or not profile:
+				# Can't tell yet
+				return True
+			if sys.platform == "win32" and not startupinfo:
+				startupinfo = sp.STARTUPINFO()
+				startupinfo.dwFlags |= sp.STARTF_USESHOWWINDOW
+				startupinfo.wShowWindow = sp.SW_HIDE
+			try:
+				p = sp.Popen([safe_str(xicclu), "-v0", "-ff",
+							  safe_str(profile)], stdin=sp.PIPE,
+							 stdout=sp.PIPE, stderr=sp.STDOUT,
+							 cwd=safe_str(cwd) if cwd else None,
+							 startupinfo=startupinfo,
+							 universal_newlines=True)
+			except EnvironmentError as exception:
+				safe_print("Warning - could not run %s: %s" %
+						   (utilname, exception))
+				return True
+			lines = queue.Queue()
+			reader = threading.Thread(target=cls._read,
+									  args=(p.stdout, lines),
+									  name="XiccluProbeReader")
+			reader.daemon = True
+			reader.start()
+			try:
+				p.stdin.write("0.5 0.5 0.5\n")
+				p.stdin.flush()
+				line = lines.get(True, cls.probe_timeout)
+			except (IOError, queue.Empty):
+				line = None
+			try:
+				p.stdin.write("\n")
+				p.stdin.close()
+			except IOError:
+				pass
+			p.wait()
+			if not line:
+				safe_print("%s doesn't flush its output, disabling "
+						   "persistent lookups" % utilname)
+			PersistentXicclu.pipe_roundtrip = bool(line)
+			return cls.pipe_roundtrip
+
+	def spawn(self):
+		self.closed = False
+		self.output = []
+		self.errors = []
+		self.rows = 0
+		if (getattr(self, "subprocess", None) and
+			self.subprocess.poll() is None):
+			return
+		self.stderr = tempfile.SpooledTemporaryFile()
+		self.subprocess = sp.Popen(self.args, stdin=sp.PIPE, stdout=sp.PIPE,
+								   stderr=self.stderr, cwd=self.cwd,
+								   startupinfo=self.startupinfo,
+								   universal_newlines=True)
+		# Read output in a thread so the child never blocks on a full pipe
+		self._lines = queue.Queue()
+		reader = threading.Thread(target=self._read,
+								  args=(self.subprocess.stdout, self._lines),
+								  name="XiccluOutputReader")
+		reader.daemon = True
+		reader.start()
+
+	@staticmethod
+	def _read(stdout, lines):
+		for line in stdout:
+			lines.put(line)
+		lines.put(None)
+
+	def close(self, raise_exception=True):
+		""" Read back the output for all rows since spawn() """
+		if self.closed:
+			return
+		if not self.subprocess.stdin.closed:
+			self.subprocess.stdin.flush()
+		count_all = not self.verbose
+		output = []
+		count = 0
+		while count < self.rows:
+			try:
+				line = self._lines.get(True, 1)
+			except queue.Empty:
+				# Lookups through large profiles can take a while. The
+				# reader puts None when the child exits.
+				if self.subprocess_abort or self.thread_abort:
+					self._stop()
+					raise Info(lang.getstr("aborted"))
+				continue
+			if line is None:
+				break
+			output.append(line)
+			if count_all or "->" in line:
+				count += 1
+		if count < self.rows:
+			# The child exited. Collect any remaining output.
+			self._stop()
+			while True:
+				line = self._lines.get()
+				if line is None:
+					break
+				output.append(line)
+		self.output = output
+		if self.sessionlogfile and self.errors:
+			self.sessionlogfile.write("\n".join(self.errors))
+		if self.logfile:
+			self.logfile.write("\n")
+		self.closed = True
+		if self.subprocess.returncode and raise_exception:
+			# Error
+			raise IOError("\n".join(self.errors))
+
+	def exit(self, raise_exception=True):
+		try:
+			self.close(raise_exception)
+		finally:
+			self._stop()
+			self._remove_temp()
+
+	def _stop(self):
+		p = self.subprocess
+		if p.returncode is not None:
+			return
+		if p.poll() is None:
+			try:
+				p.stdin.write("\n")
+				p.stdin.close()
+			except IOError:
+				pass
+		p.wait()
+		self.stderr.seek(0)
+		self.errors = self.stderr.readlines()
+		self.stderr.close()
+
+
+class NativeXicclu(Xicclu):
+
+	"""
+	In-process drop-in replacement for Xicclu
+	
+	Uses icctransform to do lookups with NumPy instead of piping text to
+	and from an ArgyllCMS xicclu/icclu subprocess. Raises
+	icctransform.UnsupportedTransformError if the profile or any of the
+	options can't be handled in-process (see get_xicclu).
+	
+	"""
+
+	def __init__(self, profile, intent="r", direction="f", order="n",
+				 pcs=None, scale=1, cwd=None, startupinfo=None, use_icclu=False,
+				 use_cam_clipping=False, logfile=None, worker=None,
+				 show_actual_if_clipped=False, input_encoding=None,
+				 output_encoding=None, convert_video_rgb_to_clut65=False,
+				 verbose=1):
+		import icctransform
+		if not profile:
+			raise Error("Xicclu: Profile is %r" % profile)
+		if (use_cam_clipping or show_actual_if_clipped or
+			convert_video_rgb_to_clut65 or
+			input_encoding not in (None, "n") or
+			output_encoding not in (None, "n")):
+			raise icctransform.UnsupportedTransformError("Xicclu options")
+		WorkerBase.__init__(self)
+		if not isinstance(profile, (CGATS.CGATS, ICCP.ICCProfile)):
+			if profile.lower().endswith(".cal"):
+				raise icctransform.UnsupportedTransformError("Calibration")
+			profile = ICCP.ICCProfile(profile)
+		self.transform = icctransform.get_transform(profile, intent,
+													direction, order, pcs)
+		self.scale = scale
+		self.convert_video_rgb_to_clut65 = False
+		self.logfile = logfile
+		self.worker = worker
+		self.temp = False
+		self.verbose = verbose
+		self.show_actual_if_clipped = False
+		self.output_scale = 1.0
+		# Device values are scaled by 'scale', PCS values are not
+		self.input_scale = 1.0
+		if self.transform.input_colorspace not in ("XYZ", "Lab"):
+			self.input_scale = float(scale)
+		if self.transform.output_colorspace not in ("XYZ", "Lab"):
+			self.output_scale = 1.0 / scale
+		# xicclu outputs forward XYZ lookups as 0..100 (see Xicclu.__init__)
+		self.raw_scale = 1.0
+		if (profile.profileClass not in ("abst", "link") and
+			direction in ("f", "ib") and
+			(pcs == "x" or (profile.connectionColorSpace == "XYZ" and
+							not pcs))):
+			self.raw_scale = 100.0
+		self.spawn()
+
+	def spawn(self):
+		self.closed = False
+		self.output = []
+		self.errors = []
+		self._in = []
+		self._out = []
+		self._clip = []
+
+	def __call__(self, idata):
+		import numpy
+		if isinstance(idata, str):
+			idata = [line.split() for line in idata.splitlines()
+					 if line.strip()]
+		elif not hasattr(idata, "ndim"):
+			idata = list(idata)
+			if idata and isinstance(idata[0], (float, int)):
+				idata = [idata]
+			idata = [v.split() if isinstance(v, str) else v for v in idata]
+		idata = numpy.asarray(idata, dtype=numpy.float64)
+		self._in.append(idata)
+		idata = idata / self.input_scale
+		numrows = len(idata)
+		chunklen = 65536
+		prevperc = -1
+		for i in range(0, numrows, chunklen):
+			if getattr(sys, "_sigbreak", False) and not self.subprocess_abort:
+				self.subprocess_abort = True
+				safe_print("Got SIGBREAK, aborting subprocess...")
+			if self.subprocess_abort or self.thread_abort:
+				raise Info(lang.getstr("aborted"))
+			odata, clip = self.transform(idata[i:i + chunklen])
+			self._out.append(odata / self.output_scale)
+			self._clip.append(clip)
+			perc = round(min(i + chunklen, numrows) / float(numrows) * 100)
+			if perc > prevperc and self.logfile:
+				self.logfile.write("\r%i%%" % perc)
+				prevperc = perc
+
+	def close(self, raise_exception=True):
+		if self.closed:
+			return
+		if self.logfile:
+			self.logfile.write("\n")
+		self.closed = True
+
+	def exit(self, raise_exception=True):
+		self.close(raise_exception)
+
+	def get_array(self):
+		""" Return output values and clipping flags as NumPy arrays """
+		import numpy
+		if not self._out:
+			return numpy.empty((0, 0)), numpy.empty(0, dtype=bool)
+		if len(self._out) > 1:
+			self._out = [numpy.concatenate(self._out)]
+			self._clip = [numpy.concatenate(self._clip)]
+		return self._out[0], self._clip[0]
+
+	def get(self, raw=False, get_clip=False, output_format=None,
+			reverse=False):
+		import numpy
+		odata, clip = self.get_array()
+		if reverse:
+			odata = odata[:, ::-1]
+		if raw:
+			# Same line format as xicclu/icclu output
+			self.output = []
+			if self.verbose:
+				idata = numpy.concatenate(self._in) if self._in else []
+				incs = self.transform.input_colorspace
+				outcs = self.transform.output_colorspace
+			for i, row in enumerate(odata * self.raw_scale):
+				line = " ".join("%f" % v for v in row)
+				if self.verbose:
+					line = "%s [%s] -> %s [%s]" % (" ".join("%f" % v for v in
+															idata[i]), incs,
+												   line, outcs)
+					if clip[i]:
+						line += " (clip)"
+				self.output.append(line + "\n")
+			return self.output
+		if output_format:
+			fmt, maxv = output_format
+			odata = (odata / float(self.scale) * maxv).round().astype(fmt)
+			return [row.tobytes() for row in odata]
+		parsed = odata.tolist()
+		if get_clip:
+			for row, clipped in zip(parsed, clip.tolist()):
+				row.append(clipped)
+		return parsed
+
+
+def get_xicclu(profile, intent="r", direction="f", order="n", pcs=None,
+			   scale=1, cwd=None, startupinfo=None, use_icclu=False,
+			   use_cam_clipping=False, logfile=None, worker=None,
+			   show_actual_if_clipped=False, input_encoding=None,
+			   output_encoding=None, convert_video_rgb_to_clut65=False,
+			   verbose=1, persistent=False):
+	"""
+	Return a NativeXicclu instance if possible, otherwise Xicclu
+	
+	Arguments are the same as for Xicclu. If persistent is True, return
+	PersistentXicclu instead of Xicclu.
+	
+	"""
+	args = (profile, intent, direction, order, pcs, scale, cwd, startupinfo,
+			use_icclu, use_cam_clipping, logfile, worker,
+			show_actual_if_clipped, input_encoding, output_encoding,
+			convert_video_rgb_to_clut65, verbose)
+	try:
+		return NativeXicclu(*args)
+	except ImportError:
+		# No numpy
+		pass
+	except NotImplementedError as exception:
+		if debug or verbose > 1:
+			safe_print("Using %s, in-process lookup not possible:" %
+					   ("icclu" if use_icclu else "xicclu"), exception)
+	if persistent and PersistentXicclu.probe(use_icclu, cwd, startupinfo):
+		return PersistentXicclu(*args)
+	return Xicclu(*args)
+
+
+class XiccluPool(object):
+
+	"""
+	LRU pool of warm lookup workers (NativeXicclu or PersistentXicclu)
+	
+	Workers are keyed by profile ID, intent, direction, pcs and order (plus
+	the remaining Xicclu options, see get_key). acquire() hands out a worker
+	for exclusive use, release() puts it back. When more than maxsize
+	workers are idle, the least recently used ones are ended.
+	
+	"""
+
+	def __init__(self, maxsize=8):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self._idle = OrderedDict()
+		self._lock = threading.Lock()
+		self._pid = os.getpid()
+
+	def get_key(self, profile, intent="r", direction="f", order="n",
+				pcs=None, scale=1, cwd=None, startupinfo=None,
+				use_icclu=False, use_cam_clipping=False, logfile=None,
+				worker=None, show_actual_if_clipped=False,
+				input_encoding=None, output_encoding=None,
+				convert_video_rgb_to_clut65=False, verbose=1):
+		"""
+		Return the pool key for Xicclu arguments, or None if not poolable
+		
+		The returned key doesn't tell whether the worker will be an
+		in-process NativeXicclu or a PersistentXicclu, so xicclu is only
+		probed by the factory when needed (see get_xicclu). Only profiles
+		which exist as file can be pooled. Profile objects are
+		identified by path and the checksum of their current contents (the
+		header ID isn't updated when tags change). Profiles given as
+		filename are identified by path, size and modification time instead
+		of ID to avoid parsing them.
+		
+		"""
+		if show_actual_if_clipped:
+			# Number of output lines per input row is not fixed
+			return
+		if isinstance(profile, ICCP.ICCProfile):
+			if not profile.fileName or not os.path.isfile(profile.fileName):
+				return
+			profile_id = (os.path.abspath(profile.fileName),
+						  profile.calculateID(False))
+		elif (isinstance(profile, str) and
+			  not profile.lower().endswith(".cal") and
+			  os.path.isfile(profile)):
+			stat = os.stat(profile)
+			profile_id = (os.path.abspath(profile), stat.st_size,
+						  stat.st_mtime)
+		else:
+			return
+		return (profile_id, intent, direction, pcs, order, scale, use_icclu,
+				use_cam_clipping, input_encoding, output_encoding,
+				convert_video_rgb_to_clut65, verbose)
+
+	def acquire(self, key, factory):
+		"""
+		Return an idle worker for key, or a new one created by factory()
+		
+		"""
+		with self._lock:
+			if self._pid != os.getpid():
+				# Forked. Workers belong to the parent process
+				self._idle = OrderedDict()
+				self._pid = os.getpid()
+			workers = self._idle.get(key)
+			if workers:
+				worker = workers.pop()
+				if not workers:
+					del self._idle[key]
+				self.hits += 1
+			else:
+				worker = None
+				self.misses += 1
+		if worker:
+			worker.spawn()
+		else:
+			worker = factory()
+			worker.pool_key = key
+		return worker
+
+	def release(self, worker):
+		""" Return a worker to the pool """
+		if not isinstance(worker, (NativeXicclu, PersistentXicclu)):
+			# Plain Xicclu (output can't be read back without ending the
+			# child process, see PersistentXicclu.probe)
+			worker.exit(raise_exception=False)
+			return
+		worker.logfile = None
+		worker.worker = None
+		evicted = []
+		with self._lock:
+			key = worker.pool_key
+			workers = self._idle.pop(key, [])
+			workers.append(worker)
+			# Re-insert to mark key as most recently used
+			self._idle[key] = workers
+			count = sum(len(workers) for workers in self._idle.values())
+			while count > self.maxsize:
+				lru_key = next(iter(self._idle))
+				evicted.append(self._idle[lru_key].pop(0))
+				if not self._idle[lru_key]:
+					del self._idle[lru_key]
+				count -= 1
+		for worker in evicted:
+			worker.exit(raise_exception=False)
+
+	def clear(self):
+		""" End all idle workers """
+		with self._lock:
+			if self._pid != os.getpid():
+				self._idle = OrderedDict()
+				return
+			workers = [worker for workers in self._idle.values()
+					   for worker in workers]
+			self._idle = OrderedDict()
+		for worker in workers:
+			worker.exit(raise_exception=False)
+
+
+xicclu_pool = XiccluPool()
+atexit.register(xicclu_pool.clear)
+
+
 class MP_Xicclu(Xicclu):
 
 	def __init__(self, profile, intent="r", direction="f", order="n",
@@ -792,6 +1518,7 @@ class MP_Xicclu(Xicclu):
 		self.logfile = logfile
 		self.worker = worker
 		self.output_stream = output_stream
+		self.output_format = output_format
 		self._in = []
 		self._args = (profile.fileName, intent, direction, order,
 					  pcs, scale, cwd, startupinfo, use_icclu,
@@ -827,13 +1554,25 @@ class MP_Xicclu(Xicclu):
 		pass
 
 	def get(self):
-
-		for slices in pool_slice(_mp_xicclu, self._in, self._args, {},
+		# Persistent workers keep their parsed profiles and lookup processes
+		# (see XiccluPool) between calls
+		for slices in pool_slice(_mp_xicclu, self._in, self._args,
+								 {"pipe_roundtrip":
+								  PersistentXicclu.pipe_roundtrip},
 								 self.num_workers, self.thread_abort,
-								 self.logfile, num_batches=self.num_batches):
-			if self.output_stream:
+								 self.logfile, num_batches=self.num_batches,
+								 persistent=True):
+			if self.output_format:
+				# Packed binary output
+				if self.output_stream:
+					self.output_stream.write(slices)
+				else:
+					self._out.append(slices)
+			elif self.output_stream:
 				for row in slices:
 					self.output_stream.write(row)
 			else:
 				self._out.extend(slices)
+		if self.output_format:
+			return b"".join(self._out)
 		return self._out
@@ -40,6 +40,28 @@ FGCOLOUR = wx.Colour(0x99, 0x99, 0x99)
 
 CRT = True
 
+
+def _compile(pattern):
+	# Spaces in patterns match any amount of whitespace in Argyll output
+	return re.compile(pattern.replace(" ", r"\s+"), re.I)
+
+
+# Interactive display adjustment output (dispcal -m)
+TARGET_BR_RE = _compile("Target white brightness = (\d+(?:\.\d+)?)")
+TARGET_BL_RE = _compile("Target Near Black = (\d+(?:\.\d+)?), Current = (\d+(?:\.\d+)?)")
+INITIAL_BR_RE = _compile("(Initial|Target)(?: Br)? (\d+(?:\.\d+)?)\s*(?:, x (\d+(?:\.\d+)?)\s*, y (\d+(?:\.\d+)?)(?:\s*, (?:(V[CD]T \d+K?) )?DE(?: 2K)? (\d+(?:\.\d+)?))?|$)")
+CURRENT_BR_RE = _compile("Current(?: Br)? (\d+(?:\.\d+)?)")
+CHECK_ALL_CURRENT_BR_RE = _compile("Target Brightness = (?:\d+(?:\.\d+)?), Current = (\d+(?:\.\d+)?)")
+CURRENT_BRIGHTNESS_RE = _compile("Current Brightness = (\d+(?:\.\d+)?)")
+BLACK_XYZ_RE = _compile("Black = XYZ (?:\d+(?:\.\d+)?) (\d+(?:\.\d+)?) (?:\d+(?:\.\d+)?)")
+XY_DE_RGB_RE = _compile("x (\d+(?:\.\d+)?)[=+-]*, y (\d+(?:\.\d+)?)[=+-]*,? (?:(V[CD]T \d+K?) )?DE(?: 2K)? (\d+(?:\.\d+)?) R([=+-]+) G([=+-]+) B([=+-]+)")
+_XY_DE_RE = "(?:Target white = x (?:\d+(?:\.\d+)?), y (?:\d+(?:\.\d+)?), Current|Current white) = x (\d+(?:\.\d+)?), y (\d+(?:\.\d+)?), (?:(?:(V[CD]T \d+K?) )?DE(?: 2K)?|error =) (\d+(?:\.\d+)?)"
+WHITE_XY_DE_RE = _compile(_XY_DE_RE)
+BLACK_XY_DE_RE = _compile(_XY_DE_RE.replace("white", "black"))
+WHITE_XY_TARGET_RE = _compile("Target white = x (\d+(?:\.\d+)?), y (\d+(?:\.\d+)?)")
+BLACK_XY_TARGET_RE = _compile("Target black = x (\d+(?:\.\d+)?), y (\d+(?:\.\d+)?)")
+
+
 def get_panel(parent, size=wx.DefaultSize):
 	scale = max(getcfg("app.dpi") / get_default_dpi(), 1.0)
 	size = tuple(int(round(v * scale)) for v in size)
@@ -1115,12 +1137,12 @@ class DisplayAdjustmentFrame(windowcls):
 		else:
 			indicator = getbitmap("theme/icons/10x10/record_outline")
 		
-		target_br = re.search("Target white brightness = (\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
+		target_br = TARGET_BR_RE.search(txt)
 		if getcfg("measurement_mode") == "c":
-			target_bl = re.search("Target Near Black = (\d+(?:\.\d+)?), Current = (\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
+			target_bl = TARGET_BL_RE.search(txt)
 			if target_bl:
 				self.lb.GetCurrentPage().target_bl = ["Target", float(target_bl.groups()[0])]
-		initial_br = re.search("(Initial|Target)(?: Br)? (\d+(?:\.\d+)?)\s*(?:, x (\d+(?:\.\d+)?)\s*, y (\d+(?:\.\d+)?)(?:\s*, (?:(V[CD]T \d+K?) )?DE(?: 2K)? (\d+(?:\.\d+)?))?|$)".replace(" ", "\s+"), txt, re.I)
+		initial_br = INITIAL_BR_RE.search(txt)
 		current_br = None
 		current_bl = None
 		if target_br and not getattr(self, "target_br", None):
@@ -1129,24 +1151,23 @@ class DisplayAdjustmentFrame(windowcls):
 			self.lb.GetCurrentPage().initial_br = [initial_br.groups()[0],
 												   float(initial_br.groups()[1])] + list(initial_br.groups()[2:])
 		if self.lb.GetCurrentPage().ctrltype != "check_all":
-			current_br = re.search("Current(?: Br)? (\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
+			current_br = CURRENT_BR_RE.search(txt)
 		else:
-			current_br = re.search("Target Brightness = (?:\d+(?:\.\d+)?), Current = (\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
+			current_br = CHECK_ALL_CURRENT_BR_RE.search(txt)
 			if not current_br:
-				current_br = re.search("Current Brightness = (\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
+				current_br = CURRENT_BRIGHTNESS_RE.search(txt)
 			if getcfg("measurement_mode") == "c":
 				if target_bl:
 					current_bl = float(target_bl.groups()[1])
 			else:
-				current_bl = re.search("Black = XYZ (?:\d+(?:\.\d+)?) (\d+(?:\.\d+)?) (?:\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
+				current_bl = BLACK_XYZ_RE.search(txt)
 				if current_bl:
 					current_bl = float(current_bl.groups()[0])
-		xy_dE_rgb = re.search("x (\d+(?:\.\d+)?)[=+-]*, y (\d+(?:\.\d+)?)[=+-]*,? (?:(V[CD]T \d+K?) )?DE(?: 2K)? (\d+(?:\.\d+)?) R([=+-]+) G([=+-]+) B([=+-]+)".replace(" ", "\s+"), txt, re.I)
-		white_xy_dE_re = "(?:Target white = x (?:\d+(?:\.\d+)?), y (?:\d+(?:\.\d+)?), Current|Current white) = x (\d+(?:\.\d+)?), y (\d+(?:\.\d+)?), (?:(?:(V[CD]T \d+K?) )?DE(?: 2K)?|error =) (\d+(?:\.\d+)?)".replace(" ", "\s+")
-		white_xy_dE = re.search(white_xy_dE_re, txt, re.I)
-		black_xy_dE = re.search(white_xy_dE_re.replace("white", "black"), txt, re.I)
-		white_xy_target = re.search("Target white = x (\d+(?:\.\d+)?), y (\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
-		black_xy_target = re.search("Target black = x (\d+(?:\.\d+)?), y (\d+(?:\.\d+)?)".replace(" ", "\s+"), txt, re.I)
+		xy_dE_rgb = XY_DE_RGB_RE.search(txt)
+		white_xy_dE = WHITE_XY_DE_RE.search(txt)
+		black_xy_dE = BLACK_XY_DE_RE.search(txt)
+		white_xy_target = WHITE_XY_TARGET_RE.search(txt)
+		black_xy_target = BLACK_XY_TARGET_RE.search(txt)
 		if current_br or current_bl or xy_dE_rgb or white_xy_dE or black_xy_dE:
 			self.Freeze()
 		#for t in ("target_br", "target_bl", "initial_br", "current_br", "current_bl"):
@@ -25,6 +25,7 @@ from wxMeasureFrame import MeasureFrame
 from wxwindows import (BaseApp, BaseFrame, FlatShadedButton,
 					   numpad_keycodes, nav_keycodes, processing_keycodes,
 					   wx_Panel)
+import argyll_output
 import colormath
 import config
 import localization as lang
@@ -32,6 +33,10 @@ import report
 
 BGCOLOUR = wx.Colour(0x33, 0x33, 0x33)
 
+CT_RE = dict((locus, re.compile(r"Closest\s+%s\s+temperature\s+=\s+(\d+)K" %
+								locus, re.I))
+			 for locus in ("Daylight", "Planckian"))
+
 
 class FlatShadedNumberedButton(FlatShadedButton):
 	
@@ -278,15 +283,14 @@ class DisplayUniformityFrame(BaseFrame):
 			#							CCT = ddddK (Delta E d.dddddd)
 			# Closest Planckian temperature = ddddK (Delta E d.dddddd)
 			# Closest Daylight temperature  = ddddK (Delta E d.dddddd)
-			XYZ = re.search("XYZ:\s+(\d+\.\d+)\s+(\d+\.\d+)\s+(\d+\.\d+)", txt)
+			XYZ = argyll_output.XYZ_RE.search(txt)
 			self.results[self.index].append({"XYZ": [float(value) for value in
 													 XYZ.groups()]})
 			self.last_error = None
 		loci = {"t": "Daylight", "T": "Planckian"}
 		for locus in list(loci.values()):
 			if locus in txt:
-				CT = re.search("Closest\s+%s\s+temperature\s+=\s+(\d+)K" % locus,
-							   txt, re.I)
+				CT = CT_RE[locus].search(txt)
 				self.results[self.index][-1]["C%sT" % locus[0]] = int(CT.groups()[0])
 		if "key to take a reading" in txt and not self.last_error:
 			safe_print("%s: Got 'key to take a reading'" % appname)
@@ -345,7 +345,8 @@ class GamutCanvas(LUTCanvas):
 			raise cwd
 		
 		if not profiles:
-			profiles = [ICCP.ICCProfile(get_data_path("ref/sRGB.icm")),
+			profiles = [ICCP.ICCProfile(get_data_path("ref/sRGB.icm"),
+											use_mmap=True),
 						get_display_profile()]
 		for i, profile in enumerate(profiles):
 			if profile_no is not None and i != profile_no:
@@ -763,7 +764,7 @@ class GamutViewOptions(wx_Panel):
 
 	def comparison_profile_drop_handler(self, path):
 		try:
-			profile = ICCP.ICCProfile(path)
+			profile = ICCP.ICCProfile(path, use_mmap=True)
 		except Exception as exception:
 			show_result_dialog(exception, self.TopLevelParent)
 		else:
@@ -1201,7 +1202,7 @@ class ProfileInfoFrame(LUTFrame):
 	def LoadProfile(self, profile, reset=True):
 		if not isinstance(profile, ICCP.ICCProfile):
 			try:
-				profile = ICCP.ICCProfile(profile)
+				profile = ICCP.ICCProfile(profile, use_mmap=True)
 			except (IOError, ICCP.ICCProfileInvalidError) as exception:
 				show_result_dialog(Error(lang.getstr("profile.invalid") + 
 									     "\n" + profile), self)
@@ -1660,7 +1661,7 @@ class ProfileInfoFrame(LUTFrame):
 			if result != wx.ID_OK:
 				return
 			try:
-				profile = ICCP.ICCProfile(path)
+				profile = ICCP.ICCProfile(path, use_mmap=True)
 			except (IOError, ICCP.ICCProfileInvalidError) as exception:
 				show_result_dialog(Error(lang.getstr("profile.invalid") + "\n" +
 										 path), self)
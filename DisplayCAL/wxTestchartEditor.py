@@ -1531,8 +1531,8 @@ END_DATA""")
 							  "XYZ_X", "XYZ_Y", "XYZ_Z"):
 					entry[label] = round(dataset.DATA[i][label], 4)
 				newdata.append(entry)
-			self.tc_add_data(row, newdata)
-			self.grid.select_row(row + len(newdata))
+			count = self.tc_add_data(row, newdata, unique=True)
+			self.grid.select_row(row + count)
 	
 	def tc_add_ti3(self, chart, img=None, use_gamut=True, profile=None):
 		if img:
@@ -2189,6 +2189,7 @@ END_DATA""")
 					  7: 1023}[filter_index]
 		is_winnt6 = sys.platform == "win32" and sys.getwindowsversion() >= (6, )
 		use_winnt6_symlinks = is_winnt6 and is_superuser()
+		sRGB2XYZ = colormath.ColorSpaceTransform(scale=100.0)
 		for i in range(maxlen):
 			if self.worker.thread_abort:
 				break
@@ -2206,8 +2207,7 @@ END_DATA""")
 				target.writerow([str(v) for v in [i, R, G, B]])
 				continue
 			# Image format
-			X, Y, Z = colormath.RGB2XYZ(R / 100.0, G / 100.0, B / 100.0,
-										scale=100.0)
+			X, Y, Z = sRGB2XYZ(R / 100.0, G / 100.0, B / 100.0)
 			L, a, b = colormath.XYZ2Lab(X, Y, Z)
 			# XXX: Careful when rounding floats!
 			# Incorrect: int(round(50 * 2.55)) = 127 (127.499999)
@@ -3189,29 +3189,30 @@ END_DATA""")
 		if self.Parent and hasattr(self.Parent, "start_timers"):
 			self.Parent.start_timers()
 	
-	def tc_add_data(self, row, newdata):
+	def tc_add_data(self, row, newdata, unique=False):
+		"""
+		Insert newdata after row and return the number of inserted patches.
+		
+		If unique is True, patches whose RGB values are already in the chart
+		are omitted.
+		
+		"""
+		data = self.ti1.queryv1("DATA")
+		if unique:
+			unique_fields = ("RGB_R", "RGB_G", "RGB_B")
+		else:
+			unique_fields = None
+		newdata = data.insert_samples(newdata, row + 1, unique_fields)
+		if not newdata:
+			return 0
 		self.grid.BeginBatch()
 		self.grid.InsertRows(row + 1, len(newdata))
-		data = self.ti1.queryv1("DATA")
 		if hasattr(self, "preview"):
 			self.preview.BeginBatch()
-		data_format = self.ti1.queryv1("DATA_FORMAT")
-		data.moveby1(row + 1, len(newdata))
-		for i in range(len(newdata)):
-			dataset = CGATS.CGATS()
-			for label in data_format.values():
-				if not label in newdata[i]:
-					newdata[i][label] = 0.0
-				dataset[label] = newdata[i][label]
-			dataset.key = row + 1 + i
-			dataset.parent = data
-			dataset.root = data.root
-			dataset.type = 'SAMPLE'
-			data[dataset.key] = dataset
+		for i, sample in enumerate(newdata):
 			for label in ("RGB_R", "RGB_G", "RGB_B"):
 				for col in range(self.grid.GetNumberCols()):
 					if self.label_b2a.get(self.grid.GetColLabelValue(col)) == label:
-						sample = newdata[i]
 						self.grid.SetCellValue(row + 1 + i, col,
 											   CGATS.rpad(sample[label],
 														  data.vmaxlen + 
@@ -3230,6 +3231,7 @@ END_DATA""")
 		self.tc_save_check()
 		if hasattr(self, "preview"):
 			self.preview.EndBatch()
+		return len(newdata)
 
 	def tc_grid_setcolorlabel(self, row, data=None):
 		grid = self.grid
@@ -8,7 +8,6 @@ Interactive display calibration UI
 
 import math
 import os
-import re
 import sys
 import time
 
@@ -23,6 +22,7 @@ from wxwindows import (BaseApp, BaseFrame, BitmapBackgroundPanel, CustomCheckBox
 					   CustomGrid, FlatShadedButton, numpad_keycodes,
 					   nav_keycodes, processing_keycodes, wx_Panel)
 import CGATS
+import argyll_output
 import audio
 import colormath
 import config
@@ -483,8 +483,7 @@ class UntetheredFrame(BaseFrame):
 			if getcfg("measurement.play_sound"):
 				self.measurement_sound.safe_play()
 			# Result is XYZ: d.dddddd d.dddddd d.dddddd, D50 Lab: d.dddddd d.dddddd d.dddddd
-			XYZ = re.search("XYZ:\s+(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)",
-							txt)
+			XYZ = argyll_output.XYZ_RE.search(txt)
 			if not XYZ:
 				return
 			XYZ = [float(v) for v in XYZ.groups()]
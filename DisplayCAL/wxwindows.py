@@ -36,7 +36,7 @@ from log import log as log_, safe_print
 from meta import name as appname
 from options import debug
 from ordereddict import OrderedDict
-from network import ScriptingClientSocket, get_network_addr
+from network import ScriptingClientSocket, ScriptingHost, get_network_addr
 from util_io import StringIOu as StringIO
 from util_os import get_program_file, launch_file, waccess
 from util_str import box, safe_str, safe_unicode, wrap
@@ -905,10 +905,25 @@ class BaseFrame(wx.Frame):
 				except socket.error:
 					pass
 			safe_print(lang.getstr("app.listening", (addr, port)))
-			self.listening = True
-			self.listener = threading.Thread(target=self.connection_handler,
-											 name="ScriptingHost.ConnectionHandler")
-			self.listener.start()
+			commands = set(command.split()[0] for command in
+						   self.get_commands())
+			self.scripting_host = ScriptingHost(sys._appsocket,
+												self.connection_handler,
+												self.message_handler,
+												self.disconnect_handler,
+												commands=commands)
+			self.scripting_host.start()
+
+	def _get_listening(self):
+		scripting_host = getattr(self, "scripting_host", None)
+		return bool(scripting_host and scripting_host.running)
+
+	def _set_listening(self, listening):
+		scripting_host = getattr(self, "scripting_host", None)
+		if scripting_host and not listening:
+			scripting_host.stop()
+
+	listening = property(_get_listening, _set_listening)
 
 	def connect(self, ip, port):
 		if getattr(self, "conn", None):
@@ -922,167 +937,142 @@ class BaseFrame(wx.Frame):
 			return exception
 		return conn
 
-	def connection_handler(self):
+	def connection_handler(self, conn, addrport):
 		""" Handle socket connections """
-		self._msghandlercount = 0
-		while self and getattr(self, "listening", False):
-			try:
-				# Wait for connection
-				conn, addrport = sys._appsocket.accept()
-			except socket.timeout:
-				continue
-			except socket.error as exception:
-				if exception.errno == errno.EWOULDBLOCK:
-					sleep(.05)
-					continue
-				break
-			if (addrport[0] != "127.0.0.1" and
-				not getcfg("app.allow_network_clients")):
-				# Network client disallowed
-				conn.close()
-				safe_print(lang.getstr("app.client.network.disallowed", addrport))
-				sleep(.2)
-				continue
-			try:
-				conn.settimeout(.2)
-			except socket.error as exception:
-				conn.close()
-				safe_print(lang.getstr("app.client.ignored", exception))
-				sleep(.2)
-				continue
-			safe_print(lang.getstr("app.client.connect", addrport))
-			self._msghandlercount += 1
-			threading.Thread(target=self.message_handler,
-							 name="ScriptingHost.MessageHandler-%d" %
-								  self._msghandlercount,
-							 args=(conn, addrport)).start()
-		sys._appsocket.close()
-
-	def message_handler(self, conn, addrport):
-		""" Handle messages sent via socket """
+		if (addrport[0] != "127.0.0.1" and
+			not getcfg("app.allow_network_clients")):
+			# Network client disallowed
+			safe_print(lang.getstr("app.client.network.disallowed", addrport))
+			return False
+		safe_print(lang.getstr("app.client.connect", addrport))
 		responseformats[conn] = "plain"
-		buffer = ""
-		while self and getattr(self, "listening", False):
-			# Wait for incoming message
-			try:
-				incoming = conn.recv(4096)
-			except socket.timeout:
-				continue
-			except socket.error as exception:
-				if exception.errno == errno.EWOULDBLOCK:
-					sleep(.05)
-					continue
-				break
+
+	def disconnect_handler(self, conn):
+		safe_print(lang.getstr("app.client.disconnect", conn.addrport))
+		responseformats.pop(conn, None)
+
+	def message_handler(self, conn, line, received):
+		""" Handle a message sent via socket """
+		if not self or not getattr(self, "listening", False):
+			return
+		command_timestamp = datetime.now().strftime("%Y-%m-%dTH:%M:%S.%f")
+		line = safe_unicode(line, "UTF-8")
+		safe_print(lang.getstr("app.incoming_message",
+							   conn.addrport + (line, )))
+		data = split_command_line(line)
+		conn.begin_command(data, received)
+		response = None
+		# Non-UI commands
+		if data[0] == "getappname" and len(data) == 1:
+			response = pyname
+		elif data[0] == "getcfg" and len(data) < 3:
+			if len(data) == 2:
+				# Return cfg value
+				if data[1] in defaults:
+					if responseformats[conn].startswith("xml"):
+						response = {"name": data[1],
+									"value": getcfg(data[1])}
+					else:
+						response = {data[1]: getcfg(data[1])}
+				else:
+					response = "invalid"
 			else:
-				if not incoming:
-					break
-				buffer += incoming
-				while "\n" in buffer and self and getattr(self, "listening", False):
-					end = buffer.find("\n")
-					line = buffer[:end].strip()
-					buffer = buffer[end + 1:]
-					if line:
-						command_timestamp = datetime.now().strftime("%Y-%m-%dTH:%M:%S.%f")
-						line = safe_unicode(line, "UTF-8")
-						safe_print(lang.getstr("app.incoming_message",
-											   addrport + (line, )))
-						data = split_command_line(line)
-						response = None
-						# Non-UI commands
-						if data[0] == "getappname" and len(data) == 1:
-							response = pyname
-						elif data[0] == "getcfg" and len(data) < 3:
-							if len(data) == 2:
-								# Return cfg value
-								if data[1] in defaults:
-									if responseformats[conn].startswith("xml"):
-										response = {"name": data[1],
-													"value": getcfg(data[1])}
-									else:
-										response = {data[1]: getcfg(data[1])}
-								else:
-									response = "invalid"
-							else:
-								# Return whole cfg
-								if responseformats[conn] != "plain":
-									response = []
-								else:
-									response = OrderedDict()
-								for name in sorted(defaults):
-									value = getcfg(name, False)
-									if value is not None:
-										if responseformats[conn] != "plain":
-											response.append({"name": name,
-															 "value": value})
-										else:
-											response[name] = value
-						elif data[0] == "getcommands" and len(data) == 1:
-							response = sorted(self.get_commands())
-						elif data[0] == "getdefault" and len(data) == 2:
-							if data[1] in defaults:
-								if responseformats[conn] != "plain":
-									response = {"name": data[1],
-												"value": defaults[data[1]]}
-								else:
-									response = {data[1]: defaults[data[1]]}
-							else:
-								response = "invalid"
-						elif data[0] == "getdefaults" and len(data) == 1:
-							if responseformats[conn] != "plain":
-								response = []
-							else:
-								response = OrderedDict()
-							for name in sorted(defaults):
-								if responseformats[conn] != "plain":
-									response.append({"name": name,
-													 "value": defaults[name]})
-								else:
-									response[name] = defaults[name]
-						elif data[0] == "getvalid" and len(data) == 1:
-							if responseformats[conn] != "plain":
-								response = {}
-								for section, options in (("ranges",
-														  config.valid_ranges),
-														 ("values",
-														  config.valid_values)):
-									valid = response[section] = []
-									for name, values in options.items():
-										valid.append({"name": name,
-													  "values": values})
-							else:
-								response = {"ranges": config.valid_ranges,
-											"values": config.valid_values}
-							if responseformats[conn] == "plain":
-								valid = []
-								for section, options in response.items():
-									valid.append("[%s]" % section)
-									for name, values in options.items():
-										valid.append("%s = %s" %
-													 (name,
-													  " ".join(demjson.encode(value)
-															   for value in values)))
-								response = valid
-						elif (data[0] == "setresponseformat" and
-							  len(data) == 2 and
-							  data[1] in ("json", "json.pretty", "plain", "xml",
-										  "xml.pretty")):
-							responseformats[conn] = data[1]
-							response = "ok"
-						if response is not None:
-							self.send_response(response, data, conn,
-											   command_timestamp)
-							continue
-						# UI commands
-						wx.CallAfter(self.finish_processing, data, conn,
-									 command_timestamp)
+				# Return whole cfg
+				if responseformats[conn] != "plain":
+					response = []
+				else:
+					response = OrderedDict()
+				for name in sorted(defaults):
+					value = getcfg(name, False)
+					if value is not None:
+						if responseformats[conn] != "plain":
+							response.append({"name": name,
+											 "value": value})
+						else:
+							response[name] = value
+		elif data[0] == "getcommands" and len(data) == 1:
+			response = sorted(self.get_commands())
+		elif data[0] == "getdefault" and len(data) == 2:
+			if data[1] in defaults:
+				if responseformats[conn] != "plain":
+					response = {"name": data[1],
+								"value": defaults[data[1]]}
+				else:
+					response = {data[1]: defaults[data[1]]}
+			else:
+				response = "invalid"
+		elif data[0] == "getdefaults" and len(data) == 1:
+			if responseformats[conn] != "plain":
+				response = []
+			else:
+				response = OrderedDict()
+			for name in sorted(defaults):
+				if responseformats[conn] != "plain":
+					response.append({"name": name,
+									 "value": defaults[name]})
+				else:
+					response[name] = defaults[name]
+		elif data[0] == "getlatency" and len(data) == 1:
+			# Per-command latency (count, mean and max milliseconds)
+			latency = self.scripting_host.get_latency()
+			if responseformats[conn] != "plain":
+				response = []
+			else:
+				response = OrderedDict()
+			for name in sorted(latency):
+				count, mean, maximum = latency[name]
+				if responseformats[conn] != "plain":
+					response.append({"name": name, "count": count,
+									 "mean": mean, "max": maximum})
+				else:
+					response[name] = "%i %.3f %.3f" % (count, mean, maximum)
+		elif data[0] == "getvalid" and len(data) == 1:
+			if responseformats[conn] != "plain":
+				response = {}
+				for section, options in (("ranges",
+										  config.valid_ranges),
+										 ("values",
+										  config.valid_values)):
+					valid = response[section] = []
+					for name, values in options.items():
+						valid.append({"name": name,
+									  "values": values})
+			else:
+				response = {"ranges": config.valid_ranges,
+							"values": config.valid_values}
+			if responseformats[conn] == "plain":
+				valid = []
+				for section, options in response.items():
+					valid.append("[%s]" % section)
+					for name, values in options.items():
+						valid.append("%s = %s" %
+									 (name,
+									  " ".join(demjson.encode(value)
+											   for value in values)))
+				response = valid
+		elif (data[0] == "setresponseformat" and
+			  len(data) == 2 and
+			  data[1] in ("json", "json.pretty", "plain", "xml",
+						  "xml.pretty")):
+			responseformats[conn] = data[1]
+			response = "ok"
+		if response is not None:
+			self.send_response(response, data, conn,
+							   command_timestamp)
+			return
+		# UI commands. Hold back the following commands of this connection
+		# until the response has been sent (see send_response) so responses
+		# are sent in order.
+		conn.defer()
+		wx.CallAfter(self._finish_processing, data, conn,
+					 command_timestamp)
+
+	def _finish_processing(self, data, conn, command_timestamp):
 		try:
-			conn.shutdown(socket.SHUT_RDWR)
-		except socket.error as exception:
-			if exception.errno != errno.ENOTCONN:
-				safe_print("Warning - could not shutdown connection:", exception)
-		safe_print(lang.getstr("app.client.disconnect", addrport))
-		conn.close()
-		responseformats.pop(conn)
+			self.finish_processing(data, conn, command_timestamp)
+		except:
+			conn.resume()
+			raise
 
 	def get_app_state(self, format):
 		win = self.get_top_window()
@@ -1140,7 +1130,7 @@ class BaseFrame(wx.Frame):
 				"echo <string>", "exit [force]", "getactivewindow", "getappname",
 				"getcellvalues [window] <grid>", "getcommands",
 				"getcfg [option]", "getdefault <option>", "getdefaults",
-				"getmenus", "getmenuitems [menu]", "getstate",
+				"getlatency", "getmenus", "getmenuitems [menu]", "getstate",
 				"getuielement [window] <element>", "getuielements [window]",
 				"getvalid", "getwindows",
 				"interact [window] <element> [setvalue value]",
@@ -1228,6 +1218,7 @@ class BaseFrame(wx.Frame):
 	def finish_processing(self, data, conn, command_timestamp):
 		if not responseformats.get(conn):
 			# Client connection has broken down in the meantime
+			conn.resume()
 			return
 		state = self.get_app_state("plain")
 		dialog = isinstance(self.get_top_window(), wx.Dialog)
@@ -1722,6 +1713,14 @@ class BaseFrame(wx.Frame):
 				  child or win)
 
 	def send_response(self, response, data, conn, command_timestamp, win=None):
+		try:
+			self._send_response(response, data, conn, command_timestamp, win)
+		finally:
+			# Continue with commands held back by message_handler
+			conn.resume()
+
+	def _send_response(self, response, data, conn, command_timestamp,
+					   win=None):
 		if not responseformats.get(conn):
 			# Client connection has broken down in the meantime
 			return
@@ -1753,9 +1752,11 @@ class BaseFrame(wx.Frame):
 			if isinstance(response, list):
 				response = "\n".join(response)
 		try:
-			conn.sendall("%s\4" % safe_str(response, "UTF-8"))
+			conn.sendall(safe_str(response, "UTF-8") + b"\4")
 		except socket.error as exception:
 			safe_print(exception)
+		else:
+			conn.end_command(data)
 
 	def send_command(self, scripting_host_name_suffix, command):
 		lock_name = appbasename
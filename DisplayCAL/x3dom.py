@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 
+import codecs
 import http.client
 import os
 import re
@@ -510,8 +511,129 @@ Transform {
 	return vrml
 
 
+# VRML preprocessing, applied to complete lines
+_VRML_COMMENT_RE = re.compile("#[^\n\r]*")
+# <class> <Token> { -> <Token> {
+_VRML_CLASS_RE = re.compile("\w+[ \t]+(\w+\s*\{)")
+_VRML_CLASS_TAIL_RE = re.compile("\w+[ \t]+\w+\s*$")
+_VRML_COMMA_RE = re.compile(",\s*")
+_VRML_COMMA_TAIL_RE = re.compile("(?:\s+|#[^\n\r]*)*")
+_VRML_INVALID_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_VRML_SPACES_RE = re.compile(" {2,}")
+# Tokens outside of attribute values: brace or bracket, token, whitespace,
+# line break, invalid character
+_VRML_TOKEN_RE = re.compile(r'([{}\[\]])|([A-Za-z0-9_]+)|([ \t]+)|([\r\n])|(.)',
+							re.S)
+# Tokens inside attribute values: brace or bracket, run of value characters,
+# line break, quote
+_VRML_VALUE_RE = re.compile(r'([{}\[\]])|([^\r\n{}\[\]"]+)|([\r\n])|(")')
+
+
+def _vrml_chunks(vrml, chunksize=1024 * 1024):
+	"""
+	Read VRML from a string or file object in chunks
+	
+	Yield (text, progress) tuples, progress being the fraction of the input
+	that has been read.
+	
+	"""
+	if isinstance(vrml, (bytes, str)):
+		read = lambda: vrml[pos:pos + chunksize]
+		tell = lambda: pos
+		size = len(vrml)
+	else:
+		read = lambda: vrml.read(chunksize)
+		# For compressed files, progress is the position in the
+		# compressed file
+		fileobj = getattr(vrml, "fileobj", None) or vrml
+		tell = fileobj.tell
+		try:
+			size = os.fstat(fileobj.fileno()).st_size
+		except (AttributeError, EnvironmentError):
+			size = 0
+	pos = 0
+	# Multibyte characters may be split across chunks
+	decoder = codecs.getincrementaldecoder("UTF-8")("replace")
+	while True:
+		data = read()
+		if not data:
+			break
+		pos += len(data)
+		if isinstance(data, bytes):
+			data = decoder.decode(data)
+		yield data, min(tell() / float(size or 1), 1.0)
+	data = decoder.decode(b"", True)
+	if data:
+		yield data, 1.0
+
+
+def _vrml_lines(chunks):
+	"""
+	Preprocess VRML chunks
+	
+	Comments and commas are removed and '<class> <Token> {' is replaced
+	with '<Token> {'. Yield (text, progress) tuples, text being complete
+	lines. Lines that may still be changed by the replacements depending
+	on the next chunk are held back.
+	
+	"""
+	carry = ""
+	# Whether the previous text ended in a comma (',\s*' -> ' ' also removes
+	# leading whitespace of the next text)
+	comma = False
+	progress = 0
+	for data, progress in chunks:
+		buf = carry + data
+		if comma:
+			tail = _VRML_COMMA_TAIL_RE.match(buf).end()
+			if tail == len(buf):
+				# Only whitespace and comments (which may be incomplete)
+				carry = buf
+				continue
+			buf = buf[tail:]
+			comma = False
+		cut = buf.rfind("\n") + 1
+		# Hold back lines ending in '<class> <Token>' if they may be followed
+		# by a '{' on one of the next lines
+		pos = cut
+		while pos:
+			start = buf.rfind("\n", 0, pos - 1) + 1
+			line = _VRML_COMMENT_RE.sub("", buf[start:pos])
+			if line.strip():
+				if not _VRML_CLASS_TAIL_RE.search(line):
+					break
+				held = _VRML_COMMENT_RE.sub("", buf[cut:]).lstrip()
+				if held and not held.startswith("{"):
+					break
+				cut = start
+			pos = start
+		if not cut:
+			carry = buf
+			continue
+		carry = buf[cut:]
+		text, comma = _vrml_preprocess(buf[:cut])
+		yield text, progress
+	if comma:
+		carry = carry[_VRML_COMMA_TAIL_RE.match(carry).end():]
+	if carry:
+		text, comma = _vrml_preprocess(carry)
+		yield text, progress
+
+
+def _vrml_preprocess(text):
+	text = _VRML_COMMENT_RE.sub("", text)
+	text = _VRML_CLASS_RE.sub("\\1", text)
+	comma = text.rstrip().endswith(",")
+	return _VRML_COMMA_RE.sub(" ", text), comma
+
+
 def vrml2x3dom(vrml, worker=None):
-	""" Convert VRML to X3D """
+	"""
+	Convert VRML to X3D
+	
+	vrml can be a string or a file object, which is read in chunks.
+	
+	"""
 	x3d = Tag("X3D",  **{"xmlns:xsd": "http://www.w3.org/2001/XMLSchema-instance",
 						 "profile": "Immersive",
 						 "version": "3.0",
@@ -519,106 +641,119 @@ def vrml2x3dom(vrml, worker=None):
 	tag = Tag("Scene")
 	x3d.append_child(tag)
 	token = ""
-	valid_token_chars = string.ascii_letters + string.digits + "_"
 	attribute = False
 	quote = 0
 	listing = False
-	# Remove comments
-	vrml = re.sub("#[^\n\r]*", "", vrml)
-	# <class> <Token> { -> <Token> {
-	vrml = re.sub("\w+[ \t]+(\w+\s*\{)", "\\1", vrml)
-	# Remove commas
-	vrml = re.sub(",\s*", " ", vrml)
 	indent = ""
-	maxi = len(vrml) - 1.0
 	lastprogress = 0
-	for i, c in enumerate(vrml):
-		curprogress = int(i / maxi * 100)
-		if worker:
-			if curprogress > lastprogress:
-				worker.lastmsg.write("%i%%\n" % curprogress)
-			if getattr(worker, "thread_abort", False):
-				return False
-		if curprogress > lastprogress:
-			lastprogress = curprogress
-			if curprogress < 100:
-				end = None
-			else:
-				end = "\n"
-			_safe_print.write("\r%i%%" % curprogress, end=end)
-		if ord(c) < 32 and c not in "\n\r\t":
-			raise VRMLParseError("Parse error: Got invalid character %r" % c)
-		elif c == "{":
-			safe_print(indent, "start tag %r" % token)
-			indent += "  "
-			attribute = False
-			if token:
-				if token[0] not in string.ascii_letters:
-					raise VRMLParseError("Invalid token", token)
+	for text, progress in _vrml_lines(_vrml_chunks(vrml)):
+		invalid = _VRML_INVALID_RE.search(text)
+		if invalid:
+			raise VRMLParseError("Parse error: Got invalid character %r" %
+								 invalid.group())
+		pos = 0
+		length = len(text)
+		while pos < length:
+			if attribute:
+				match = _VRML_VALUE_RE.match(text, pos)
 			else:
-				raise VRMLParseError("Parse error: Empty token")
-			child = Tag(token)
-			tag.append_child(child)
-			tag = child
-			token = ""
-		elif c == "}":
-			attribute = _attrchk(attribute, token, tag, indent)
-			indent = indent[:-2]
-			safe_print(indent, "end tag %r" % tag.tagname)
-			if tag.parent:
-				tag = tag.parent
-			else:
-				raise VRMLParseError("Parse error: Stray '}'")
-			token = ""
-		elif c == "[":
-			if token:
-				safe_print(indent, "listing %r" % token)
-				listing = True
-		elif c == "]":
-			attribute = _attrchk(attribute, token, tag, indent)
-			token = ""
-			listing = False
-		elif attribute:
-			if c in ("\n", "\r"):
-				if listing:
-					if (tag.attributes.get(token) and
-						tag.attributes[token][-1] != " "):
-						tag.attributes[token] += " "
+				match = _VRML_TOKEN_RE.match(text, pos)
+			pos = match.end()
+			c = match.group()
+			kind = match.lastindex
+			if kind == 1:
+				# Brace or bracket
+				if c == "{":
+					safe_print(indent, "start tag %r" % token)
+					indent += "  "
+					attribute = False
+					if token:
+						if token[0] not in string.ascii_letters:
+							raise VRMLParseError("Invalid token", token)
+					else:
+						raise VRMLParseError("Parse error: Empty token")
+					child = Tag(token)
+					tag.append_child(child)
+					tag = child
+					token = ""
+				elif c == "}":
+					attribute = _attrchk(attribute, token, tag, indent)
+					indent = indent[:-2]
+					safe_print(indent, "end tag %r" % tag.tagname)
+					if tag.parent:
+						tag = tag.parent
+					else:
+						raise VRMLParseError("Parse error: Stray '}'")
+					token = ""
+				elif c == "[":
+					if token:
+						safe_print(indent, "listing %r" % token)
+						listing = True
 				else:
 					attribute = _attrchk(attribute, token, tag, indent)
 					token = ""
-			else:
+					listing = False
+			elif attribute:
+				if kind == 3:
+					# Line break
+					if listing:
+						value = tag.attributes.get(token)
+						if value and value[-1][-1] != " ":
+							value.append(" ")
+					else:
+						attribute = _attrchk(attribute, token, tag, indent)
+						token = ""
+					continue
 				if not token in tag.attributes:
 					tag.attributes[token] = StrList()
-				if not (c.strip() or tag.attributes[token]):
-					continue
-				if c == '"':
+				value = tag.attributes[token]
+				if kind == 2:
+					# Whole run of values (e.g. all numbers of a point or
+					# color list) at once, with runs of spaces collapsed
+					if not value:
+						c = c.lstrip()
+					elif value[-1][-1] == " ":
+						c = c.lstrip(" ")
+					if c:
+						value.append(_VRML_SPACES_RE.sub(" ", c))
+				else:
+					# Quote
 					quote += 1
-				if c != '"' or tag.tagname != "FontStyle" or token != "style":
-					if c != " " or (tag.attributes[token] and
-									tag.attributes[token][-1] != " "):
-						tag.attributes[token] += c
-				if quote == 2:
-					if not listing:
-						attribute = _attrchk(attribute, token, tag, indent)
-						token = ""
-					quote = 0
-		elif c not in (" ", "\n", "\r", "\t"):
-			if c in valid_token_chars:
+					if tag.tagname != "FontStyle" or token != "style":
+						value.append(c)
+					if quote == 2:
+						if not listing:
+							attribute = _attrchk(attribute, token, tag, indent)
+							token = ""
+						quote = 0
+			elif kind == 2:
 				token += c
-			else:
+			elif kind == 5:
 				raise VRMLParseError("Parse error: Got invalid character %r" % c)
-		elif token:
-			if token[0] not in string.ascii_letters:
-				raise VRMLParseError("Parse error: Invalid token", token)
-			if token == "children":
-				token = ""
-			elif c in (" ", "\t"):
-				if not attribute:
+			elif token:
+				# Whitespace or line break after token
+				if token[0] not in string.ascii_letters:
+					raise VRMLParseError("Parse error: Invalid token", token)
+				if token == "children":
+					token = ""
+				elif kind == 3:
 					attribute = True
-					if token in tag.attributes:
+					if token in tag.attributes or len(c) > 1:
 						# Overwrite existing attribute
 						tag.attributes[token] = StrList()
+		curprogress = int(progress * 100)
+		if worker:
+			if curprogress > lastprogress:
+				worker.lastmsg.write("%i%%\n" % curprogress)
+			if getattr(worker, "thread_abort", False):
+				return False
+		if curprogress > lastprogress:
+			lastprogress = curprogress
+			if curprogress < 100:
+				end = None
+			else:
+				end = "\n"
+			_safe_print.write("\r%i%%" % curprogress, end=end)
 	return x3d
 
 
@@ -633,15 +768,14 @@ def vrmlfile2x3dfile(vrmlpath, x3dpath, html=True, embed=False, force=False,
 		cls = GzipFileProper
 	else:
 		cls = open
-	with cls(vrmlpath, "rb") as vrmlfile:
-		vrml = vrmlfile.read()
 	if worker:
 		worker.recent.write("%s %s\n" % (lang.getstr("converting"),
 										 os.path.basename(vrmlpath)))
 	_safe_print(lang.getstr("converting"), vrmlpath)
 	filename, ext = os.path.splitext(x3dpath)
 	try:
-		x3d = vrml2x3dom(vrml, worker)
+		with cls(vrmlpath, "rb") as vrmlfile:
+			x3d = vrml2x3dom(vrmlfile, worker)
 		if not x3d:
 			_safe_print(lang.getstr("aborted"))
 			return False
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the Argyll output tokenizer
+
+Run from the repository root with
+python -m unittest discover -s tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), "DisplayCAL"))
+
+try:
+	import argyll_output
+except Exception as exception:
+	import_error = exception
+else:
+	import_error = None
+
+
+@unittest.skipIf(import_error, "Import failed: %s" % import_error)
+class TokenizerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.events = []
+		self.tokenizer = argyll_output.Tokenizer()
+		self.tokenizer.subscribe(lambda event: self.events.append(
+			(event.type, event.groups)))
+
+	def feed(self, *chunks):
+		for chunk in chunks:
+			self.tokenizer.feed(chunk)
+		return self.events
+
+	def test_split_number(self):
+		self.assertEqual(self.feed("\rpatch 12 of 4", "5", "\r"),
+						 [(argyll_output.PATCH, (12, 45))])
+
+	def test_split_count(self):
+		self.assertEqual(self.feed("Number of patches = 1", "00\n"),
+						 [(argyll_output.PATCH_COUNT, (100, ))])
+
+	def test_progress_without_line_break(self):
+		self.feed("\rpatch 1 of 45 ")
+		self.assertEqual(self.events, [(argyll_output.PATCH, (1, 45))])
+		# The next progress line completes the previous one, which must not
+		# emit its event again
+		self.feed("\rpatch 2 of 45 ")
+		self.assertEqual(self.events, [(argyll_output.PATCH, (1, 45)),
+									   (argyll_output.PATCH, (2, 45))])
+
+	def test_prompt_without_line_break(self):
+		# Argyll waits for input after a prompt, so it has to be emitted
+		# before the line is complete
+		self.feed("Hit ESC or Q to exit, any other key to take a reading:")
+		self.assertEqual([event[0] for event in self.events],
+						 [argyll_output.PROMPT])
+
+if __name__ == "__main__":
+	unittest.main()
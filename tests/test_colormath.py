@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the colormath caches
+
+Run from the repository root with
+python -m unittest discover -s tests
+
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), "DisplayCAL"))
+
+import colormath
+
+
+class LRUCacheTest(unittest.TestCase):
+
+	def test_eviction(self):
+		cache = colormath.LRUCache("test", 2)
+		cache["a"] = 1
+		cache["b"] = 2
+		self.assertEqual(cache.get("a"), 1)  # "b" is now the LRU entry
+		cache["c"] = 3
+		self.assertEqual(len(cache), 2)
+		self.assertFalse("b" in cache)
+		self.assertEqual(cache.get("b"), None)
+		self.assertEqual(cache["c"], 3)
+		self.assertRaises(KeyError, lambda: cache["b"])
+		self.assertEqual((cache.hits, cache.misses, cache.evictions),
+						 (2, 2, 1))
+
+	def test_cache_info(self):
+		cache = colormath.LRUCache("test_cache_info", 4)
+		cache["a"] = 1
+		cache.get("a")
+		info = colormath.get_cache_info()["test_cache_info"]
+		self.assertEqual(info["size"], 1)
+		self.assertEqual(info["maxsize"], 4)
+		self.assertEqual(info["hits"], 1)
+		colormath.clear_caches()
+		self.assertEqual(len(cache), 0)
+
+
+class LongTRCTest(unittest.TestCase):
+
+	def setUp(self):
+		colormath.clear_caches()
+		trc = [(i / 4095.0) ** 2.2 for i in range(4096)]
+		self.rgb_space = [[trc, trc, trc], "D65", (0.64, 0.33, 0.2126),
+						  (0.3, 0.6, 0.7152), (0.15, 0.06, 0.0722)]
+
+	def test_key_does_not_copy_trc(self):
+		refs = []
+		key = colormath._cache_key(self.rgb_space[:5], refs)
+		# The TRCs are keyed by identity and kept alive through refs
+		self.assertEqual(len(refs), 3)
+		self.assertTrue(len(repr(key)) < 500)
+
+	def test_cached_lookups(self):
+		misses = colormath.XYZ2RGB.interp.misses
+		start = time.time()
+		for i in range(1000):
+			RGB = colormath.XYZ2RGB(0.2 + i / 10000.0, 0.2, 0.2,
+									self.rgb_space)
+		elapsed = time.time() - start
+		# One Interp instance for the (shared) TRC, re-used for every call
+		self.assertEqual(colormath.XYZ2RGB.interp.misses - misses, 1)
+		RGB_ = colormath.XYZ2RGB(0.2 + 999 / 10000.0, 0.2, 0.2, "sRGB")
+		for v, v_ in zip(RGB, RGB_):
+			self.assertAlmostEqual(v, v_, 1)
+		# Converting the TRCs to cache keys on every call took several
+		# seconds for this
+		self.assertTrue(elapsed < 1, "%.3f seconds" % elapsed)
+
+
+if __name__ == "__main__":
+	unittest.main()
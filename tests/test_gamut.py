@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the in-process gamut volume and coverage calculation
+
+Run from the repository root with
+python -m unittest discover -s tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), "DisplayCAL"))
+
+try:
+	import numpy
+	import config
+	config.initcfg()
+	import ICCProfile as ICCP
+	import gamut
+except Exception as exception:
+	import_error = exception
+else:
+	import_error = None
+
+
+@unittest.skipIf(import_error, "Import failed: %s" % import_error)
+class GamutTest(unittest.TestCase):
+
+	def test_reference_volume(self):
+		# Argyll's volume for the bundled sRGB gamut
+		srgb = gamut.get_reference_gamut("sRGB")
+		self.assertAlmostEqual(srgb.volume / ICCP.GAMUT_VOLUME_SRGB, 1, 4)
+		self.assertAlmostEqual(srgb.intersect_volume() /
+							   ICCP.GAMUT_VOLUME_SRGB, 1, 3)
+
+	def test_srgb_profile(self):
+		profile = ICCP.ICCProfile.from_named_rgb_space("sRGB")
+		volume, coverage = gamut.get_gamut_volume_coverage(profile)
+		self.assertAlmostEqual(volume, 1, 2)
+		self.assertEqual(sorted(coverage),
+						 sorted(key for key, name in gamut.STANDARD_GAMUTS))
+		self.assertAlmostEqual(coverage["srgb"], 1, 2)
+		# sRGB covers about 68.8% of Adobe RGB and 70.8% of DCI P3
+		self.assertAlmostEqual(coverage["adobe-rgb"], .688, 2)
+		self.assertAlmostEqual(coverage["dci-p3"], .708, 2)
+		# Cached result is a copy
+		coverage.clear()
+		self.assertEqual(len(gamut.get_gamut_volume_coverage(profile)[1]), 3)
+
+
+if __name__ == "__main__":
+	unittest.main()
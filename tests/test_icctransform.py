@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare in-process (NumPy) transforms against ArgyllCMS xicclu
+
+Run from the repository root with
+python -m unittest discover -s tests
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), "DisplayCAL"))
+
+try:
+	import numpy
+	import config
+	config.initcfg()
+	import ICCProfile as ICCP
+	import icctransform
+	import worker_base
+except Exception as exception:
+	import_error = exception
+	xicclu = None
+else:
+	import_error = None
+	xicclu = worker_base.get_argyll_util("xicclu")
+
+
+RGB = [[0, 0, 0], [1, 1, 1], [1, 0, 0], [0, 1, 0], [0, 0, 1],
+	   [0.5, 0.5, 0.5], [0.25, 0.75, 0.1], [0.9, 0.2, 0.6]]
+
+
+@unittest.skipIf(import_error, "Import failed: %s" % import_error)
+class NativeTransformTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.profiles = {}
+		for pcs in ("XYZ", "Lab"):
+			profile = ICCP.ICCProfile.from_named_rgb_space("sRGB")
+			profile.connectionColorSpace = pcs
+			profile.setDescription("sRGB %s PCS" % pcs)
+			profile.calculateID()
+			profile.write(os.path.join(self.tempdir, "sRGB_%s.icc" % pcs))
+			self.profiles[pcs] = profile
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def lookup(self, cls, profile, idata, direction="f", pcs=None):
+		xicclu = cls(profile, "r", direction, pcs=pcs)
+		xicclu(idata)
+		xicclu.exit()
+		return numpy.array(xicclu.get())
+
+	def test_pcs_defaults_to_connection_colorspace(self):
+		for pcs, profile in self.profiles.items():
+			transform = icctransform.get_transform(profile, "r", "f")
+			self.assertEqual(transform.output_colorspace, pcs)
+			transform = icctransform.get_transform(profile, "r", "b")
+			self.assertEqual(transform.input_colorspace, pcs)
+
+	def test_lab_pcs_matches_xyz_pcs(self):
+		XYZ = self.lookup(worker_base.NativeXicclu, self.profiles["XYZ"], RGB)
+		Lab = self.lookup(worker_base.NativeXicclu, self.profiles["Lab"], RGB)
+		self.assertTrue(numpy.allclose(icctransform.XYZ2Lab(XYZ), Lab,
+									   atol=1e-6))
+		RGB_ = self.lookup(worker_base.NativeXicclu, self.profiles["Lab"],
+						   Lab, "b")
+		self.assertTrue(numpy.allclose(RGB_, RGB, atol=1e-6))
+
+	def test_raw_output_format(self):
+		xicclu = worker_base.NativeXicclu(self.profiles["XYZ"], "r", "f")
+		xicclu(RGB)
+		xicclu.exit()
+		lines = xicclu.get(raw=True)
+		self.assertEqual(len(lines), len(RGB))
+		self.assertTrue(lines[1].startswith("1.000000 1.000000 1.000000 "
+											"[RGB] -> "))
+		self.assertTrue(lines[1].rstrip().endswith("[XYZ]"))
+		# XYZ output is scaled to 0..100 like xicclu -pX
+		Y = float(lines[1].split("->")[1].split()[1])
+		self.assertAlmostEqual(Y, 100.0, 2)
+
+	@unittest.skipUnless(xicclu, "ArgyllCMS xicclu not found")
+	def test_native_matches_xicclu(self):
+		for pcs, profile in self.profiles.items():
+			for direction, idata in (("f", RGB), ("b", None)):
+				if idata is None:
+					# Inverse lookup of the forward result
+					idata = self.lookup(worker_base.Xicclu, profile,
+										RGB).tolist()
+				argyll = self.lookup(worker_base.Xicclu, profile, idata,
+									 direction)
+				native = self.lookup(worker_base.NativeXicclu, profile,
+									 idata, direction)
+				self.assertEqual(argyll.shape, native.shape)
+				# Lab differences are in dE, XYZ and RGB are 0..1
+				atol = 0.01 if direction == "f" and pcs == "Lab" else 0.0005
+				self.assertTrue(numpy.allclose(argyll, native, atol=atol),
+								"%s PCS %s: max diff %s" %
+								(pcs, direction,
+								 numpy.abs(argyll - native).max()))
+				raw_argyll = worker_base.Xicclu(profile, "r", direction)
+				raw_argyll(idata)
+				raw_argyll.exit()
+				raw_native = worker_base.NativeXicclu(profile, "r",
+													  direction)
+				raw_native(idata)
+				raw_native.exit()
+				lines = [line for line in raw_argyll.get(raw=True)
+						 if "->" in line]
+				for a, n in zip(lines, raw_native.get(raw=True)):
+					self.assertEqual(a.split("[")[1], n.split("[")[1])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the batched log writer
+
+Run from the repository root with
+python -m unittest discover -s tests
+
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), "DisplayCAL"))
+
+try:
+	import log
+	from multiprocess import mp
+except Exception as exception:
+	import_error = exception
+else:
+	import_error = None
+
+
+def _log_and_exit(logger):
+	logger.info("child")
+	# Like multiprocessing children, skip exit handlers
+	os._exit(0)
+
+
+@unittest.skipIf(import_error, "Import failed: %s" % import_error)
+class LogWriterTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.writer = log.LogWriter()
+		self.logger = logging.getLogger("test_log_%s" % id(self))
+		self.logger.propagate = False
+		self.logger.setLevel(logging.INFO)
+
+	def tearDown(self):
+		for handler in list(self.logger.handlers):
+			self.logger.removeHandler(handler)
+		shutil.rmtree(self.tempdir)
+
+	def add_handler(self, cls, filename):
+		filename = os.path.join(self.tempdir, filename)
+		handler = log.QueuedHandler(cls(filename), self.writer)
+		self.logger.addHandler(handler)
+		return handler, filename
+
+	def test_flush(self):
+		handler, filename = self.add_handler(log.FileHandler, "test.log")
+		self.logger.info("message")
+		handler.flush()
+		with open(filename) as logfile:
+			self.assertEqual(logfile.read(), "message\n")
+
+	@unittest.skipUnless(hasattr(os, "fork"), "Needs fork")
+	def test_forked_child(self):
+		handler, filename = self.add_handler(log.FileHandler, "test.log")
+		process = mp.get_context("fork").Process(target=_log_and_exit,
+												 args=(self.logger, ))
+		process.start()
+		process.join()
+		with open(filename) as logfile:
+			self.assertEqual(logfile.read(), "child\n")
+
+	def test_flush_is_bounded(self):
+		release = threading.Event()
+
+		class StuckHandler(log.FileHandler):
+
+			def emit(self, record):
+				release.wait(10)
+
+		handler, filename = self.add_handler(StuckHandler, "stuck.log")
+		self.writer.flush_timeout = .2
+		self.logger.info("message")
+		start = time.time()
+		handler.flush()
+		release.set()
+		self.assertTrue(time.time() - start < 5)
+
+
+if __name__ == "__main__":
+	unittest.main()
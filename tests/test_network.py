@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the pipelined scripting host
+
+Run from the repository root with
+python -m unittest discover -s tests
+
+"""
+
+import os
+import socket
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), "DisplayCAL"))
+
+try:
+	from network import ScriptingHost
+except Exception as exception:
+	import_error = exception
+else:
+	import_error = None
+
+
+@unittest.skipIf(import_error, "Import failed: %s" % import_error)
+class ScriptingHostTest(unittest.TestCase):
+
+	def setUp(self):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.bind(("127.0.0.1", 0))
+		sock.listen(1)
+		self.host = ScriptingHost(sock, lambda conn, addrport: None,
+								  self.message_handler,
+								  commands=["slow", "fast"])
+		self.host.start()
+		self.client = socket.create_connection(sock.getsockname(), 5)
+
+	def tearDown(self):
+		self.client.close()
+		self.host.stop()
+		self.host.thread.join(5)
+
+	def message_handler(self, conn, line, received):
+		data = [line.decode("UTF-8")]
+		conn.begin_command(data, received)
+		if data[0] == "slow":
+			# Respond later from another thread, like UI commands
+			conn.defer()
+			threading.Timer(0.2, self.respond, (conn, data)).start()
+		else:
+			self.respond(conn, data)
+
+	def respond(self, conn, data):
+		try:
+			conn.sendall(data[0].encode("UTF-8") + b"\4")
+			conn.end_command(data)
+		finally:
+			conn.resume()
+
+	def receive(self, count):
+		responses = b""
+		while responses.count(b"\4") < count:
+			incoming = self.client.recv(4096)
+			if not incoming:
+				break
+			responses += incoming
+		return responses.split(b"\4")[:count]
+
+	def test_pipelined_responses_in_order(self):
+		self.client.sendall(b"fast\nslow\nfast\nslow\nunknown\n")
+		self.assertEqual(self.receive(5), [b"fast", b"slow", b"fast", b"slow",
+										   b"unknown"])
+
+	def test_latency_only_for_known_commands(self):
+		self.client.sendall(b"".join(b"cmd%i\n" % i for i in range(20)) +
+							b"fast\n")
+		self.receive(21)
+		latency = self.host.get_latency()
+		self.assertEqual(sorted(latency), ["<other>", "fast"])
+		self.assertEqual(latency["<other>"][0], 20)
+
+
+if __name__ == "__main__":
+	unittest.main()
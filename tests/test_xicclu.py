@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for warm (pooled and persistent) xicclu lookups
+
+Run from the repository root with
+python -m unittest discover -s tests
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+	os.path.abspath(__file__))), "DisplayCAL"))
+
+try:
+	import config
+	config.initcfg()
+	import ICCProfile as ICCP
+	import multiprocess
+	import worker_base
+except Exception as exception:
+	import_error = exception
+	xicclu = None
+else:
+	import_error = None
+	xicclu = worker_base.get_argyll_util("xicclu")
+
+
+def _pid(chunk, thread_abort_event, progress_queue):
+	progress_queue.put(100)
+	return os.getpid()
+
+
+@unittest.skipIf(import_error, "Import failed: %s" % import_error)
+class XiccluPoolTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.profile = ICCP.ICCProfile.from_named_rgb_space("sRGB")
+		self.profile.write(os.path.join(self.tempdir, "sRGB.icc"))
+		self.pool = worker_base.XiccluPool(maxsize=2)
+
+	def tearDown(self):
+		self.pool.clear()
+		shutil.rmtree(self.tempdir)
+
+	def test_get_key_does_not_probe(self):
+		probe = worker_base.PersistentXicclu.probe
+		def fail(*args, **kwargs):
+			raise AssertionError("probe called")
+		worker_base.PersistentXicclu.probe = fail
+		try:
+			key = self.pool.get_key(self.profile.fileName)
+			lookup = self.pool.acquire(key, lambda: worker_base.get_xicclu(
+				self.profile.fileName, persistent=True))
+		finally:
+			worker_base.PersistentXicclu.probe = probe
+		self.assertTrue(isinstance(lookup, worker_base.NativeXicclu))
+		self.pool.release(lookup)
+
+	def test_reuse(self):
+		key = self.pool.get_key(self.profile.fileName)
+		factory = lambda: worker_base.get_xicclu(self.profile.fileName,
+												 persistent=True)
+		first = self.pool.acquire(key, factory)
+		first([[1, 1, 1]])
+		first.close()
+		self.pool.release(first)
+		second = self.pool.acquire(key, factory)
+		self.assertTrue(second is first)
+		self.assertEqual((self.pool.hits, self.pool.misses), (1, 1))
+		second([[0, 0, 0]])
+		second.close()
+		self.assertEqual(len(second.get()), 1)
+		self.pool.release(second)
+
+	@unittest.skipUnless(xicclu, "ArgyllCMS xicclu not found")
+	def test_persistent_child(self):
+		if not worker_base.PersistentXicclu.probe():
+			self.skipTest("xicclu doesn't flush its output")
+		# Video encoding can't be done in-process, so this needs xicclu
+		lookup = worker_base.get_xicclu(self.profile, input_encoding="t",
+										persistent=True)
+		self.assertTrue(isinstance(lookup, worker_base.PersistentXicclu))
+		try:
+			# Blank lines must not end the child
+			lookup("1 1 1\n\n0.5 0.5 0.5\n")
+			lookup.close()
+			self.assertEqual(len(lookup.get()), 2)
+			pid = lookup.subprocess.pid
+			lookup.spawn()
+			lookup([[0, 0, 0]])
+			lookup.close()
+			self.assertEqual(len(lookup.get()), 1)
+			self.assertEqual(lookup.subprocess.pid, pid)
+			self.assertEqual(lookup.subprocess.poll(), None)
+		finally:
+			lookup.exit()
+
+
+@unittest.skipIf(import_error, "Import failed: %s" % import_error)
+class PersistentPoolTest(unittest.TestCase):
+
+	def tearDown(self):
+		multiprocess.shutdown_persistent_pool()
+
+	def test_workers_are_reused(self):
+		data = list(range(8))
+		first = set(multiprocess.pool_slice(_pid, data, num_workers=2,
+											persistent=True))
+		second = set(multiprocess.pool_slice(_pid, data, num_workers=2,
+											 persistent=True))
+		pids = set(process.pid for process in
+				   multiprocess._persistent["pool"]._pool)
+		self.assertFalse(os.getpid() in first)
+		self.assertTrue(first <= pids)
+		self.assertTrue(second <= pids)
+
+
+if __name__ == "__main__":
+	unittest.main()